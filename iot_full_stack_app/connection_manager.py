@@ -0,0 +1,203 @@
+"""
+Connection manager for RabbitMQ.
+Keeps a bounded pool of long-lived connections, hands out one channel per
+thread and counts how often connections are opened, reused from the idle
+pool after a release, and fail.
+"""
+
+import threading
+import time
+
+import pika
+from pika.exceptions import AMQPError
+
+
+class ConnectionStats:
+    """Thread-safe counters describing how the pool is being used."""
+
+    FIELDS = ("opened", "reused", "failed", "closed", "channels_opened", "channels_reused")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(self.FIELDS, 0)
+
+    def increment(self, field):
+        with self._lock:
+            self._counts[field] += 1
+
+    def as_dict(self):
+        """Return a snapshot of all counters."""
+        with self._lock:
+            return dict(self._counts)
+
+    def __repr__(self):
+        return f"ConnectionStats({self.as_dict()})"
+
+
+class ConnectionManager:
+    """
+    Bounded pool of pika BlockingConnections.
+
+    A BlockingConnection is not thread-safe, so every connection is bound to
+    the thread that acquired it until that thread releases it. Calling
+    acquire() again from the same thread returns the same connection, and
+    channel() returns the same channel as long as it stays open.
+    """
+
+    def __init__(self, parameters, max_connections=4, retry_attempts=3,
+                 retry_delay=2.0, acquire_timeout=30.0):
+        """
+        Args:
+            parameters (pika.ConnectionParameters): Parameters used for new connections
+            max_connections (int): Upper bound on open connections in this process
+            retry_attempts (int): How many times to try opening a connection
+            retry_delay (float): Seconds to wait between attempts
+            acquire_timeout (float): Seconds to wait for a free connection when the pool is full
+        """
+        self.parameters = parameters
+        self.max_connections = max_connections
+        self.retry_attempts = retry_attempts
+        self.retry_delay = retry_delay
+        self.acquire_timeout = acquire_timeout
+        self.stats = ConnectionStats()
+
+        self._idle = []
+        self._open_count = 0
+        self._condition = threading.Condition()
+        self._local = threading.local()
+
+    def _open_connection(self):
+        """Open a new connection, retrying on failure."""
+        last_error = None
+        for attempt in range(1, self.retry_attempts + 1):
+            try:
+                connection = pika.BlockingConnection(self.parameters)
+                self.stats.increment("opened")
+                return connection
+            except AMQPError as e:
+                last_error = e
+                self.stats.increment("failed")
+                print(f"RabbitMQ connection attempt {attempt}/{self.retry_attempts} failed: {e}")
+                if attempt < self.retry_attempts:
+                    time.sleep(self.retry_delay)
+        raise last_error
+
+    def _forget(self, connection):
+        """Drop a connection that is closed or about to be closed."""
+        with self._condition:
+            self._open_count -= 1
+            self.stats.increment("closed")
+            self._condition.notify()
+
+    def acquire(self):
+        """
+        Get a connection for the calling thread.
+
+        Returns:
+            pika.BlockingConnection: An open connection owned by this thread
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            # Still held by this thread, not handed back from the pool: not a reuse
+            if connection.is_open:
+                return connection
+            self._local.connection = None
+            self._local.channel = None
+            self._forget(connection)
+
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._condition:
+            while True:
+                # Prefer an idle connection that is still healthy
+                while self._idle:
+                    connection = self._idle.pop()
+                    if connection.is_open:
+                        self.stats.increment("reused")
+                        self._local.connection = connection
+                        return connection
+                    self._open_count -= 1
+                    self.stats.increment("closed")
+
+                if self._open_count < self.max_connections:
+                    # Reserve the slot before releasing the lock to connect
+                    self._open_count += 1
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise RuntimeError(
+                        f"RabbitMQ connection pool exhausted ({self.max_connections} connections in use)"
+                    )
+                self._condition.wait(remaining)
+
+        try:
+            connection = self._open_connection()
+        except Exception:
+            with self._condition:
+                self._open_count -= 1
+                self._condition.notify()
+            raise
+
+        self._local.connection = connection
+        return connection
+
+    def channel(self):
+        """
+        Get a channel for the calling thread, reusing it while it stays open.
+
+        Returns:
+            pika.adapters.blocking_connection.BlockingChannel: An open channel
+        """
+        connection = self.acquire()
+        channel = getattr(self._local, "channel", None)
+        if channel is not None and channel.is_open and channel.connection is connection:
+            self.stats.increment("channels_reused")
+            return channel
+
+        channel = connection.channel()
+        self.stats.increment("channels_opened")
+        self._local.channel = channel
+        return channel
+
+    def release(self):
+        """Return the calling thread's connection to the idle pool."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            return
+        self._local.connection = None
+        self._local.channel = None
+
+        if not connection.is_open:
+            self._forget(connection)
+            return
+
+        with self._condition:
+            self._idle.append(connection)
+            self._condition.notify()
+
+    def discard(self):
+        """Close and drop the calling thread's connection, e.g. after an error."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            return
+        self._local.connection = None
+        self._local.channel = None
+        try:
+            if connection.is_open:
+                connection.close()
+        except AMQPError:
+            pass
+        self._forget(connection)
+
+    def close_all(self):
+        """Close every idle connection and the calling thread's connection."""
+        self.discard()
+        with self._condition:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            try:
+                if connection.is_open:
+                    connection.close()
+            except AMQPError:
+                pass
+            self._forget(connection)
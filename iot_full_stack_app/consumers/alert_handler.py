@@ -1,101 +1,127 @@
 #!/usr/bin/env python
-import json
 from datetime import datetime
 import sys
 import os
 
 # Add parent directory to path to import utils
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils import get_rabbitmq_connection
-
-# Connect to RabbitMQ using CloudAMQP credentials
-connection = get_rabbitmq_connection()
-channel = connection.channel()
-
-# Declare the direct exchange for alerts
-channel.exchange_declare(exchange='sensors.direct', exchange_type='direct')
-
-# Create a queue for alerts
-result = channel.queue_declare(queue='', exclusive=True)
-queue_name = result.method.queue
-
-# Bind the queue to the exchange with the 'alerts' routing key
-channel.queue_bind(
-    exchange='sensors.direct',
-    queue=queue_name,
-    routing_key='alerts'
-)
-
-print("Alert handler started. Waiting for abnormal sensor values. To exit press CTRL+C")
-
-# Define thresholds for alerts
-THRESHOLDS = {
-    "temperature": {"min": 0, "max": 35, "unit": "°C"},
-    "humidity": {"min": 30, "max": 100, "unit": "%"},
-    "soil_moisture": {"min": 250, "max": 800, "unit": "units"}
-}
-
-def callback(ch, method, properties, body):
-    try:
-        # Parse the JSON message
-        data = json.loads(body)
-        
-        # Get timestamp and format it
-        timestamp = data.get("timestamp", 0)
-        datetime_str = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
-        
-        # Check all values against thresholds
-        alerts = []
-        
-        # Check temperature
-        if "temperature" in data:
-            temp = data["temperature"]
-            if temp > THRESHOLDS["temperature"]["max"]:
-                alerts.append(f"HIGH TEMPERATURE: {temp}{THRESHOLDS['temperature']['unit']}")
-            elif temp < THRESHOLDS["temperature"]["min"]:
-                alerts.append(f"LOW TEMPERATURE: {temp}{THRESHOLDS['temperature']['unit']}")
-        
-        # Check humidity
-        if "humidity" in data:
-            humid = data["humidity"]
-            if humid < THRESHOLDS["humidity"]["min"]:
-                alerts.append(f"LOW HUMIDITY: {humid}{THRESHOLDS['humidity']['unit']}")
-            elif humid > THRESHOLDS["humidity"]["max"]:
-                alerts.append(f"HIGH HUMIDITY: {humid}{THRESHOLDS['humidity']['unit']}")
-        
-        # Check soil moisture
-        if "soil_moisture" in data:
-            moisture = data["soil_moisture"]
-            if moisture < THRESHOLDS["soil_moisture"]["min"]:
-                alerts.append(f"LOW SOIL MOISTURE: {moisture}{THRESHOLDS['soil_moisture']['unit']}")
-            elif moisture > THRESHOLDS["soil_moisture"]["max"]:
-                alerts.append(f"HIGH SOIL MOISTURE: {moisture}{THRESHOLDS['soil_moisture']['unit']}")
-        
-        # Print alerts if any were found
-        if alerts:
+from async_runtime import ReadingConsumer, ConsumerRuntime
+from sharding import assigned_shards, make_shared
+from threshold_engine import default_engine
+from alert_aggregator import AlertAggregator, OPEN, ONGOING
+
+def format_duration(seconds):
+    # e.g. 45s, 3m20s, 2h05m
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+
+class AlertHandler(ReadingConsumer):
+    """
+    Reports alerts for readings outside the thresholds.
+
+    Only changes are printed: when a device's metric starts alerting, a
+    reminder at most once per cooldown while it keeps alerting, and when it
+    clears (see alert_aggregator.py). The emitters also route the first
+    reading back in range to 'alerts', so an alert clears on that reading
+    rather than only after the clear timeout.
+    """
+
+    # Alerts arrive on the direct exchange with the 'alerts' routing key
+    exchange = 'sensors.direct'
+    exchange_type = 'direct'
+    routing_keys = ('alerts',)
+
+    def __init__(self):
+        super().__init__()
+        self.engine = default_engine
+        self.alerts = AlertAggregator()
+        self._timer = None
+
+    def expire_timer(self):
+        # Clear alerts of devices that stopped sending alerting readings, then check again later
+        self.report(self.alerts.expire())
+        self._timer = self.call_later(max(1.0, self.alerts.clear_after / 2), self.expire_timer)
+
+    def on_start(self):
+        print("Alert handler started. Waiting for abnormal sensor values.")
+        if self._timer is None and self.alerts.clear_after:
+            self._timer = self.call_later(max(1.0, self.alerts.clear_after / 2), self.expire_timer)
+
+    def on_stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        print(f"Alert handler stopped ({self.alerts.stats})")
+
+    def label(self, metric, level):
+        # e.g. HIGH SOIL MOISTURE
+        return f"{level} {metric.upper().replace('_', ' ')}"
+
+    def unit(self, metric):
+        # The metric may have been dropped from the rules since the alert opened
+        rules = self.engine.rules
+        return rules.units[rules.fields.index(metric)] if metric in rules.fields else ""
+
+    def report(self, transitions, timestamp=None):
+        for t in transitions:
+            alert = t.alert
+            if t.state == ONGOING:
+                print(f"[ONGOING] {self.label(t.metric, alert.level)} on {t.device_id}: "
+                      f"{alert.value}{self.unit(t.metric)}, peak {t.peak}{self.unit(t.metric)} "
+                      f"over {t.readings} readings since the last report, "
+                      f"open for {format_duration(alert.last_seen - alert.opened)}")
+            elif t.state != OPEN:
+                print(f"[CLEARED] {self.label(t.metric, alert.level)} on {t.device_id} "
+                      f"after {format_duration(alert.last_seen - alert.opened)} "
+                      f"and {alert.count} alerting readings ({t.reason})")
+
+        opened = [t for t in transitions if t.state == OPEN]
+        if opened:
+            # Get timestamp and format it
+            datetime_str = datetime.fromtimestamp(timestamp or 0).strftime('%Y-%m-%d %H:%M:%S')
+
             print("\n" + "!" * 50)
-            print(f"ALERT at {datetime_str}:")
-            for alert in alerts:
-                print(f"* {alert}")
+            print(f"ALERT at {datetime_str} ({opened[0].device_id}):")
+            for t in opened:
+                print(f"* {self.label(t.metric, t.alert.level)}: {t.alert.value}{self.unit(t.metric)}")
             print("!" * 50 + "\n")
-        
-    except json.JSONDecodeError:
-        print(f"Error: Could not parse message as JSON: {body}")
-    except Exception as e:
-        print(f"Error processing alert: {e}")
-
-# Start consuming messages
-channel.basic_consume(
-    queue=queue_name,
-    on_message_callback=callback,
-    auto_ack=True
-)
-
-# Start consuming
-try:
-    channel.start_consuming()
-except KeyboardInterrupt:
-    print("Stopping alert handler")
-    channel.stop_consuming()
-    
-connection.close() 
\ No newline at end of file
+
+    def handle_readings(self, readings, message):
+        try:
+            # Check all values of the message (one reading or an envelope) against thresholds at once
+            result = self.engine.evaluate_readings(readings)
+            fields = self.engine.fields
+
+            # Turn the per-reading alert states into open/ongoing/cleared transitions
+            for data, low, high in zip(readings, result.low.tolist(), result.high.tolist()):
+                alerts = {}
+                for column, field in enumerate(fields):
+                    if (low[column] or high[column]) and data.get(field) is not None:
+                        alerts[field] = ("HIGH" if high[column] else "LOW", data[field])
+                transitions = self.alerts.update(data.get("device_id", "unknown"), alerts, fields)
+                if transitions:
+                    self.report(transitions, data.get("timestamp", 0))
+
+        except Exception as e:
+            print(f"Error processing alert: {e}")
+
+def create_consumers(shards=None):
+    """
+    Consumers this script contributes to a shared runtime.
+
+    With CONSUMER_SHARDS set, all workers share one named queue and only one
+    of them consumes at a time, since the AlertHandler keeps per-device alert state.
+    """
+    consumer = AlertHandler()
+    if shards is not None or assigned_shards() is not None:
+        make_shared(consumer, 'alert_handler')
+    return [consumer]
+
+if __name__ == '__main__':
+    runtime = ConsumerRuntime()
+    for consumer in create_consumers():
+        runtime.register(consumer)
+    runtime.run_forever()
@@ -1,75 +1,144 @@
 #!/usr/bin/env python
-import json
 import os
 from datetime import datetime
+from functools import lru_cache
 import sys
-import os
 
 # Add parent directory to path to import utils
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils import get_rabbitmq_connection
+from async_runtime import ReadingConsumer, ConsumerRuntime
+from batched_writer import BatchedCSVWriter
+from timeseries_store import TimeSeriesWriter, reading_to_row
+from sharding import assigned_shards, make_sharded, shard_path
+
+# Batching settings (rows per batch, max wait in ms, fsync policy: never/interval/batch)
+BATCH_ROWS = int(os.getenv('DATA_LOGGER_BATCH_ROWS', 500))
+BATCH_MS = int(os.getenv('DATA_LOGGER_BATCH_MS', 1000))
+FSYNC_POLICY = os.getenv('DATA_LOGGER_FSYNC', 'interval')
 
-# Ensure the data directory exists
-os.makedirs("data", exist_ok=True)
+# Storage format: 'columnar' (binary column store in data/timeseries) or 'csv' (data/sensor_data.csv)
+STORAGE_FORMAT = os.getenv('DATA_LOGGER_FORMAT', 'columnar')
 
-# Create or open data log file (CSV format)
+# Data log file (CSV format) and columnar store directory
 data_file = os.path.join("data", "sensor_data.csv")
-file_exists = os.path.isfile(data_file)
-
-with open(data_file, "a") as f:
-    # Write CSV header if file is new
-    if not file_exists:
-        f.write("timestamp,datetime,temperature,humidity,soil_moisture,device_id\n")
-
-# Connect to RabbitMQ using CloudAMQP credentials
-connection = get_rabbitmq_connection()
-channel = connection.channel()
-
-# Declare the fanout exchange
-channel.exchange_declare(exchange='sensors.fanout', exchange_type='fanout')
-
-# Create a temporary queue with a random name
-result = channel.queue_declare(queue='', exclusive=True)
-queue_name = result.method.queue
-
-# Bind the queue to the exchange
-channel.queue_bind(exchange='sensors.fanout', queue=queue_name)
-
-print("Waiting for sensor data. To exit press CTRL+C")
-
-def callback(ch, method, properties, body):
-    try:
-        # Parse the JSON message
-        data = json.loads(body)
-        timestamp = data.get("timestamp", 0)
-        
-        # Convert Unix timestamp to readable datetime
-        datetime_str = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
-        
-        # Print received data
-        print(f"Received: {data}")
-        
-        # Log data to CSV file
-        with open(data_file, "a") as f:
-            f.write(f"{timestamp},{datetime_str},{data.get('temperature', '')},{data.get('humidity', '')},{data.get('soil_moisture', '')},{data.get('device_id', '')}\n")
-            
-    except json.JSONDecodeError:
-        print(f"Error: Could not parse message as JSON: {body}")
-    except Exception as e:
-        print(f"Error processing message: {e}")
-
-# Start consuming messages
-channel.basic_consume(
-    queue=queue_name,
-    on_message_callback=callback,
-    auto_ack=True
-)
-
-# Start consuming
-try:
-    channel.start_consuming()
-except KeyboardInterrupt:
-    print("Stopping data logger")
-    channel.stop_consuming()
-    
-connection.close() 
\ No newline at end of file
+store_dir = os.path.join("data", "timeseries")
+
+@lru_cache(maxsize=1024)
+def format_datetime(second):
+    # Readings arrive several per second, so reuse the formatted string
+    return datetime.fromtimestamp(second).strftime('%Y-%m-%d %H:%M:%S')
+
+class DataLogger(ReadingConsumer):
+    """Logs every reading from the fanout exchange in batches."""
+
+    exchange = 'sensors.fanout'
+    exchange_type = 'fanout'
+
+    # Messages are acked only after they are written, so let the broker
+    # keep a full batch (plus the next one) in flight
+    prefetch_count = BATCH_ROWS * 2
+    manual_ack = True
+
+    def __init__(self, shard=None):
+        """
+        Args:
+            shard (int, optional): Shard this logger consumes (see sharding.py);
+                each shard writes its own data file
+        """
+        super().__init__()
+        self._timer = None
+
+        # Ensure the data directory exists
+        os.makedirs("data", exist_ok=True)
+
+        # Keep the output open and write rows in batches
+        batch_options = {
+            "max_rows": BATCH_ROWS,
+            "max_delay_ms": BATCH_MS,
+            "fsync_policy": FSYNC_POLICY,
+            "on_flush": self.ack_batch
+        }
+        csv_path, store_path = data_file, store_dir
+        if shard is not None:
+            csv_path, store_path = shard_path(data_file, shard), shard_path(store_dir, shard)
+        if STORAGE_FORMAT == 'csv':
+            self.writer = BatchedCSVWriter(
+                csv_path,
+                header="timestamp,datetime,temperature,humidity,soil_moisture,device_id",
+                **batch_options
+            )
+        else:
+            self.writer = TimeSeriesWriter(store_path, **batch_options)
+
+    def ack_batch(self, last_delivery_tag):
+        # Acknowledge every delivery up to and including the last one in the batch
+        self.ack(last_delivery_tag, multiple=True)
+        print(f"Logged {self.writer.rows_written} readings in {self.writer.batches_written} batches")
+
+    def flush_timer(self):
+        # Flush batches that have been waiting too long, then check again later
+        try:
+            self.writer.flush_if_due()
+        except Exception as e:
+            print(f"Error writing batch, will retry: {e}")
+        finally:
+            self._timer = self.call_later(BATCH_MS / 1000.0 / 2, self.flush_timer)
+
+    def on_start(self):
+        print("Waiting for sensor data.")
+        if self._timer is None:
+            self._timer = self.call_later(BATCH_MS / 1000.0 / 2, self.flush_timer)
+
+    def on_connection_lost(self):
+        # Unacked rows will be redelivered, so writing them now would duplicate them
+        dropped = self.writer.discard()
+        if dropped:
+            print(f"Connection lost, {dropped} unacknowledged readings will be redelivered")
+
+    def on_stop(self):
+        print("Stopping data logger")
+        if self._timer is not None:
+            self._timer.cancel()
+        # Write out and acknowledge whatever is still buffered
+        self.writer.close()
+
+    def handle_reading(self, data, message):
+        try:
+            # Buffer the row; it is acked once its batch is written
+            if STORAGE_FORMAT == 'csv':
+                timestamp = data.get("timestamp", 0)
+
+                # Convert Unix timestamp to readable datetime
+                datetime_str = format_datetime(int(timestamp))
+                row = f"{timestamp},{datetime_str},{data.get('temperature', '')},{data.get('humidity', '')},{data.get('soil_moisture', '')},{data.get('device_id', '')}\n"
+            else:
+                row = reading_to_row(data)
+            self.writer.write(row, delivery_tag=message.delivery_tag)
+
+        except Exception as e:
+            print(f"Error processing message: {e}")
+            self.writer.skip(message.delivery_tag)
+
+    def on_decode_error(self, message):
+        # Nothing to log, but the message still has to be acked in order
+        self.writer.skip(message.delivery_tag)
+
+def create_consumers(shards=None):
+    """
+    Consumers this script contributes to a shared runtime.
+
+    Args:
+        shards (list, optional): Shards to consume when CONSUMER_SHARDS is set
+            (default: all of them); one logger per shard
+    """
+    if shards is None:
+        shards = assigned_shards()
+    if shards is None:
+        return [DataLogger()]
+    return [make_sharded(DataLogger(shard), 'data_logger', shard) for shard in shards]
+
+if __name__ == '__main__':
+    runtime = ConsumerRuntime()
+    for consumer in create_consumers():
+        runtime.register(consumer)
+    runtime.run_forever()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""
+Run several consumers in one process over a single RabbitMQ connection.
+
+Usage:
+    python run_consumers.py                      # alert_handler, data_logger, topic_analyzer
+    python run_consumers.py alert_handler data_logger
+    python run_consumers.py security_monitor     # from the security_countermeasures folder
+
+Scaling out (CONSUMER_SHARDS=4 in .env, see sharding.py), e.g. on two machines:
+    python run_consumers.py --worker 0/2 data_logger
+    python run_consumers.py --worker 1/2 data_logger
+"""
+
+import argparse
+import importlib
+import inspect
+import os
+import sys
+
+# Make the consumer scripts (and security tools, if present) importable by name
+app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(app_dir)
+for folder in ('consumers', 'security_countermeasures'):
+    path = os.path.join(app_dir, folder)
+    if os.path.isdir(path):
+        sys.path.append(path)
+
+from async_runtime import ConsumerRuntime
+from sharding import CONSUMER_SHARDS, assigned_shards, parse_worker
+
+DEFAULT_CONSUMERS = ['alert_handler', 'data_logger', 'topic_analyzer']
+
+def main(names, worker=(0, 1)):
+    runtime = ConsumerRuntime()
+    shards = assigned_shards(*worker)
+    if shards is not None:
+        print(f"Worker {worker[0]} of {worker[1]}: shards {shards} of {CONSUMER_SHARDS}")
+    for name in names:
+        module = importlib.import_module(name)
+        if not hasattr(module, 'create_consumers'):
+            print(f"Error: {name} does not define create_consumers()")
+            sys.exit(1)
+        # Modules that support sharding get this worker's share of the shards
+        if 'shards' in inspect.signature(module.create_consumers).parameters:
+            consumers = module.create_consumers(shards=shards)
+        else:
+            consumers = module.create_consumers()
+        for consumer in consumers:
+            runtime.register(consumer)
+    runtime.run_forever()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run consumers over one RabbitMQ connection")
+    parser.add_argument('consumers', nargs='*', default=DEFAULT_CONSUMERS, help="consumer modules to run")
+    parser.add_argument('--worker', type=parse_worker, default=(0, 1),
+                        help="this process's index and the number of workers, e.g. 0/3 (with CONSUMER_SHARDS)")
+    args = parser.parse_args()
+    main(args.consumers, args.worker)
@@ -1,84 +1,159 @@
 #!/usr/bin/env python
-import json
 from datetime import datetime
+import json
+import time
 import sys
 import os
 
 # Add parent directory to path to import utils
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils import get_rabbitmq_connection
-
-# Connect to RabbitMQ using CloudAMQP credentials
-connection = get_rabbitmq_connection()
-channel = connection.channel()
-
-# Declare the topic exchange
-channel.exchange_declare(exchange='sensors.topic', exchange_type='topic')
-
-# Create a queue for analyzing topics
-result = channel.queue_declare(queue='', exclusive=True)
-queue_name = result.method.queue
-
-# Bind the queue to the exchange with different routing patterns using wildcards
-# * (star) substitutes exactly one word
-# # (hash) substitutes zero or more words
-channel.queue_bind(
-    exchange='sensors.topic',
-    queue=queue_name,
-    routing_key='sensor.*'  # This matches sensor.temperature, sensor.humidity, sensor.soil, etc.
-)
-
-# You could also use something like 'sensor.#' to match sensor.temperature.farm1, etc.
-
-print("Topic analyzer started. Demonstrating topic exchange with wildcards.")
-print("Subscribed to pattern: sensor.*")
-print("To exit press CTRL+C")
-
-def callback(ch, method, properties, body):
-    try:
-        # Parse the JSON message
-        data = json.loads(body)
-        
-        # Get timestamp and format it
-        timestamp = data.get("timestamp", 0)
-        datetime_str = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
-        
-        # Extract the specific sensor type from the routing key
-        sensor_type = method.routing_key.split('.')[-1]
-        
-        # Print the data with routing key information
-        print(f"\n[TOPIC: {method.routing_key}]")
-        print(f"Time: {datetime_str}")
-        
-        # Format output based on sensor type
-        if sensor_type == 'temperature' and 'temperature' in data:
-            print(f"Temperature: {data['temperature']}°C")
-        elif sensor_type == 'humidity' and 'humidity' in data:
-            print(f"Humidity: {data['humidity']}%")
-        elif sensor_type == 'soil' and 'soil_moisture' in data:
-            print(f"Soil Moisture: {data['soil_moisture']} units")
-        else:
-            print(f"Data: {data}")
-        
-        print("-" * 40)
-        
-    except json.JSONDecodeError:
-        print(f"Error: Could not parse message as JSON: {body}")
-    except Exception as e:
-        print(f"Error processing message: {e}")
-
-# Start consuming messages
-channel.basic_consume(
-    queue=queue_name,
-    on_message_callback=callback,
-    auto_ack=True
-)
-
-# Start consuming
-try:
-    channel.start_consuming()
-except KeyboardInterrupt:
-    print("Stopping topic analyzer")
-    channel.stop_consuming()
-    
-connection.close() 
\ No newline at end of file
+from async_runtime import ReadingConsumer, ConsumerRuntime
+from sharding import assigned_shards, make_shared
+from window_stats import SlidingWindow, TumblingWindow, format_span
+from wire_format import CONTENT_TYPE_JSON
+import pika
+
+# Window lengths in seconds (comma-separated lists), how often summaries are
+# published and how many samples each window keeps
+TUMBLING_WINDOWS = [float(s) for s in os.getenv('TOPIC_TUMBLING_WINDOWS', '60').split(',') if s.strip()]
+SLIDING_WINDOWS = [float(s) for s in os.getenv('TOPIC_SLIDING_WINDOWS', '300').split(',') if s.strip()]
+STATS_INTERVAL = float(os.getenv('TOPIC_STATS_INTERVAL', 10))
+WINDOW_CAPACITY = int(os.getenv('TOPIC_WINDOW_CAPACITY', 4096))
+
+# Seconds a tumbling window stays open after its end for late readings
+LATE_GRACE = 2.0
+
+# Reading field carried by each sensor topic
+TOPIC_FIELDS = {
+    'temperature': 'temperature',
+    'humidity': 'humidity',
+    'soil': 'soil_moisture'
+}
+
+class TopicAnalyzer(ReadingConsumer):
+    """
+    Demonstrates topic exchange wildcards by printing each sensor topic, and
+    keeps tumbling and sliding window statistics per topic (see window_stats.py).
+
+    Summaries are published back to sensors.topic, e.g. stats.temperature.1m
+    for a one minute tumbling window and stats.temperature.5m.sliding for a
+    five minute sliding window.
+    """
+
+    exchange = 'sensors.topic'
+    exchange_type = 'topic'
+    # Bind with a wildcard pattern
+    # * (star) substitutes exactly one word
+    # # (hash) substitutes zero or more words
+    routing_keys = ('sensor.*',)  # This matches sensor.temperature, sensor.humidity, sensor.soil, etc.
+
+    # You could also use something like 'sensor.#' to match sensor.temperature.farm1, etc.
+
+    def __init__(self):
+        super().__init__()
+        # sensor type -> its windows, created on the first reading of the topic
+        self.windows = {}
+        self.properties = pika.BasicProperties(content_type=CONTENT_TYPE_JSON)
+        self._timer = None
+
+    def windows_for(self, sensor_type):
+        windows = self.windows.get(sensor_type)
+        if windows is None:
+            windows = [TumblingWindow(span, WINDOW_CAPACITY) for span in TUMBLING_WINDOWS]
+            windows += [SlidingWindow(span, WINDOW_CAPACITY) for span in SLIDING_WINDOWS]
+            self.windows[sensor_type] = windows
+        return windows
+
+    def publish_summary(self, sensor_type, window, summary):
+        # e.g. stats.temperature.1m or stats.temperature.5m.sliding
+        routing_key = f"stats.{sensor_type}.{format_span(window.span)}"
+        if window.kind == "sliding":
+            routing_key += ".sliding"
+        summary.update(sensor=sensor_type, window=window.kind, span=window.span)
+        self.publish('sensors.topic', routing_key, json.dumps(summary).encode(), self.properties)
+
+        print(f"[{routing_key}] count={summary['count']} mean={summary['mean']:.2f} "
+              f"min={summary['min']} max={summary['max']} p95={summary['p95']:.2f}")
+
+    def stats_timer(self):
+        # Publish sliding summaries and close tumbling windows that no reading closed
+        now = time.time()
+        try:
+            for sensor_type, windows in self.windows.items():
+                for window in windows:
+                    if window.kind == "sliding":
+                        summary = window.summary(now)
+                    else:
+                        summary = window.close_if_due(now - LATE_GRACE)
+                    if summary is not None and summary['count']:
+                        self.publish_summary(sensor_type, window, summary)
+        except Exception as e:
+            print(f"Error publishing window summaries: {e}")
+        finally:
+            # Keep the summaries coming even if one publish failed
+            self._timer = self.call_later(STATS_INTERVAL, self.stats_timer)
+
+    def on_start(self):
+        print("Topic analyzer started. Demonstrating topic exchange with wildcards.")
+        print("Subscribed to pattern: sensor.*")
+        if self._timer is None:
+            self._timer = self.call_later(STATS_INTERVAL, self.stats_timer)
+
+    def on_stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+
+    def handle_reading(self, data, message):
+        try:
+            # Get timestamp and format it
+            timestamp = data.get("timestamp", 0)
+            datetime_str = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+            # Extract the specific sensor type from the routing key
+            sensor_type = message.routing_key.split('.')[-1]
+
+            # Print the data with routing key information
+            print(f"\n[TOPIC: {message.routing_key}]")
+            print(f"Time: {datetime_str}")
+
+            # Format output based on sensor type
+            if sensor_type == 'temperature' and 'temperature' in data:
+                print(f"Temperature: {data['temperature']}°C")
+            elif sensor_type == 'humidity' and 'humidity' in data:
+                print(f"Humidity: {data['humidity']}%")
+            elif sensor_type == 'soil' and 'soil_moisture' in data:
+                print(f"Soil Moisture: {data['soil_moisture']} units")
+            else:
+                print(f"Data: {data}")
+
+            print("-" * 40)
+
+            # Add the value to the topic's windows; a reading in a later
+            # tumbling window closes the current one
+            field = TOPIC_FIELDS.get(sensor_type)
+            if field is not None and data.get(field) is not None:
+                for window in self.windows_for(sensor_type):
+                    summary = window.add(timestamp, data[field])
+                    if summary is not None and summary['count']:
+                        self.publish_summary(sensor_type, window, summary)
+
+        except Exception as e:
+            print(f"Error processing message: {e}")
+
+def create_consumers(shards=None):
+    """
+    Consumers this script contributes to a shared runtime.
+
+    With CONSUMER_SHARDS set, all workers share one named queue and only one
+    of them consumes at a time, since the TopicAnalyzer keeps per-topic windows.
+    """
+    consumer = TopicAnalyzer()
+    if shards is not None or assigned_shards() is not None:
+        make_shared(consumer, 'topic_analyzer')
+    return [consumer]
+
+if __name__ == '__main__':
+    runtime = ConsumerRuntime()
+    for consumer in create_consumers():
+        runtime.register(consumer)
+    runtime.run_forever()
@@ -1,7 +1,8 @@
 #!/usr/bin/env python
-import json
 import threading
-from flask import Flask, jsonify
+import json
+import math
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
 import time
 import sys
@@ -9,7 +10,15 @@ import os
 
 # Add parent directory to path to import utils
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils import get_rabbitmq_connection
+from utils import get_rabbitmq_connection, get_connection_manager
+from ack_batcher import AckBatcher, DEFAULT_PREFETCH
+from wire_format import iter_readings
+from threshold_engine import check_alerts_batch, default_engine
+from history import (choose_step, history_generation, history_response,
+                     open_window_end, DEFAULT_HISTORY_SPAN)
+from event_stream import EventBroadcaster, encode_event_body
+from snapshot import SnapshotHolder, snapshot_response, json_response
+from device_table import DeviceTable
 import pika
 
 # Initialize Flask app
@@ -17,51 +26,20 @@ app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
 # In-memory storage for the latest sensor data
-latest_data = {
+# (an immutable snapshot that the consumer thread replaces on every reading)
+latest_data = SnapshotHolder({
     "timestamp": 0,
     "temperature": 0,
     "humidity": 0,
     "soil_moisture": 0,
     "alerts": []
-}
-
-# Define thresholds for alerts (same as in alert_handler.py)
-THRESHOLDS = {
-    "temperature": {"min": 0, "max": 35, "unit": "°C"},
-    "humidity": {"min": 30, "max": 100, "unit": "%"},
-    "soil_moisture": {"min": 250, "max": 800, "unit": "units"}
-}
-
-# Check if values are in alert range
-def check_alerts(data):
-    alerts = []
-    
-    # Check temperature
-    if "temperature" in data:
-        temp = data["temperature"]
-        if temp > THRESHOLDS["temperature"]["max"]:
-            alerts.append(f"HIGH TEMPERATURE: {temp}{THRESHOLDS['temperature']['unit']}")
-        elif temp < THRESHOLDS["temperature"]["min"]:
-            alerts.append(f"LOW TEMPERATURE: {temp}{THRESHOLDS['temperature']['unit']}")
-    
-    # Check humidity
-    if "humidity" in data:
-        humid = data["humidity"]
-        if humid < THRESHOLDS["humidity"]["min"]:
-            alerts.append(f"LOW HUMIDITY: {humid}{THRESHOLDS['humidity']['unit']}")
-        elif humid > THRESHOLDS["humidity"]["max"]:
-            alerts.append(f"HIGH HUMIDITY: {humid}{THRESHOLDS['humidity']['unit']}")
-    
-    # Check soil moisture
-    if "soil_moisture" in data:
-        moisture = data["soil_moisture"]
-        if moisture < THRESHOLDS["soil_moisture"]["min"]:
-            alerts.append(f"LOW SOIL MOISTURE: {moisture}{THRESHOLDS['soil_moisture']['unit']}")
-        elif moisture > THRESHOLDS["soil_moisture"]["max"]:
-            alerts.append(f"HIGH SOIL MOISTURE: {moisture}{THRESHOLDS['soil_moisture']['unit']}")
-    
-    return alerts
+})
 
+# Latest reading for every device, keyed by device_id
+devices = DeviceTable()
+
+# Pushes new readings to dashboards connected to /api/stream
+broadcaster = EventBroadcaster()
 
 # Function to handle RabbitMQ connection
 def start_rabbitmq_consumer():
@@ -80,34 +58,51 @@ def start_rabbitmq_consumer():
         # Bind the queue to the exchange
         channel.queue_bind(exchange='sensors.fanout', queue=queue_name)
         
+        # Bound the number of unacked readings held in memory and ack them in batches
+        channel.basic_qos(prefetch_count=DEFAULT_PREFETCH)
+        acks = AckBatcher(lambda tag, multiple: channel.basic_ack(delivery_tag=tag, multiple=multiple))
+        
+        def ack_timer():
+            # Ack readings that have waited too long, then check again later
+            acks.flush_if_due()
+            connection.call_later(acks.max_delay / 2, ack_timer)
+        
+        connection.call_later(acks.max_delay / 2, ack_timer)
+        
         print("Web data server started. Waiting for sensor data...")
         
         # Define callback function for received messages
         def callback(ch, method, properties, body):
             try:
-                # Parse the JSON message
-                data = json.loads(body)
-                print(type(data))#dict
-                
-                # Update the latest data
-                global latest_data
-                latest_data.update(data)
-                
-                # Calculate alerts
-                latest_data["alerts"] = check_alerts(data)
+                # Decode the message (JSON or binary, one reading or an envelope of several)
+                readings = list(iter_readings(body, properties))
                 
-                print(f"Received data for web: {data}")
+                # Check every reading of the message against the thresholds at once
+                for data, alerts in zip(readings, check_alerts_batch(readings)):
+                    print(type(data))#dict
+                    
+                    # Publish a new snapshot with the reading and its alerts
+                    reading = dict(data, alerts=alerts)
+                    snapshot = latest_data.update(reading)
+                    devices.update(data.get("device_id", "unknown"), reading)
+                    
+                    # Push the already encoded snapshot to every connected dashboard
+                    broadcaster.publish_encoded(encode_event_body('reading', snapshot.body))
+                    
+                    print(f"Received data for web: {data}")
                 
-            except json.JSONDecodeError:
-                print(f"Error: Could not parse message as JSON: {body}")
+            except ValueError:
+                print(f"Error: Could not decode message: {body}")
             except Exception as e:
                 print(f"Error processing message: {e}")
+            
+            # Bad readings are only logged, so every delivery counts as handled
+            acks.done(method.delivery_tag)
         
         # Start consuming messages
         channel.basic_consume(
             queue=queue_name,
-            on_message_callback=callback,
-            auto_ack=True
+            on_message_callback=callback
         )
         
         # Start consuming in a blocking way
@@ -115,13 +110,97 @@ def start_rabbitmq_consumer():
     
     except Exception as e:
         print(f"RabbitMQ consumer error: {e}")
+        get_connection_manager().discard()  # Drop the broken connection from the pool
         time.sleep(5)  # Wait before reconnecting
         start_rabbitmq_consumer()  # Try to reconnect
 
 # API route to get the latest data
 @app.route('/api/sensor-data', methods=['GET'])
 def get_sensor_data():
-    return jsonify(latest_data)
+    # Pre-encoded bytes, or 304 if the client already has this reading
+    return snapshot_response(latest_data.get(), request)
+
+# API route to get the latest data for one device
+@app.route('/api/sensor-data/<device_id>', methods=['GET'])
+def get_device_data(device_id):
+    snapshot = devices.get(device_id)
+    if snapshot is None:
+        return jsonify({
+            'error': 'Not Found',
+            'message': f'No data received from device {device_id}'
+        }), 404
+    return snapshot_response(snapshot, request)
+
+# API route to get the latest data for all devices in one response
+@app.route('/api/devices', methods=['GET'])
+def get_all_devices():
+    body, etag = devices.bulk()
+    return json_response(body, etag, request)
+
+# API route to get the alert thresholds (defaults and per-device overrides) for the dashboard
+@app.route('/api/thresholds', methods=['GET'])
+def get_thresholds():
+    rules = default_engine.rules
+    body = json.dumps(rules.to_dict()).encode()
+    return json_response(body, f"rules-{rules.version}", request)
+
+# Streaming route: pushes each new reading as a Server-Sent Event
+@app.route('/api/stream', methods=['GET'])
+def stream_sensor_data():
+    response = Response(
+        broadcaster.stream(initial=encode_event_body('reading', latest_data.get().body)),
+        mimetype='text/event-stream'
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Disable proxy buffering
+    return response
+
+# API route to get downsampled history from the data logger's store
+@app.route('/api/history', methods=['GET'])
+def get_history():
+    device_id = request.args.get('device')
+    if not device_id:
+        return jsonify({
+            'error': 'Bad Request',
+            'message': 'The device parameter is required'
+        }), 400
+
+    try:
+        end = request.args.get('to')
+        end = float(end) if end else None
+        start = request.args.get('from')
+        start = float(start) if start else None
+        step = request.args.get('step')
+        step = float(step) if step else None
+    except ValueError:
+        return jsonify({
+            'error': 'Bad Request',
+            'message': 'from, to and step must be numbers (Unix seconds)'
+        }), 400
+
+    # float() accepts 'nan' and 'inf', which would break the bucketing
+    if not all(math.isfinite(value) for value in (start or 0, end or 0, step or 0)):
+        return jsonify({
+            'error': 'Bad Request',
+            'message': 'from, to and step must be finite numbers'
+        }), 400
+
+    # Without `to` the window runs up to now, rounded so repeated requests hit the cache
+    if end is None:
+        end = open_window_end(time.time(), start, step)
+    if start is None:
+        start = end - DEFAULT_HISTORY_SPAN
+
+    if start > end:
+        return jsonify({
+            'error': 'Bad Request',
+            'message': 'from must not be after to'
+        }), 400
+
+    step = choose_step(start, end, step)
+    generation = history_generation(device_id, start, end)
+    body = history_response(device_id, start, end, step, generation)
+    return Response(body, mimetype='application/json')
 
 # Start RabbitMQ consumer in a separate thread
 rabbitmq_thread = threading.Thread(target=start_rabbitmq_consumer)
@@ -131,4 +210,5 @@ rabbitmq_thread.start()
 # Run the Flask app
 if __name__ == '__main__':
     # Change port from 5000 to 5001 to avoid conflicts
-    app.run(host='0.0.0.0', port=5001, debug=True) 
\ No newline at end of file
+    # threaded=True lets each /api/stream client hold its own connection
+    app.run(host='0.0.0.0', port=5001, debug=True, threaded=True) 
\ No newline at end of file
@@ -3,15 +3,20 @@
 // API endpoint for sensor data (updated port from 5000 to 5001)
 const API_URL = 'http://localhost:5001/api/sensor-data';  //REST API
 
-// Update interval in milliseconds (2 seconds)
+// Server-Sent Events stream that pushes each new reading
+const STREAM_URL = 'http://localhost:5001/api/stream';
+
+// Polling interval in milliseconds (2 seconds), used only when the stream is unavailable
 const UPDATE_INTERVAL = 2000;
 
-// Thresholds for highlighting values
-const THRESHOLDS = {
-    temperature: { min: 0, max: 35 },
-    humidity: { min: 30, max: 100 },
-    soil_moisture: { min: 250, max: 800 }
-};
+// Thresholds for highlighting values, from the server's rules file
+const THRESHOLDS_URL = 'http://localhost:5001/api/thresholds';
+
+// How often to pick up changed threshold rules (30 seconds)
+const THRESHOLDS_INTERVAL = 30000;
+
+// Defaults and per-device thresholds, once loaded
+let thresholds = null;
 
 // Elements to update
 const temperatureElement = document.getElementById('temperature');
@@ -26,15 +31,46 @@ function formatDateTime(timestamp) {
     return date.toLocaleString();
 }
 
-// Check if a value is in the normal range
-function isInNormalRange(value, type) {
-    return value >= THRESHOLDS[type].min && value <= THRESHOLDS[type].max;
+// Fetch the threshold rules from the API
+function fetchThresholds() {
+    fetch(THRESHOLDS_URL)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error('Network response was not ok');
+            }
+            return response.json();
+        })
+        .then(rules => {
+            thresholds = rules;
+        })
+        .catch(error => {
+            console.error('Error fetching thresholds:', error);
+        });
+}
+
+// Thresholds that apply to a device: its own overrides or the defaults
+function thresholdsFor(deviceId) {
+    if (!thresholds) {
+        return null;
+    }
+    const device = thresholds.devices[deviceId];
+    return device ? device.thresholds : thresholds.defaults;
+}
+
+// Check if a value is in the normal range (a null limit means no limit)
+function isInNormalRange(value, type, deviceId) {
+    const limits = thresholdsFor(deviceId);
+    if (!limits || !limits[type]) {
+        return true;
+    }
+    const { min, max } = limits[type];
+    return (min === null || value >= min) && (max === null || value <= max);
 }
 
 // Add appropriate class based on value
-function setValueClass(element, value, type) {
+function setValueClass(element, value, type, deviceId) {
     element.classList.remove('normal', 'warning');
-    element.classList.add(isInNormalRange(value, type) ? 'normal' : 'warning');
+    element.classList.add(isInNormalRange(value, type, deviceId) ? 'normal' : 'warning');
 }
 
 // Fetch data from the API
@@ -60,17 +96,17 @@ function updateDashboard(data) {
     // Update sensor values
     if (data.temperature) {
         temperatureElement.textContent = data.temperature;
-        setValueClass(temperatureElement, data.temperature, 'temperature');
+        setValueClass(temperatureElement, data.temperature, 'temperature', data.device_id);
     }
     
     if (data.humidity) {
         humidityElement.textContent = data.humidity;
-        setValueClass(humidityElement, data.humidity, 'humidity');
+        setValueClass(humidityElement, data.humidity, 'humidity', data.device_id);
     }
     
     if (data.soil_moisture) {
         soilMoistureElement.textContent = data.soil_moisture;
-        setValueClass(soilMoistureElement, data.soil_moisture, 'soil_moisture');
+        setValueClass(soilMoistureElement, data.soil_moisture, 'soil_moisture', data.device_id);
     }
     
     // Update alerts
@@ -92,11 +128,54 @@ function updateDashboard(data) {
     }
 }
 
-// Initial data fetch
-fetchSensorData();
+// Polling fallback
+let pollTimer = null;
+
+function startPolling() {
+    if (pollTimer === null) {
+        fetchSensorData();
+        pollTimer = setInterval(fetchSensorData, UPDATE_INTERVAL);
+    }
+}
+
+function stopPolling() {
+    if (pollTimer !== null) {
+        clearInterval(pollTimer);
+        pollTimer = null;
+    }
+}
+
+// Receive readings as they arrive; poll only while the stream is down
+function connectStream() {
+    if (!window.EventSource) {
+        startPolling();
+        return;
+    }
+
+    const source = new EventSource(STREAM_URL);
+
+    source.addEventListener('open', () => {
+        console.log('Connected to sensor stream');
+        stopPolling();
+    });
+
+    source.addEventListener('reading', event => {
+        updateDashboard(JSON.parse(event.data));
+    });
+
+    // EventSource reconnects by itself; keep the dashboard fresh meanwhile
+    source.addEventListener('error', () => {
+        console.warn('Sensor stream unavailable, falling back to polling');
+        startPolling();
+    });
+}
+
+// Load the thresholds and keep them up to date
+fetchThresholds();
+setInterval(fetchThresholds, THRESHOLDS_INTERVAL);
 
-// Set up periodic updates
-setInterval(fetchSensorData, UPDATE_INTERVAL);
+// Start receiving updates
+connectStream();
 
 // Log to console that the dashboard is running
 console.log('IoT Agriculture Monitoring Dashboard started'); 
\ No newline at end of file
@@ -0,0 +1,79 @@
+"""
+Per-device state table for the web data servers.
+
+Each device keeps its own Snapshot (slots record + pre-encoded JSON + ETag),
+so an update only re-encodes that one device. The bulk /api/devices body is
+stitched together from the per-device bytes the first time it is requested
+after a change, and then reused until the next update.
+"""
+
+import hashlib
+import json
+import threading
+
+from snapshot import Snapshot
+
+
+class DeviceTable:
+    """Latest reading per device_id."""
+
+    def __init__(self):
+        self._devices = {}
+        self._version = 0
+        self._bulk = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._devices)
+
+    def get(self, device_id):
+        """
+        Return the latest snapshot for a device.
+
+        Returns:
+            Snapshot: The device's snapshot, or None if it has not reported yet
+        """
+        return self._devices.get(device_id)
+
+    def update(self, device_id, changes):
+        """
+        Publish a new snapshot for one device. O(1) in the number of devices.
+
+        Args:
+            device_id (str): Device the reading came from
+            changes (dict): Keys to add or replace in the device's latest values
+
+        Returns:
+            Snapshot: The device's new snapshot
+        """
+        with self._lock:
+            current = self._devices.get(device_id)
+            data = dict(current.data) if current is not None else {"device_id": device_id}
+            data.update(changes)
+            snapshot = Snapshot(data)
+            self._devices[device_id] = snapshot
+            self._version += 1
+        return snapshot
+
+    def bulk(self):
+        """
+        Return all devices' latest values as one pre-encoded JSON object.
+
+        Returns:
+            tuple: (body bytes, etag) for {"device_id": {...}, ...}
+        """
+        bulk = self._bulk
+        if bulk is not None and bulk[0] == self._version:
+            return bulk[1], bulk[2]
+
+        with self._lock:
+            version = self._version
+            items = list(self._devices.items())
+
+        body = b"{" + b",".join(
+            json.dumps(device_id).encode("utf-8") + b":" + snapshot.body
+            for device_id, snapshot in items
+        ) + b"}"
+        etag = hashlib.blake2b(body, digest_size=8).hexdigest()
+        self._bulk = (version, body, etag)
+        return body, etag
@@ -0,0 +1,118 @@
+"""
+Server-Sent Events fan-out for the web data server.
+The RabbitMQ consumer thread publishes each event once; the encoded bytes
+are shared by every connected dashboard instead of being serialized per client.
+"""
+
+import json
+import queue
+import threading
+
+# Comment line sent when nothing happened, so proxies keep the connection open
+KEEPALIVE = b": keepalive\n\n"
+
+
+def encode_event(event, data):
+    """
+    Encode one SSE message.
+
+    Args:
+        event (str): Event name the browser listens for
+        data (dict): Payload, sent as JSON
+
+    Returns:
+        bytes: The wire format of the event
+    """
+    return encode_event_body(event, json.dumps(data).encode("utf-8"))
+
+
+def encode_event_body(event, body):
+    """
+    Encode one SSE message around an already encoded JSON body.
+
+    Args:
+        event (str): Event name the browser listens for
+        body (bytes): JSON payload (must not contain newlines)
+
+    Returns:
+        bytes: The wire format of the event
+    """
+    return b"event: " + event.encode("utf-8") + b"\ndata: " + body + b"\n\n"
+
+
+class EventBroadcaster:
+    """Fan pre-encoded events out to all subscribed clients."""
+
+    def __init__(self, max_queue=100, keepalive_interval=15.0):
+        """
+        Args:
+            max_queue (int): Events buffered per client before it is treated as too slow
+            keepalive_interval (float): Seconds between keepalive comments
+        """
+        self.max_queue = max_queue
+        self.keepalive_interval = keepalive_interval
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def subscribe(self):
+        """Register a client and return the queue its events arrive on."""
+        client_queue = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subscribers.add(client_queue)
+        return client_queue
+
+    def unsubscribe(self, client_queue):
+        with self._lock:
+            self._subscribers.discard(client_queue)
+
+    def publish(self, event, data):
+        """Encode an event once and hand the same bytes to every client."""
+        self.publish_encoded(encode_event(event, data))
+
+    def publish_encoded(self, message):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for client_queue in subscribers:
+            try:
+                client_queue.put_nowait(message)
+            except queue.Full:
+                # A client that cannot keep up gets dropped; the browser reconnects
+                self.unsubscribe(client_queue)
+                try:
+                    client_queue.put_nowait(None)
+                except queue.Full:
+                    pass
+
+    def stream(self, initial=None):
+        """
+        Generator for a Flask streaming response.
+
+        Args:
+            initial (bytes, optional): Event sent first, e.g. the current reading
+
+        Yields:
+            bytes: Encoded events and keepalive comments
+        """
+        client_queue = self.subscribe()
+        try:
+            if initial is not None:
+                yield initial
+            while True:
+                try:
+                    message = client_queue.get(timeout=self.keepalive_interval)
+                except queue.Empty:
+                    with self._lock:
+                        dropped = client_queue not in self._subscribers
+                    if dropped:
+                        return
+                    yield KEEPALIVE
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.unsubscribe(client_queue)
@@ -0,0 +1,187 @@
+"""
+Downsampled sensor history for the web data server.
+Reads a device's readings from the columnar store and reduces them to
+fixed-width time buckets with min/max/mean per field, using NumPy.
+"""
+
+import json
+import math
+from functools import lru_cache
+
+import numpy as np
+
+from timeseries_store import TimeSeriesStore, MISSING_INT16, DEFAULT_STORE_PATH
+from sharding import CONSUMER_SHARDS, shard_for, shard_path
+
+# Upper bound on buckets in one response, whatever window is requested
+MAX_HISTORY_POINTS = 2000
+
+# Bucket count used when the client does not pass a step
+DEFAULT_HISTORY_POINTS = 500
+
+# Window length in seconds when the client does not pass `from`
+DEFAULT_HISTORY_SPAN = 3600
+
+FIELDS = ("temperature", "humidity", "soil_moisture")
+
+# Store path -> shared reader
+_stores = {}
+
+
+def get_store(device_id=None, path=DEFAULT_STORE_PATH):
+    """
+    Return the shared store reader, created on first use.
+
+    With CONSUMER_SHARDS set each shard's data logger writes its own store,
+    so the store is picked by the device's shard.
+    """
+    if CONSUMER_SHARDS > 0 and device_id is not None:
+        path = shard_path(path, shard_for(device_id))
+    store = _stores.get(path)
+    if store is None:
+        store = _stores[path] = TimeSeriesStore(path)
+    return store
+
+
+def get_stores(device_id, path=DEFAULT_STORE_PATH):
+    """
+    Return every store that may hold a device's readings.
+
+    With CONSUMER_SHARDS set, readings published without a routing key go to
+    shard 0 whatever the device (see sharding.py), so shard 0's store is read
+    too for devices of the other shards.
+    """
+    stores = [get_store(device_id, path)]
+    if CONSUMER_SHARDS > 0 and shard_for(device_id) != 0:
+        stores.append(get_store(path=shard_path(path, 0)))
+    return stores
+
+
+def choose_step(start, end, step=None):
+    """
+    Pick the bucket width for a window.
+
+    If no step is given, aim for DEFAULT_HISTORY_POINTS buckets. A step that
+    would produce more than MAX_HISTORY_POINTS buckets is widened.
+    """
+    span = max(end - start, 1e-9)
+    if step is None or step <= 0:
+        step = span / DEFAULT_HISTORY_POINTS
+    return max(step, span / MAX_HISTORY_POINTS)
+
+
+def _to_list(values, digits=2):
+    # NaN has no JSON representation, so empty buckets become null
+    return [None if v != v else round(v, digits) for v in values.tolist()]
+
+
+def downsample(timestamps, fields, start, step):
+    """
+    Reduce readings to min/max/mean per bucket.
+
+    Args:
+        timestamps (np.ndarray): Reading timestamps
+        fields (dict): Field name -> float array aligned with timestamps (NaN = missing)
+        start (float): Window start, left edge of the first bucket
+        step (float): Bucket width in seconds
+
+    Returns:
+        dict: Columnar buckets, only for buckets that contain readings
+    """
+    result = {"timestamp": [], "count": []}
+    for field in fields:
+        result[field] = {"min": [], "max": [], "mean": []}
+    if len(timestamps) == 0:
+        return result
+
+    buckets = ((timestamps - start) // step).astype(np.int64)
+    order = np.argsort(buckets, kind="stable")
+    buckets = buckets[order]
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+    counts = np.diff(np.append(bounds, len(buckets)))
+
+    result["timestamp"] = (start + buckets[bounds] * step).tolist()
+    result["count"] = counts.tolist()
+
+    for field, values in fields.items():
+        values = values[order]
+        valid = ~np.isnan(values)
+        valid_counts = np.add.reduceat(valid.astype(np.int64), bounds)
+        sums = np.add.reduceat(np.where(valid, values, 0.0), bounds)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.where(valid_counts > 0, sums / valid_counts, np.nan)
+        result[field] = {
+            # fmin/fmax skip NaN unless every value in the bucket is NaN
+            "min": _to_list(np.fmin.reduceat(values, bounds)),
+            "max": _to_list(np.fmax.reduceat(values, bounds)),
+            "mean": _to_list(means),
+        }
+    return result
+
+
+def history_generation(device_id, start, end):
+    """
+    Cache key part that changes when new data could affect a window.
+
+    Counts the device's index blocks whose timestamp range overlaps the
+    window, over all of its stores. Blocks are only ever appended, so the
+    count grows whenever a flushed batch adds readings to the window,
+    including late readings for a window that has already closed, and stays
+    put otherwise.
+    """
+    generation = 0
+    for store in get_stores(device_id):
+        code = store.device_code(device_id)
+        if code is not None:
+            generation += len(store.index.find(code, start, end))
+    return generation
+
+
+def open_window_end(now, start=None, step=None):
+    """
+    End of a window that runs up to now, for requests without a `to`.
+
+    Rounded up to a power of two seconds no smaller than the bucket step,
+    so requests made a moment apart share a cache key instead of each
+    building its own response.
+    """
+    span = now - start if start is not None else DEFAULT_HISTORY_SPAN
+    quantum = 2.0 ** math.ceil(math.log2(choose_step(now - span, now, step)))
+    return math.ceil(now / quantum) * quantum
+
+
+@lru_cache(maxsize=256)
+def history_response(device_id, start, end, step, generation=0):
+    """
+    Build the JSON body for one history window.
+
+    Identical windows (same generation) are served from the LRU cache.
+
+    Returns:
+        bytes: Encoded JSON response
+    """
+    blocks = []
+    for store in get_stores(device_id):
+        blocks.extend(store.query_blocks(device_id, start, end, columns=("timestamp",) + FIELDS))
+
+    if blocks:
+        timestamps = np.concatenate([block["timestamp"] for block in blocks])
+        fields = {}
+        for field in FIELDS:
+            values = np.concatenate([block[field] for block in blocks]).astype(np.float64)
+            if field == "soil_moisture":
+                values[values == MISSING_INT16] = np.nan
+            fields[field] = values
+    else:
+        timestamps = np.empty(0)
+        fields = {field: np.empty(0) for field in FIELDS}
+
+    body = {
+        "device": device_id,
+        "from": start,
+        "to": end,
+        "step": step,
+        "readings": int(len(timestamps)),
+        "buckets": downsample(timestamps, fields, start, step),
+    }
+    return json.dumps(body).encode("utf-8")
@@ -1,15 +1,44 @@
 #!/usr/bin/env python
+"""
+Sensor emitter.
+
+Usage:
+    python sensor_emitter.py                 # one reading every 2-5 seconds
+    python sensor_emitter.py --interval 0.1 --envelope 50   # 10 Hz, 50 readings per message
+    python sensor_emitter.py --load --devices 1000 --rate 50000 --duration 60
+"""
+import argparse
 import random
 import time
-import json
 import sys
 import os
 
 # Add parent directory to path to import utils
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils import get_rabbitmq_connection
+from publisher import MultiExchangePublisher, EnvelopeBatcher
+from confirm_tracker import ConfirmTracker
+from threshold_engine import ThresholdEngine
+from sharding import device_routing_key
 import pika
 
+parser = argparse.ArgumentParser(description="Publish simulated sensor readings")
+parser.add_argument('--load', action='store_true', help="high-rate load mode for capacity tests")
+parser.add_argument('--devices', type=int, default=1000, help="virtual devices in load mode")
+parser.add_argument('--rate', type=float, default=50000, help="target messages per second in load mode")
+parser.add_argument('--duration', type=float, default=None, help="seconds to run in load mode (default: until CTRL+C)")
+parser.add_argument('--batch-size', type=int, default=500, help="readings per pre-generated batch in load mode")
+parser.add_argument('--encoder', default='auto', choices=['auto', 'json', 'orjson'], help="JSON encoder (auto uses orjson if installed)")
+parser.add_argument('--wire-format', default=os.getenv('SENSOR_WIRE_FORMAT', 'json'), choices=['json', 'binary'],
+                    help="message encoding; consumers decode both by content type")
+parser.add_argument('--confirm-window', type=int, default=int(os.getenv('PUBLISH_CONFIRM_WINDOW', 1000)),
+                    help="unconfirmed messages allowed in flight (0 disables publisher confirms)")
+parser.add_argument('--interval', type=float, default=None, help="seconds between readings (default: random 2-5)")
+parser.add_argument('--envelope', type=int, default=0, help="pack up to this many readings per message (0 sends each reading on its own)")
+parser.add_argument('--envelope-ms', type=int, default=1000, help="send a partly filled envelope after this many milliseconds")
+parser.add_argument('--device-id', default='farm_sensor_01', help="device id of the readings (selects its threshold rules)")
+args = parser.parse_args()
+
 # Connect to RabbitMQ using CloudAMQP credentials
 connection = get_rabbitmq_connection()
 channel = connection.channel()
@@ -20,7 +49,51 @@ channel.exchange_declare(exchange='sensors.direct', exchange_type='direct')
 channel.exchange_declare(exchange='sensors.topic', exchange_type='topic')
 channel.exchange_declare(exchange='sensors.headers', exchange_type='headers')
 
-print("Starting IoT sensor emitter... Press CTRL+C to exit")
+# Publisher confirms, tracked asynchronously so publishing does not wait per message
+confirms = None
+if args.confirm_window > 0:
+    confirms = ConfirmTracker(connection, channel, window=args.confirm_window)
+
+def close_connection():
+    # Give the broker a moment to confirm what is still in flight
+    if confirms is not None:
+        confirms.wait_for_confirms(timeout=5)
+        print(f"Publisher confirms: {confirms.stats}")
+    connection.close()
+
+if args.load:
+    # Imported here, only load mode needs it
+    from load_generator import run_load
+    run_load(connection, channel, devices=args.devices, rate=args.rate,
+             duration=args.duration, batch_size=args.batch_size, confirms=confirms,
+             wire_format=args.wire_format)
+    close_connection()
+    sys.exit(0)
+
+# Encodes each payload once and flushes all routes of a reading together
+publisher = MultiExchangePublisher(connection, channel, encoder=args.encoder, confirms=confirms,
+                                   wire_format=args.wire_format)
+headers_properties = pika.BasicProperties(
+    content_type=publisher.content_type,
+    headers={'device_type': 'environment', 'location': 'field_1'}
+)
+
+# Optional envelopes: many readings per AMQP message for high-frequency sampling
+envelopes = None
+if args.envelope > 0:
+    envelopes = EnvelopeBatcher(publisher, max_readings=args.envelope, max_delay_ms=args.envelope_ms)
+
+    def envelope_timer():
+        # Send envelopes that have waited too long, then check again later
+        envelopes.flush_if_due()
+        connection.call_later(envelopes.max_delay / 2, envelope_timer)
+
+    connection.call_later(envelopes.max_delay / 2, envelope_timer)
+
+# Decides which readings also go to the alerts queue
+thresholds = ThresholdEngine()
+
+print(f"Starting IoT sensor emitter ({publisher.encoder_name} encoder)... Press CTRL+C to exit")
 
 try:
     while True:
@@ -36,65 +109,47 @@ try:
             "temperature": temperature,
             "humidity": humidity,
             "soil_moisture": soil_moisture,
-            "device_id": "farm_sensor_01"
+            "device_id": args.device_id
         }
         
-        message = json.dumps(payload)
-        print(type(message))#str
-        
-        # Check for alert conditions
-        alert = temperature > 35 or humidity < 30 or soil_moisture < 250
+        # Check for alert conditions (rules from threshold_rules.json, reloaded when it changes);
+        # the first reading back in range goes to the alerts queue too, so the alert clears
+        alert = thresholds.needs_alert_route([payload])[0]
         
-        # Publish to fanout exchange (broadcasts to all consumers)
-        channel.basic_publish(
-            exchange='sensors.fanout',
-            routing_key='',
-            body=message
-        )
+        # Fanout broadcasts to all consumers (it ignores the routing key,
+        # which picks the device's shard queue for sharded consumers)
+        routes = [('sensors.fanout', device_routing_key(args.device_id), payload, None)]
         
-        # Publish to direct exchange (with routing key)
+        # Direct exchange (with routing key) only for alerts and the reading that ends one
         if alert:
-            channel.basic_publish(
-                exchange='sensors.direct',
-                routing_key='alerts',
-                body=message
-            )
-        
-        # Publish to topic exchange (with routing patterns)
-        channel.basic_publish(
-            exchange='sensors.topic',
-            routing_key='sensor.temperature',
-            body=json.dumps({"temperature": temperature, "timestamp": timestamp})
-        )
+            routes.append(('sensors.direct', 'alerts', payload, None))
         
-        channel.basic_publish(
-            exchange='sensors.topic',
-            routing_key='sensor.humidity',
-            body=json.dumps({"humidity": humidity, "timestamp": timestamp})
-        )
+        # Topic exchange (with routing patterns), one payload per sensor type
+        routes.append(('sensors.topic', 'sensor.temperature', {"temperature": temperature, "timestamp": timestamp}, None))
+        routes.append(('sensors.topic', 'sensor.humidity', {"humidity": humidity, "timestamp": timestamp}, None))
+        routes.append(('sensors.topic', 'sensor.soil', {"soil_moisture": soil_moisture, "timestamp": timestamp}, None))
         
-        channel.basic_publish(
-            exchange='sensors.topic',
-            routing_key='sensor.soil',
-            body=json.dumps({"soil_moisture": soil_moisture, "timestamp": timestamp})
-        )
+        # Headers exchange
+        routes.append(('sensors.headers', '', payload, headers_properties))
         
-        # Publish to headers exchange
-        channel.basic_publish(
-            exchange='sensors.headers',
-            routing_key='',
-            properties=pika.BasicProperties(
-                headers={'device_type': 'environment', 'location': 'field_1'}
-            ),
-            body=message
-        )
+        if envelopes is not None:
+            # Queued until the envelope is full or the timer sends it
+            envelopes.add(routes)
+        else:
+            # Serializes each distinct payload once
+            publisher.publish_payloads(routes)
         
         # Print what was sent
-        print(f"Sent: {message}")
+        encode_us, publish_us = publisher.stats.per_reading_us()
+        print(f"Sent: {payload} (avg per reading: {publisher.stats.bytes_per_reading():.0f} bytes, "
+              f"encode {encode_us:.0f}us, publish {publish_us:.0f}us)")
         
         # Wait for a few seconds before sending the next reading
-        time.sleep(random.uniform(2, 5))
+        # (connection.sleep keeps handling confirms and heartbeats meanwhile)
+        connection.sleep(args.interval if args.interval is not None else random.uniform(2, 5))
 
 except KeyboardInterrupt:
     print("Stopping sensor emitter")
-    connection.close() 
\ No newline at end of file
+    if envelopes is not None:
+        envelopes.flush()
+    close_connection() 
\ No newline at end of file
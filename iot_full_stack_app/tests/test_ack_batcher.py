@@ -0,0 +1,92 @@
+"""
+Tests for ack_batcher.py.
+
+Run from iot_full_stack_app:
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import time
+import unittest
+
+# Add parent directory to path to import the app's modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ack_batcher import AckBatcher
+
+
+class AckBatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.acks = []
+        self.batcher = AckBatcher(lambda tag, multiple: self.acks.append((tag, multiple)),
+                                  every=3, max_delay_ms=1000)
+
+    def test_acks_once_per_full_batch(self):
+        for tag in (1, 2):
+            self.batcher.done(tag)
+        self.assertEqual(self.acks, [])
+        self.batcher.done(3)
+        self.assertEqual(self.acks, [(3, True)])
+        self.assertEqual(self.batcher.pending, 0)
+        self.assertEqual(self.batcher.messages_settled, 3)
+
+    def test_out_of_order_settlement_waits_for_the_gap(self):
+        # 2, 3 and 4 are handled before 1, so nothing may be acked yet
+        for tag in (2, 3, 4):
+            self.batcher.done(tag)
+        self.assertEqual(self.acks, [])
+        self.assertEqual(self.batcher.pending, 0)
+
+        self.batcher.done(1)
+        self.assertEqual(self.acks, [(4, True)])
+
+    def test_ack_never_names_a_tag_beyond_the_gap(self):
+        self.batcher.done(1)
+        self.batcher.done(3)
+        self.assertEqual(self.batcher.flush(), 1)
+        self.assertEqual(self.acks, [(1, True)])
+
+        self.batcher.done(2)
+        self.batcher.flush()
+        self.assertEqual(self.acks, [(1, True), (3, True)])
+
+    def test_nacked_tags_are_not_acked(self):
+        self.batcher.done(1)
+        self.batcher.done(2, ok=False)
+        self.batcher.done(3, ok=False)
+        # The batch is full, but the ack only covers the last good tag
+        self.assertEqual(self.acks, [(1, True)])
+        self.assertEqual(self.batcher.messages_settled, 3)
+
+    def test_all_nacked_batch_sends_no_ack(self):
+        for tag in (1, 2, 3):
+            self.batcher.done(tag, ok=False)
+        self.assertEqual(self.acks, [])
+        self.assertEqual(self.batcher.ack_frames, 0)
+        self.assertEqual(self.batcher.pending, 0)
+
+    def test_duplicate_and_old_tags_are_ignored(self):
+        for tag in (1, 2, 3):
+            self.batcher.done(tag)
+        self.batcher.done(2)
+        self.batcher.done(3)
+        self.assertEqual(self.batcher.pending, 0)
+        self.assertEqual(self.acks, [(3, True)])
+
+    def test_flush_if_due_waits_for_max_delay(self):
+        batcher = AckBatcher(lambda tag, multiple: self.acks.append(tag), every=100, max_delay_ms=20)
+        batcher.done(1)
+        batcher.flush_if_due()
+        self.assertEqual(self.acks, [])
+        time.sleep(0.03)
+        batcher.flush_if_due()
+        self.assertEqual(self.acks, [1])
+
+    def test_flush_without_pending_is_a_no_op(self):
+        self.assertEqual(self.batcher.flush(), 0)
+        self.assertEqual(self.acks, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
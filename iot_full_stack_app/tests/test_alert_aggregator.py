@@ -0,0 +1,108 @@
+"""
+Tests for alert_aggregator.py.
+
+Run from iot_full_stack_app:
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+# Add parent directory to path to import the app's modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from alert_aggregator import AlertAggregator, OPEN, ONGOING, CLEARED
+
+METRICS = ("temperature", "humidity")
+
+
+def states(transitions):
+    return [(t.state, t.device_id, t.metric) for t in transitions]
+
+
+class AlertAggregatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.aggregator = AlertAggregator(cooldown=60, clear_after=30, max_active=100)
+
+    def test_first_alerting_reading_opens(self):
+        transitions = self.aggregator.update("dev", {"temperature": ("HIGH", 36)}, METRICS, now=0)
+        self.assertEqual(states(transitions), [(OPEN, "dev", "temperature")])
+        self.assertEqual(len(self.aggregator), 1)
+
+    def test_repeats_within_cooldown_are_suppressed(self):
+        self.aggregator.update("dev", {"temperature": ("HIGH", 36)}, METRICS, now=0)
+        for now in (10, 20, 30):
+            self.assertEqual(self.aggregator.update("dev", {"temperature": ("HIGH", 37)}, METRICS, now=now), [])
+        self.assertEqual(self.aggregator.stats.suppressed, 3)
+
+    def test_reminder_after_cooldown_reports_count_and_peak(self):
+        self.aggregator.update("dev", {"temperature": ("HIGH", 36)}, METRICS, now=0)
+        self.aggregator.update("dev", {"temperature": ("HIGH", 39)}, METRICS, now=20)
+        transitions = self.aggregator.update("dev", {"temperature": ("HIGH", 37)}, METRICS, now=60)
+        self.assertEqual(states(transitions), [(ONGOING, "dev", "temperature")])
+        self.assertEqual(transitions[0].readings, 2)
+        self.assertEqual(transitions[0].peak, 39)
+
+        # The next reminder starts counting afresh
+        transitions = self.aggregator.update("dev", {"temperature": ("HIGH", 36)}, METRICS, now=120)
+        self.assertEqual(transitions[0].readings, 1)
+        self.assertEqual(transitions[0].peak, 37)
+
+    def test_low_alert_peak_is_the_minimum(self):
+        self.aggregator.update("dev", {"humidity": ("LOW", 25)}, METRICS, now=0)
+        self.aggregator.update("dev", {"humidity": ("LOW", 20)}, METRICS, now=10)
+        transitions = self.aggregator.update("dev", {"humidity": ("LOW", 22)}, METRICS, now=60)
+        self.assertEqual(transitions[0].peak, 20)
+
+    def test_reading_back_in_range_clears(self):
+        self.aggregator.update("dev", {"temperature": ("HIGH", 36)}, METRICS, now=0)
+        transitions = self.aggregator.update("dev", {}, METRICS, now=5)
+        self.assertEqual(states(transitions), [(CLEARED, "dev", "temperature")])
+        self.assertEqual(transitions[0].reason, "back in range")
+        self.assertEqual(len(self.aggregator), 0)
+
+    def test_metric_not_checked_does_not_clear(self):
+        self.aggregator.update("dev", {"temperature": ("HIGH", 36)}, METRICS, now=0)
+        self.assertEqual(self.aggregator.update("dev", {}, ("humidity",), now=5), [])
+        self.assertEqual(len(self.aggregator), 1)
+
+    def test_switching_sides_clears_then_opens(self):
+        self.aggregator.update("dev", {"temperature": ("HIGH", 36)}, METRICS, now=0)
+        transitions = self.aggregator.update("dev", {"temperature": ("LOW", -1)}, METRICS, now=5)
+        self.assertEqual([t.state for t in transitions], [CLEARED, OPEN])
+        self.assertEqual(transitions[1].alert.level, "LOW")
+
+    def test_expire_clears_only_stale_alerts(self):
+        self.aggregator.update("a", {"temperature": ("HIGH", 36)}, METRICS, now=0)
+        self.aggregator.update("b", {"temperature": ("HIGH", 36)}, METRICS, now=20)
+        self.assertEqual(self.aggregator.expire(now=29), [])
+        self.assertEqual(states(self.aggregator.expire(now=30)), [(CLEARED, "a", "temperature")])
+        self.assertEqual(states(self.aggregator.expire(now=50)), [(CLEARED, "b", "temperature")])
+
+    def test_expire_disabled(self):
+        aggregator = AlertAggregator(clear_after=0)
+        aggregator.update("dev", {"temperature": ("HIGH", 36)}, METRICS, now=0)
+        self.assertEqual(aggregator.expire(now=10 ** 6), [])
+
+    def test_least_recently_seen_alert_is_evicted(self):
+        aggregator = AlertAggregator(max_active=2)
+        aggregator.update("a", {"temperature": ("HIGH", 36)}, METRICS, now=0)
+        aggregator.update("b", {"temperature": ("HIGH", 36)}, METRICS, now=1)
+        aggregator.update("a", {"temperature": ("HIGH", 36)}, METRICS, now=2)
+        aggregator.update("c", {"temperature": ("HIGH", 36)}, METRICS, now=3)
+        self.assertEqual(len(aggregator), 2)
+        self.assertEqual(aggregator.stats.evicted, 1)
+        # "b" was dropped, so its next reading opens a new alert
+        transitions = aggregator.update("b", {"temperature": ("HIGH", 36)}, METRICS, now=4)
+        self.assertEqual([t.state for t in transitions], [OPEN])
+
+    def test_per_metric_cooldown(self):
+        aggregator = AlertAggregator(cooldown=60, cooldowns={"humidity": 5})
+        aggregator.update("dev", {"humidity": ("LOW", 20)}, METRICS, now=0)
+        transitions = aggregator.update("dev", {"humidity": ("LOW", 20)}, METRICS, now=5)
+        self.assertEqual([t.state for t in transitions], [ONGOING])
+
+
+if __name__ == "__main__":
+    unittest.main()
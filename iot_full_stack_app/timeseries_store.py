@@ -0,0 +1,552 @@
+"""
+Columnar time-series store for sensor readings.
+
+Readings are kept as fixed-width little-endian binary columns, one file per
+field, grouped into segment directories:
+
+    data/timeseries/
+    ├── devices.json            device_id dictionary (code = list index)
+    ├── index.bin               per-device block index (see timeseries_index.py)
+    ├── seg-000000/
+    │   ├── timestamp.f64
+    │   ├── temperature.f32
+    │   ├── humidity.f32
+    │   ├── soil_moisture.i16
+    │   └── device.u16
+    └── seg-000001/ ...
+
+Readers memory-map the column files and get NumPy arrays without parsing.
+Range queries for one device use the block index to seek straight to the
+rows they need:
+
+    store = TimeSeriesStore("data/timeseries")
+    for reading in store.query("farm_sensor_01", start=t1, end=t2):
+        ...
+
+Usage (one-shot import of the old CSV log; refuses a store that already
+holds readings unless --append is given):
+    python timeseries_store.py data/sensor_data.csv data/timeseries
+"""
+
+import csv
+import json
+import math
+import os
+import sys
+
+import numpy as np
+
+from batched_writer import BatchedWriter
+from timeseries_index import SensorIndex, INDEX_FILE, block_entries, append_entries
+
+# Column name -> NumPy dtype (explicit little-endian so files are portable)
+COLUMNS = {
+    "timestamp": np.dtype("<f8"),
+    "temperature": np.dtype("<f4"),
+    "humidity": np.dtype("<f4"),
+    "soil_moisture": np.dtype("<i2"),
+    "device": np.dtype("<u2"),
+}
+COLUMN_FILES = {
+    "timestamp": "timestamp.f64",
+    "temperature": "temperature.f32",
+    "humidity": "humidity.f32",
+    "soil_moisture": "soil_moisture.i16",
+    "device": "device.u16",
+}
+
+# Stored when a reading has no soil moisture value (floats use NaN)
+MISSING_INT16 = -32768
+
+# Largest values the soil moisture and float columns can hold
+INT16_MAX = int(np.iinfo(COLUMNS["soil_moisture"]).max)
+FLOAT32_MAX = float(np.finfo(COLUMNS["temperature"]).max)
+
+# Rows per segment before a new one is started
+DEFAULT_SEGMENT_ROWS = 1 << 20
+
+DEFAULT_STORE_PATH = os.path.join("data", "timeseries")
+DEVICES_FILE = "devices.json"
+
+
+def segment_name(number):
+    return f"seg-{number:06d}"
+
+
+class TimeSeriesStore:
+    """Read-only view over a columnar store directory."""
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        self._devices = []
+        self._device_codes = {}
+        self._devices_mtime = None
+        self.index = SensorIndex(path)
+        self._segment_cache = {}
+
+    # ---------- Device dictionary ----------
+
+    def _load_devices(self):
+        devices_path = os.path.join(self.path, DEVICES_FILE)
+        try:
+            stat = os.stat(devices_path)
+        except OSError:
+            return
+        mtime = (stat.st_mtime_ns, stat.st_size)
+        if mtime == self._devices_mtime:
+            return
+        with open(devices_path) as f:
+            self._devices = json.load(f)
+        self._device_codes = {device_id: code for code, device_id in enumerate(self._devices)}
+        self._devices_mtime = mtime
+
+    def devices(self):
+        """Return all known device IDs, indexed by their code."""
+        self._load_devices()
+        return list(self._devices)
+
+    def device_code(self, device_id):
+        """
+        Look up the dictionary code for a device.
+
+        Returns:
+            int: The code, or None if the device has never been logged
+        """
+        self._load_devices()
+        return self._device_codes.get(device_id)
+
+    def decode_devices(self, codes):
+        """Turn an array of device codes back into device IDs."""
+        self._load_devices()
+        return np.asarray(self._devices, dtype=object)[codes]
+
+    # ---------- Segments ----------
+
+    def segment_names(self):
+        """Return segment directory names in write order."""
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(name for name in os.listdir(self.path) if name.startswith("seg-"))
+
+    def segment_rows(self, name):
+        """
+        Count the complete rows in a segment.
+
+        Columns are appended one after another, so after a crash the last
+        batch may be only partly written. Only rows present in every column count.
+        """
+        rows = None
+        for column, filename in COLUMN_FILES.items():
+            try:
+                size = os.path.getsize(os.path.join(self.path, name, filename))
+            except OSError:
+                size = 0
+            column_rows = size // COLUMNS[column].itemsize
+            rows = column_rows if rows is None else min(rows, column_rows)
+        return rows or 0
+
+    def open_segment(self, name, columns=None):
+        """
+        Memory-map the columns of one segment.
+
+        Args:
+            name (str): Segment directory name
+            columns (list, optional): Columns to map, all of them by default
+
+        Returns:
+            dict: Column name -> read-only NumPy array
+        """
+        self._load_devices()
+        rows = self.segment_rows(name)
+        arrays = {}
+        for column in columns or COLUMNS:
+            dtype = COLUMNS[column]
+            if rows == 0:
+                arrays[column] = np.empty(0, dtype=dtype)
+                continue
+            arrays[column] = np.memmap(
+                os.path.join(self.path, name, COLUMN_FILES[column]),
+                dtype=dtype, mode="r", shape=(rows,)
+            )
+        return arrays
+
+    def read(self, columns=None, device_id=None):
+        """
+        Read whole columns across all segments.
+
+        Args:
+            columns (list, optional): Columns to read, all of them by default
+            device_id (str, optional): Only return rows for this device
+
+        Returns:
+            dict: Column name -> NumPy array
+        """
+        columns = list(columns or COLUMNS)
+        wanted = list(columns)
+        if device_id is not None and "device" not in wanted:
+            wanted.append("device")
+
+        code = None
+        if device_id is not None:
+            code = self.device_code(device_id)
+            if code is None:
+                return {column: np.empty(0, dtype=COLUMNS[column]) for column in columns}
+
+        parts = {column: [] for column in columns}
+        for name in self.segment_names():
+            arrays = self.open_segment(name, wanted)
+            if code is not None:
+                mask = arrays["device"] == code
+                for column in columns:
+                    parts[column].append(arrays[column][mask])
+            else:
+                for column in columns:
+                    parts[column].append(np.asarray(arrays[column]))
+
+        return {
+            column: np.concatenate(chunks) if chunks else np.empty(0, dtype=COLUMNS[column])
+            for column, chunks in parts.items()
+        }
+
+    # ---------- Indexed range queries ----------
+
+    def _segment_arrays(self, segment, min_rows):
+        """Return cached memory maps for a segment, remapping it if it has grown."""
+        cached = self._segment_cache.get(segment)
+        if cached is None or len(cached["timestamp"]) < min_rows:
+            cached = self.open_segment(segment_name(segment))
+            self._segment_cache[segment] = cached
+        return cached
+
+    def query_blocks(self, device_id, start=None, end=None, columns=None):
+        """
+        Stream one device's readings in [start, end] as blocks of NumPy arrays.
+
+        Only the blocks the index says overlap the window are read, so the
+        cost follows the size of the result, not the size of the store.
+
+        Args:
+            device_id (str): Device to read
+            start (float, optional): First timestamp to include
+            end (float, optional): Last timestamp to include
+            columns (list, optional): Columns to return, all of them by default
+
+        Yields:
+            dict: Column name -> NumPy array for each matching block
+        """
+        code = self.device_code(device_id)
+        if code is None:
+            return
+        columns = list(columns or COLUMNS)
+
+        for entry in self.index.find(code, start, end):
+            arrays = self._segment_arrays(int(entry["segment"]), int(entry["end_row"]))
+            rows = slice(int(entry["start_row"]), int(entry["end_row"]))
+
+            # Other devices share the block, and its edges may fall outside the window
+            timestamps = arrays["timestamp"][rows]
+            mask = arrays["device"][rows] == code
+            if start is not None:
+                mask &= timestamps >= start
+            if end is not None:
+                mask &= timestamps <= end
+            if not mask.any():
+                continue
+            yield {column: arrays[column][rows][mask] for column in columns}
+
+    def query(self, device_id, start=None, end=None):
+        """
+        Stream one device's readings in [start, end] as dictionaries.
+
+        Yields:
+            dict: A reading in the same shape the sensor emitter publishes
+        """
+        for block in self.query_blocks(device_id, start, end):
+            for timestamp, temperature, humidity, soil_moisture in zip(
+                block["timestamp"].tolist(), block["temperature"].tolist(),
+                block["humidity"].tolist(), block["soil_moisture"].tolist()
+            ):
+                yield {
+                    "timestamp": timestamp,
+                    "temperature": round(temperature, 2),
+                    "humidity": round(humidity, 2),
+                    "soil_moisture": None if soil_moisture == MISSING_INT16 else soil_moisture,
+                    "device_id": device_id,
+                }
+
+    def rebuild_index(self, block_rows=4096):
+        """
+        Rewrite the block index from the stored columns.
+        Used for stores written before the index existed.
+        """
+        index_path = os.path.join(self.path, INDEX_FILE)
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            for name in self.segment_names():
+                arrays = self.open_segment(name, ["timestamp", "device"])
+                number = int(name[4:])
+                for first_row in range(0, len(arrays["timestamp"]), block_rows):
+                    rows = slice(first_row, first_row + block_rows)
+                    append_entries(f, block_entries(
+                        number, first_row,
+                        np.asarray(arrays["timestamp"][rows]),
+                        np.asarray(arrays["device"][rows])
+                    ))
+            os.fsync(f.fileno())
+        os.replace(tmp_path, index_path)
+        self.index = SensorIndex(self.path)
+
+
+class TimeSeriesWriter(BatchedWriter):
+    """
+    Append readings to a columnar store in batches.
+
+    Rows are tuples of (timestamp, temperature, humidity, soil_moisture, device_id).
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH, segment_rows=DEFAULT_SEGMENT_ROWS, **kwargs):
+        """
+        Args:
+            path (str): Store directory
+            segment_rows (int): Rows per segment before a new segment is started
+            **kwargs: Batching options passed to BatchedWriter
+        """
+        super().__init__(**kwargs)
+        self.store = TimeSeriesStore(path)
+        self.path = path
+        self.segment_rows_limit = segment_rows
+        os.makedirs(path, exist_ok=True)
+
+        self._devices = self.store.devices()
+        self._device_codes = {device_id: code for code, device_id in enumerate(self._devices)}
+
+        segments = self.store.segment_names()
+        self._segment_number = int(segments[-1][4:]) if segments else 0
+        self._segment_rows = self.store.segment_rows(segments[-1]) if segments else 0
+        self._files = {}
+        self._open_segment()
+        self.rows_dropped = 0
+
+        # Index every batch as it is written
+        index_path = os.path.join(path, INDEX_FILE)
+        if not os.path.exists(index_path) and segments:
+            self.store.rebuild_index()
+        self._index_file = open(index_path, "ab")
+
+    def _open_segment(self):
+        name = segment_name(self._segment_number)
+        segment_path = os.path.join(self.path, name)
+        os.makedirs(segment_path, exist_ok=True)
+        for column, filename in COLUMN_FILES.items():
+            column_path = os.path.join(segment_path, filename)
+            f = open(column_path, "ab")
+            # Drop a partly written trailing batch left behind by a crash
+            complete = self._segment_rows * COLUMNS[column].itemsize
+            if f.tell() > complete:
+                f.truncate(complete)
+                f.seek(complete)
+            self._files[column] = f
+        self.segment = name
+
+    def _roll_segment(self):
+        self._sync()
+        for f in self._files.values():
+            f.close()
+        self._segment_number += 1
+        self._segment_rows = 0
+        self._open_segment()
+
+    def _encode_device(self, device_id):
+        """Code of a device in the device column, or None if the column has no codes left."""
+        code = self._device_codes.get(device_id)
+        if code is None:
+            code = len(self._devices)
+            if code > np.iinfo(COLUMNS["device"]).max:
+                return None
+            # Write the dictionary before any row refers to the new code
+            devices_path = os.path.join(self.path, DEVICES_FILE)
+            tmp_path = devices_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self._devices + [device_id], f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, devices_path)
+            self._devices.append(device_id)
+            self._device_codes[device_id] = code
+        return code
+
+    def _write_rows(self, rows):
+        while rows:
+            room = self.segment_rows_limit - self._segment_rows
+            if room <= 0:
+                self._roll_segment()
+                continue
+            chunk = rows[:room]
+            self._write_chunk(chunk)
+            # Drop written rows so a failed flush keeps only the rest
+            del rows[:len(chunk)]
+
+    def _write_chunk(self, rows):
+        codes = [self._encode_device(row[4]) for row in rows]
+        if None in codes:
+            # These rows can never be stored; drop them so the rest of the batch (and its acks) go through
+            dropped = codes.count(None)
+            self.rows_dropped += dropped
+            print(f"Dropped {dropped} readings: too many distinct device IDs for the device column")
+            rows = [row for row, code in zip(rows, codes) if code is not None]
+            codes = [code for code in codes if code is not None]
+            if not rows:
+                return
+
+        timestamps, temperatures, humidities, soil, _ = zip(*rows)
+        columns = {
+            "timestamp": np.asarray(timestamps, dtype=COLUMNS["timestamp"]),
+            "temperature": np.asarray(temperatures, dtype=COLUMNS["temperature"]),
+            "humidity": np.asarray(humidities, dtype=COLUMNS["humidity"]),
+            "soil_moisture": np.asarray(soil, dtype=COLUMNS["soil_moisture"]),
+            "device": np.asarray(codes, dtype=COLUMNS["device"]),
+        }
+        index_size = self._index_file.tell()
+        try:
+            for column, values in columns.items():
+                self._files[column].write(values.tobytes())
+            for f in self._files.values():
+                f.flush()
+
+            # The index entry goes in only after the rows it points to
+            append_entries(self._index_file, block_entries(
+                self._segment_number, self._segment_rows, columns["timestamp"], columns["device"]
+            ))
+        except Exception:
+            # Keep the columns aligned for the retry: cut every file back to its last complete row
+            self._rollback(index_size)
+            raise
+        self._segment_rows += len(rows)
+
+    def _rollback(self, index_size):
+        # Closing may try to flush what is still buffered, so close before truncating
+        for f in list(self._files.values()) + [self._index_file]:
+            try:
+                f.close()
+            except OSError:
+                pass
+        # Reopening the segment truncates each column to _segment_rows
+        self._open_segment()
+        index_path = os.path.join(self.path, INDEX_FILE)
+        self._index_file = open(index_path, "ab")
+        if self._index_file.tell() > index_size:
+            self._index_file.truncate(index_size)
+            self._index_file.seek(index_size)
+
+    def _sync(self):
+        for f in self._files.values():
+            f.flush()
+            os.fsync(f.fileno())
+        self._index_file.flush()
+        os.fsync(self._index_file.fileno())
+
+    def _close(self):
+        for f in self._files.values():
+            f.close()
+        self._index_file.close()
+
+
+def _float32_value(name, value):
+    # NaN marks a missing value; anything else has to fit a float32 column
+    if value in (None, ""):
+        return np.nan
+    value = float(value)
+    if not math.isnan(value) and not abs(value) <= FLOAT32_MAX:
+        raise ValueError(f"{name} {value} does not fit the {name} column")
+    return value
+
+
+def reading_to_row(data):
+    """
+    Convert a sensor reading dict into a TimeSeriesWriter row.
+    Missing values become NaN (or MISSING_INT16 for soil moisture).
+
+    Every value is checked against its column here, so a bad reading is
+    rejected on its own instead of failing the whole batch it lands in.
+
+    Raises:
+        ValueError: If a value is not a number or does not fit its column
+    """
+    timestamp = float(data.get("timestamp", 0))
+    if not math.isfinite(timestamp):
+        raise ValueError(f"timestamp {timestamp} is not a finite number")
+
+    soil_moisture = data.get("soil_moisture")
+    if soil_moisture in (None, ""):
+        soil_moisture = MISSING_INT16
+    else:
+        soil_moisture = int(soil_moisture)
+        # MISSING_INT16 itself is reserved for missing values
+        if not MISSING_INT16 < soil_moisture <= INT16_MAX:
+            raise ValueError(f"soil_moisture {soil_moisture} does not fit the soil_moisture column")
+
+    device_id = data.get("device_id") or ""
+    if not isinstance(device_id, str):
+        raise ValueError(f"device_id {device_id!r} is not a string")
+
+    return (
+        timestamp,
+        _float32_value("temperature", data.get("temperature")),
+        _float32_value("humidity", data.get("humidity")),
+        soil_moisture,
+        device_id,
+    )
+
+
+def import_csv(csv_path, store_path=DEFAULT_STORE_PATH, batch_rows=100000, append=False):
+    """
+    Import an existing sensor_data.csv log into a columnar store.
+
+    Rows are appended as they are, so importing the same file twice stores
+    every reading twice. Unless append is set, a store that already holds
+    readings is refused.
+
+    Args:
+        csv_path (str): CSV file written by the old data logger
+        store_path (str): Store directory to append to
+        batch_rows (int): Rows written per batch
+        append (bool): Import even if the store already holds readings
+
+    Returns:
+        int: Number of rows imported
+
+    Raises:
+        ValueError: If the store already holds readings and append is not set
+    """
+    store = TimeSeriesStore(store_path)
+    if not append and any(store.segment_rows(name) for name in store.segment_names()):
+        raise ValueError(f"{store_path} already holds readings; importing again would duplicate them")
+
+    writer = TimeSeriesWriter(store_path, max_rows=batch_rows, fsync_policy="never")
+    with open(csv_path, newline="") as f:
+        for record in csv.DictReader(f):
+            writer.write(reading_to_row({
+                "timestamp": record["timestamp"],
+                "temperature": record["temperature"],
+                "humidity": record["humidity"],
+                "soil_moisture": record["soil_moisture"],
+                "device_id": record["device_id"],
+            }))
+    writer.close()
+    return writer.rows_written
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != "--append"]
+    if not args:
+        print("Usage: python timeseries_store.py <sensor_data.csv> [store_dir] [--append]")
+        sys.exit(1)
+
+    source = args[0]
+    target = args[1] if len(args) > 1 else DEFAULT_STORE_PATH
+    try:
+        imported = import_csv(source, target, append="--append" in sys.argv)
+    except ValueError as e:
+        print(f"{e} (pass --append to import anyway)")
+        sys.exit(1)
+    print(f"Imported {imported} readings from {source} into {target}")
@@ -0,0 +1,293 @@
+"""
+Wire formats for sensor readings.
+
+Readings can travel as JSON text (the default) or in a compact versioned
+binary layout. The publisher marks each message with its content type and
+consumers decode whatever they receive, so JSON stays available as the
+fallback for any producer or consumer that does not know the binary format.
+
+Binary layout, version 1 (little-endian, 19 bytes + device id):
+
+    offset  size  field
+    0       1     version (1)
+    1       1     flags: bit set for each field present (see FLAG_*)
+    2       8     timestamp, float64 seconds since the epoch
+    10      2     temperature, int16 hundredths of a °C
+    12      2     humidity, uint16 hundredths of a %
+    14      4     soil_moisture, int32
+    18      1     device id length n
+    19      n     device id, UTF-8
+
+Envelopes: a high-frequency device can send several readings in one message.
+The envelope has its own content type: {"readings": [...]} for JSON, and for
+binary a version byte and uint16 count followed by that many readings, each
+prefixed with its uint16 length. iter_readings() yields the readings of any
+message, batched or not, so handlers never see the difference.
+
+Benchmark (bytes per message and encode/decode time):
+
+    python wire_format.py
+"""
+
+import json
+import struct
+import time
+
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_BINARY = "application/vnd.iot.reading"
+CONTENT_TYPE_JSON_BATCH = "application/vnd.iot.reading-batch+json"
+CONTENT_TYPE_BINARY_BATCH = "application/vnd.iot.reading-batch"
+
+BINARY_VERSION = 1
+
+WIRE_FORMATS = ("json", "binary")
+
+_HEADER = struct.Struct("<BBdhHiB")
+# The same header split after the timestamp, for re-stamping pre-encoded readings
+_PREFIX = struct.Struct("<BBd")
+_SUFFIX = struct.Struct("<hHiB")
+_BATCH_HEADER = struct.Struct("<BH")
+_LENGTH = struct.Struct("<H")
+
+# Most readings one envelope can carry (uint16 count)
+MAX_ENVELOPE_READINGS = 65535
+
+FLAG_TIMESTAMP = 0x01
+FLAG_TEMPERATURE = 0x02
+FLAG_HUMIDITY = 0x04
+FLAG_SOIL_MOISTURE = 0x08
+FLAG_DEVICE_ID = 0x10
+FLAGS_FULL_READING = FLAG_TIMESTAMP | FLAG_TEMPERATURE | FLAG_HUMIDITY | FLAG_SOIL_MOISTURE | FLAG_DEVICE_ID
+
+
+def encode_binary(reading):
+    """
+    Pack a reading dict into the version 1 binary layout.
+
+    Args:
+        reading (dict): Any of timestamp, temperature, humidity, soil_moisture, device_id
+
+    Returns:
+        bytes: The packed reading
+
+    Raises:
+        ValueError: If a value is out of range for its field
+    """
+    flags = 0
+    timestamp = reading.get("timestamp")
+    temperature = reading.get("temperature")
+    humidity = reading.get("humidity")
+    soil_moisture = reading.get("soil_moisture")
+    device_id = reading.get("device_id")
+
+    if timestamp is not None:
+        flags |= FLAG_TIMESTAMP
+    if temperature is not None:
+        flags |= FLAG_TEMPERATURE
+    if humidity is not None:
+        flags |= FLAG_HUMIDITY
+    if soil_moisture is not None:
+        flags |= FLAG_SOIL_MOISTURE
+    device = b""
+    if device_id is not None:
+        flags |= FLAG_DEVICE_ID
+        device = device_id.encode()
+        if len(device) > 255:
+            raise ValueError(f"Device id too long for the binary format: {device_id}")
+
+    try:
+        header = _HEADER.pack(
+            BINARY_VERSION,
+            flags,
+            timestamp or 0.0,
+            round(temperature * 100) if temperature is not None else 0,
+            round(humidity * 100) if humidity is not None else 0,
+            round(soil_moisture) if soil_moisture is not None else 0,
+            len(device)
+        )
+    except struct.error as e:
+        raise ValueError(f"Reading does not fit the binary format: {e}")
+    return header + device
+
+
+def binary_reading_suffix(temperature, humidity, soil_moisture, device_id):
+    """
+    Encode everything after the timestamp of a full reading.
+    binary_reading_prefix(timestamp) + suffix equals encode_binary() of the
+    reading, so load generators can pre-encode readings and stamp them late.
+    """
+    device = device_id.encode()
+    return _SUFFIX.pack(round(temperature * 100), round(humidity * 100),
+                        round(soil_moisture), len(device)) + device
+
+
+def binary_reading_prefix(timestamp):
+    """Version, flags and timestamp of a full reading (see binary_reading_suffix)."""
+    return _PREFIX.pack(BINARY_VERSION, FLAGS_FULL_READING, timestamp)
+
+
+def decode_binary(body):
+    """
+    Unpack a binary reading back into the same dict the JSON format carries.
+
+    Raises:
+        ValueError: If the body is truncated or uses an unknown version
+    """
+    if len(body) < _HEADER.size:
+        raise ValueError(f"Binary reading too short: {len(body)} bytes")
+    version, flags, timestamp, temperature, humidity, soil_moisture, length = _HEADER.unpack_from(body)
+    if version != BINARY_VERSION:
+        raise ValueError(f"Unsupported binary reading version: {version}")
+    if len(body) < _HEADER.size + length:
+        raise ValueError("Binary reading truncated in device id")
+
+    reading = {}
+    if flags & FLAG_TIMESTAMP:
+        reading["timestamp"] = timestamp
+    if flags & FLAG_TEMPERATURE:
+        reading["temperature"] = temperature / 100
+    if flags & FLAG_HUMIDITY:
+        reading["humidity"] = humidity / 100
+    if flags & FLAG_SOIL_MOISTURE:
+        reading["soil_moisture"] = soil_moisture
+    if flags & FLAG_DEVICE_ID:
+        reading["device_id"] = body[_HEADER.size:_HEADER.size + length].decode()
+    return reading
+
+
+def content_type_for(wire_format):
+    """Content type header value for a wire format name."""
+    if wire_format == "binary":
+        return CONTENT_TYPE_BINARY
+    if wire_format == "json":
+        return CONTENT_TYPE_JSON
+    raise ValueError(f"Unknown wire format: {wire_format}")
+
+
+def batch_content_type_for(wire_format):
+    """Content type header value for an envelope in a wire format."""
+    if wire_format == "binary":
+        return CONTENT_TYPE_BINARY_BATCH
+    if wire_format == "json":
+        return CONTENT_TYPE_JSON_BATCH
+    raise ValueError(f"Unknown wire format: {wire_format}")
+
+
+def encode_binary_envelope(readings):
+    """
+    Pack several readings into one binary envelope.
+
+    Args:
+        readings (list): Reading dicts
+
+    Returns:
+        bytes: The envelope
+    """
+    if len(readings) > MAX_ENVELOPE_READINGS:
+        raise ValueError(f"Too many readings for one envelope: {len(readings)}")
+    parts = [_BATCH_HEADER.pack(BINARY_VERSION, len(readings))]
+    for reading in readings:
+        packed = encode_binary(reading)
+        parts.append(_LENGTH.pack(len(packed)))
+        parts.append(packed)
+    return b"".join(parts)
+
+
+def iter_binary_envelope(body):
+    """Yield the readings of a binary envelope one at a time."""
+    if len(body) < _BATCH_HEADER.size:
+        raise ValueError(f"Binary envelope too short: {len(body)} bytes")
+    version, count = _BATCH_HEADER.unpack_from(body)
+    if version != BINARY_VERSION:
+        raise ValueError(f"Unsupported binary envelope version: {version}")
+    offset = _BATCH_HEADER.size
+    for _ in range(count):
+        if len(body) < offset + _LENGTH.size:
+            raise ValueError("Binary envelope truncated")
+        (length,) = _LENGTH.unpack_from(body, offset)
+        offset += _LENGTH.size
+        yield decode_binary(body[offset:offset + length])
+        offset += length
+
+
+def iter_readings(body, properties=None):
+    """
+    Yield every reading in a message, whether it is a single reading or an
+    envelope, in either wire format.
+
+    Args:
+        body (bytes): Message body
+        properties (pika.BasicProperties, optional): Message properties
+
+    Raises:
+        ValueError: If the body cannot be decoded
+    """
+    content_type = getattr(properties, "content_type", None)
+    if content_type == CONTENT_TYPE_BINARY_BATCH:
+        yield from iter_binary_envelope(body)
+    elif content_type == CONTENT_TYPE_JSON_BATCH:
+        envelope = json.loads(body)
+        if not isinstance(envelope, dict) or not isinstance(envelope.get("readings"), list):
+            raise ValueError("JSON envelope without a readings list")
+        yield from envelope["readings"]
+    else:
+        yield decode_reading(body, properties)
+
+
+def decode_reading(body, properties=None):
+    """
+    Decode a message body according to its content type.
+
+    Messages without a content type are treated as JSON, so older
+    producers keep working.
+
+    Args:
+        body (bytes): Message body
+        properties (pika.BasicProperties, optional): Message properties
+
+    Returns:
+        dict: The decoded reading
+
+    Raises:
+        ValueError: If the body cannot be decoded (json.JSONDecodeError for bad JSON)
+    """
+    content_type = getattr(properties, "content_type", None)
+    if content_type == CONTENT_TYPE_BINARY:
+        return decode_binary(body)
+    return json.loads(body)
+
+
+def benchmark(count=100000):
+    """Compare message size and encode/decode time of the formats."""
+    reading = {
+        "timestamp": time.time(),
+        "temperature": 23.4,
+        "humidity": 55.1,
+        "soil_moisture": 512,
+        "device_id": "farm_sensor_01"
+    }
+
+    formats = [("json", lambda r: json.dumps(r).encode(), json.loads)]
+    try:
+        import orjson
+        formats.append(("orjson", orjson.dumps, orjson.loads))
+    except ImportError:
+        pass
+    formats.append(("binary", encode_binary, decode_binary))
+
+    print(f"{'format':<8} {'bytes':>6} {'encode us':>10} {'decode us':>10}")
+    for name, encode, decode in formats:
+        body = encode(reading)
+        start = time.perf_counter()
+        for _ in range(count):
+            encode(reading)
+        encode_us = (time.perf_counter() - start) / count * 1e6
+        start = time.perf_counter()
+        for _ in range(count):
+            decode(body)
+        decode_us = (time.perf_counter() - start) / count * 1e6
+        print(f"{name:<8} {len(body):>6} {encode_us:>10.2f} {decode_us:>10.2f}")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,13 +1,18 @@
 import os
 import pika
 from dotenv import load_dotenv
+from connection_manager import ConnectionManager
 
 # Load environment variables from .env file
 load_dotenv()
 
-def get_rabbitmq_connection():
+# Shared connection manager, created on first use
+_connection_manager = None
+
+def get_connection_parameters():
     """
-    Create a connection to RabbitMQ using CloudAMQP credentials from .env file.
+    Build RabbitMQ connection parameters from the .env file.
+    Heartbeat, frame size and pool tuning can be overridden with environment variables.
     """
     # Get RabbitMQ connection parameters from environment variables
     rabbitmq_host = os.getenv('RABBITMQ_HOST')
@@ -15,16 +20,46 @@ def get_rabbitmq_connection():
     rabbitmq_user = os.getenv('RABBITMQ_USER')
     rabbitmq_password = os.getenv('RABBITMQ_PASSWORD')
     rabbitmq_vhost = os.getenv('RABBITMQ_VHOST')
-    
+
     # Create credentials and connection parameters
     credentials = pika.PlainCredentials(rabbitmq_user, rabbitmq_password)
     parameters = pika.ConnectionParameters(
         host=rabbitmq_host,
         port=rabbitmq_port,
         virtual_host=rabbitmq_vhost,
-        credentials=credentials
+        credentials=credentials,
+        # Keep idle connections alive instead of letting the broker drop them
+        heartbeat=int(os.getenv('RABBITMQ_HEARTBEAT', 60)),
+        # Larger frames mean fewer frames per message body
+        frame_max=int(os.getenv('RABBITMQ_FRAME_MAX', 131072)),
+        blocked_connection_timeout=float(os.getenv('RABBITMQ_BLOCKED_TIMEOUT', 300)),
+        socket_timeout=float(os.getenv('RABBITMQ_SOCKET_TIMEOUT', 10))
     )
-    
-    # Establish connection
-    connection = pika.BlockingConnection(parameters)
-    return connection 
\ No newline at end of file
+    return parameters
+
+def get_connection_manager():
+    """
+    Return the process-wide RabbitMQ connection manager.
+    """
+    global _connection_manager
+    if _connection_manager is None:
+        _connection_manager = ConnectionManager(
+            get_connection_parameters(),
+            max_connections=int(os.getenv('RABBITMQ_POOL_SIZE', 4)),
+            retry_attempts=int(os.getenv('RABBITMQ_RETRY_ATTEMPTS', 3)),
+            retry_delay=float(os.getenv('RABBITMQ_RETRY_DELAY', 2))
+        )
+    return _connection_manager
+
+def get_rabbitmq_connection():
+    """
+    Get a connection to RabbitMQ using CloudAMQP credentials from .env file.
+    The connection comes from the shared pool and is reused by the calling thread.
+    """
+    return get_connection_manager().acquire()
+
+def get_rabbitmq_channel():
+    """
+    Get a channel for the calling thread, reusing it while it stays open.
+    """
+    return get_connection_manager().channel()
@@ -2,6 +2,7 @@ import pika
 import os
 import time
 from dotenv import load_dotenv
+from confirm_tracker import ConfirmTracker
 
 # Load environment variables
 load_dotenv()
@@ -18,12 +19,18 @@ channel = connection.channel()
 queue_name = "durable_queue"
 channel.queue_declare(queue=queue_name, durable=True)
 
+# Turn on publisher confirms: the broker acks each message once it has taken
+# responsibility for it (for persistent messages, once written to disk).
+# The tracker lets up to 100 messages wait for their ack instead of waiting
+# after every publish, and republishes any the broker nacks.
+confirms = ConfirmTracker(connection, channel, window=100)
+
 # Send a series of important messages that should survive broker restarts
 for i in range(5):
     message = f"Critical message #{i} - Should persist even if broker restarts"
     
     # Mark message as persistent - delivery_mode=2
-    channel.basic_publish(
+    confirms.publish(
         exchange="",
         routing_key=queue_name,
         body=message,
@@ -36,8 +43,12 @@ for i in range(5):
         )
     )
     
+    confirms.flush()
+    
     print(f" [x] Sent persistent message: '{message}'")
-    time.sleep(0.5)
+    connection.sleep(0.5)
 
-print(" [x] All critical messages sent")
+# Wait until the broker has confirmed every message
+confirms.wait_for_confirms(timeout=10)
+print(f" [x] All critical messages sent ({confirms.stats.confirmed} confirmed, {confirms.stats.failed} failed)")
 connection.close() 
\ No newline at end of file
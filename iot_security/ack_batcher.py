@@ -0,0 +1,102 @@
+"""
+Batched acknowledgements for RabbitMQ consumers.
+
+Instead of one basic.ack frame per message, an AckBatcher acknowledges
+everything handled so far with a single basic.ack(multiple=True) once every
+`every` messages or after `max_delay_ms`, whichever comes first. Combined
+with a prefetch window this bounds how many messages sit in client memory
+and leaves unprocessed messages on the broker if the consumer crashes.
+"""
+
+import os
+import time
+from dotenv import load_dotenv
+
+# Defaults, overridable in .env
+load_dotenv()
+DEFAULT_PREFETCH = int(os.getenv('CONSUMER_PREFETCH', 100))
+DEFAULT_ACK_EVERY = int(os.getenv('CONSUMER_ACK_EVERY', 50))
+DEFAULT_ACK_MS = int(os.getenv('CONSUMER_ACK_MS', 200))
+
+
+class AckBatcher:
+    """
+    Tracks settled delivery tags of one channel and acks them in batches.
+
+    Handlers may finish out of order (async handlers), so only the longest
+    run of settled tags starting at the first unacked one is ever covered by
+    a multiple=True ack. Rejected messages are nacked by the caller and only
+    marked settled here, so the batch ack never names a nacked tag.
+    """
+
+    def __init__(self, ack, every=DEFAULT_ACK_EVERY, max_delay_ms=DEFAULT_ACK_MS):
+        """
+        Args:
+            ack (callable): Called as ack(delivery_tag, multiple) to acknowledge
+            every (int): Ack once this many messages are settled
+            max_delay_ms (int): Ack once the oldest unacked message is this old
+        """
+        self._ack = ack
+        self.every = max(1, every)
+        self.max_delay = max_delay_ms / 1000.0
+
+        self.messages_settled = 0
+        self.ack_frames = 0
+
+        self._settled_upto = 0   # every tag up to this one is handled
+        self._acked_upto = 0     # every tag up to this one is acked
+        self._ack_tag = 0        # highest successfully handled tag within _settled_upto
+        self._out_of_order = {}  # tag -> handled ok, for tags beyond _settled_upto
+        self._first_pending_time = None
+
+    @property
+    def pending(self):
+        """Number of settled messages waiting for the next ack."""
+        return self._settled_upto - self._acked_upto
+
+    def done(self, delivery_tag, ok=True):
+        """
+        Mark a delivery as settled and ack the batch if it is full.
+
+        Args:
+            delivery_tag (int): The delivery tag of the handled message
+            ok (bool): False if the message was nacked by the caller
+        """
+        if delivery_tag <= self._settled_upto:
+            return
+
+        self._out_of_order[delivery_tag] = ok
+        while self._settled_upto + 1 in self._out_of_order:
+            self._settled_upto += 1
+            if self._out_of_order.pop(self._settled_upto):
+                self._ack_tag = self._settled_upto
+
+        if self.pending and self._first_pending_time is None:
+            self._first_pending_time = time.monotonic()
+        if self.pending >= self.every:
+            self.flush()
+
+    def flush_if_due(self):
+        """Ack pending messages if the oldest has waited longer than max_delay_ms."""
+        if self.pending and time.monotonic() - self._first_pending_time >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        """
+        Ack every settled message now.
+
+        Returns:
+            int: Number of messages covered by the ack
+        """
+        count = self.pending
+        if not count:
+            return 0
+
+        # Everything after the last good tag was nacked already
+        if self._ack_tag > self._acked_upto:
+            self._ack(self._ack_tag, True)
+            self.ack_frames += 1
+        self.messages_settled += count
+        self._acked_upto = self._settled_upto
+        self._first_pending_time = None
+        return count
@@ -0,0 +1,207 @@
+"""
+Alert aggregation for the alert handler.
+
+A sensor stuck above a threshold sends an alerting reading every few
+seconds. Instead of reporting each of them, AlertAggregator keeps one
+active alert per (device, metric) and reports transitions only:
+
+    OPEN     the metric started alerting
+    ONGOING  still alerting; at most one reminder per cooldown, with the
+             number of readings and the peak value since the last report
+    CLEARED  a reading of the device showed the metric back in range, or no
+             alerting reading arrived for clear_after seconds
+
+Active alerts are kept in an LRU (an OrderedDict in last-seen order) capped
+at max_active entries, so memory stays bounded however large the fleet is;
+the least recently seen alerts are dropped first. Since the order is also
+the expiry order, expire() only looks at the alerts it clears.
+"""
+
+import os
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+# Defaults, overridable in .env
+load_dotenv()
+DEFAULT_COOLDOWN = float(os.getenv('ALERT_COOLDOWN', 60))
+DEFAULT_CLEAR_AFTER = float(os.getenv('ALERT_CLEAR_AFTER', 30))
+DEFAULT_MAX_ACTIVE = int(os.getenv('ALERT_MAX_ACTIVE', 10000))
+
+OPEN = "OPEN"
+ONGOING = "ONGOING"
+CLEARED = "CLEARED"
+
+
+class ActiveAlert:
+    """One open alert of a device's metric."""
+
+    __slots__ = ("level", "opened", "last_seen", "last_reported", "value",
+                 "peak", "count", "unreported")
+
+    def __init__(self, level, value, now):
+        self.level = level            # "HIGH" or "LOW"
+        self.opened = now
+        self.last_seen = now
+        self.last_reported = now
+        self.value = value            # Latest value
+        self.peak = value             # Most extreme value since the last report
+        self.count = 1                # Alerting readings since the alert opened
+        self.unreported = 0           # Alerting readings since the last report
+
+    def observe(self, value, now):
+        self.last_seen = now
+        self.value = value
+        self.count += 1
+        self.unreported += 1
+        if (value > self.peak) if self.level == "HIGH" else (value < self.peak):
+            self.peak = value
+
+
+class AlertTransition:
+    """A change in an alert's state, to be reported."""
+
+    __slots__ = ("state", "device_id", "metric", "alert", "readings", "peak", "reason")
+
+    def __init__(self, state, device_id, metric, alert, readings=1, peak=None, reason=None):
+        self.state = state            # OPEN, ONGOING or CLEARED
+        self.device_id = device_id
+        self.metric = metric
+        self.alert = alert            # The ActiveAlert
+        self.readings = readings      # ONGOING: alerting readings since the last report
+        self.peak = peak              # ONGOING: most extreme value since the last report
+        self.reason = reason          # CLEARED: why the alert cleared
+
+    def __repr__(self):
+        return f"AlertTransition({self.state}, {self.device_id}, {self.metric}, {self.alert.level})"
+
+
+class AlertStats:
+    """Counters for how much the aggregation saved."""
+
+    def __init__(self):
+        self.readings = 0
+        self.opened = 0
+        self.reminders = 0
+        self.cleared = 0
+        self.suppressed = 0
+        self.evicted = 0
+
+    def __str__(self):
+        return (f"alerting readings={self.readings} opened={self.opened} reminders={self.reminders} "
+                f"cleared={self.cleared} suppressed={self.suppressed} evicted={self.evicted}")
+
+
+class AlertAggregator:
+    """Turns alerting readings into OPEN/ONGOING/CLEARED transitions."""
+
+    def __init__(self, cooldown=DEFAULT_COOLDOWN, clear_after=DEFAULT_CLEAR_AFTER,
+                 max_active=DEFAULT_MAX_ACTIVE, cooldowns=None):
+        """
+        Args:
+            cooldown (float): Minimum seconds between reports of the same alert
+            clear_after (float): Seconds without an alerting reading before an
+                alert is cleared (0 disables clearing by time)
+            max_active (int): Most active alerts kept; the least recently seen
+                are dropped beyond this
+            cooldowns (dict, optional): metric -> cooldown, overriding `cooldown`
+        """
+        self.cooldown = cooldown
+        self.clear_after = clear_after
+        self.max_active = max(1, max_active)
+        self.cooldowns = cooldowns or {}
+        self.stats = AlertStats()
+        # (device_id, metric) -> ActiveAlert, least recently seen first
+        self._active = OrderedDict()
+
+    def __len__(self):
+        return len(self._active)
+
+    def update(self, device_id, alerts, metrics, now=None):
+        """
+        Record one reading of a device.
+
+        Args:
+            device_id (str): Device the reading came from
+            alerts (dict): metric -> (level, value) for each metric alerting in the reading
+            metrics (iterable): Every metric the reading was checked for; active
+                alerts of those that are not in `alerts` are cleared
+            now (float, optional): Current time in seconds, default time.time()
+
+        Returns:
+            list: AlertTransition objects to report (often empty)
+        """
+        if now is None:
+            now = time.time()
+        active = self._active
+        transitions = []
+
+        for metric in metrics:
+            key = (device_id, metric)
+            alert = active.get(key)
+            observed = alerts.get(metric)
+
+            if observed is None:
+                if alert is not None:
+                    del active[key]
+                    self.stats.cleared += 1
+                    transitions.append(AlertTransition(CLEARED, device_id, metric, alert, reason="back in range"))
+                continue
+
+            level, value = observed
+            self.stats.readings += 1
+            if alert is not None and alert.level != level:
+                # Jumped from one side of the range to the other
+                del active[key]
+                self.stats.cleared += 1
+                transitions.append(AlertTransition(CLEARED, device_id, metric, alert, reason=f"now {level}"))
+                alert = None
+
+            if alert is None:
+                alert = active[key] = ActiveAlert(level, value, now)
+                self.stats.opened += 1
+                transitions.append(AlertTransition(OPEN, device_id, metric, alert))
+                self._evict()
+                continue
+
+            alert.observe(value, now)
+            active.move_to_end(key)
+            if now - alert.last_reported >= self.cooldowns.get(metric, self.cooldown):
+                self.stats.reminders += 1
+                transitions.append(AlertTransition(ONGOING, device_id, metric, alert,
+                                                   readings=alert.unreported, peak=alert.peak))
+                alert.last_reported = now
+                alert.unreported = 0
+                alert.peak = value
+            else:
+                self.stats.suppressed += 1
+
+        return transitions
+
+    def expire(self, now=None):
+        """
+        Clear alerts that have not seen an alerting reading for clear_after seconds.
+
+        Returns:
+            list: CLEARED transitions
+        """
+        if not self.clear_after:
+            return []
+        if now is None:
+            now = time.time()
+        transitions = []
+        active = self._active
+        while active:
+            key, alert = next(iter(active.items()))
+            if now - alert.last_seen < self.clear_after:
+                break
+            del active[key]
+            self.stats.cleared += 1
+            transitions.append(AlertTransition(
+                CLEARED, key[0], key[1], alert, reason=f"no alerting reading for {self.clear_after:.0f}s"))
+        return transitions
+
+    def _evict(self):
+        while len(self._active) > self.max_active:
+            self._active.popitem(last=False)
+            self.stats.evicted += 1
@@ -0,0 +1,426 @@
+"""
+Asyncio runtime for RabbitMQ consumers.
+
+Consumers are small classes that describe where their messages come from
+and how to handle them. Any number of them can be registered with one
+ConsumerRuntime, which runs them in a single process over a single
+connection (one channel per consumer) using pika's asyncio adapter.
+
+Handlers run on the event loop, so socket reads are never blocked by a
+long-running callback as long as slow work (signature checks, decryption,
+file I/O) is sent to the thread pool with `await self.run_in_executor(...)`.
+
+Example:
+    runtime = ConsumerRuntime()
+    runtime.register(AlertHandler())
+    runtime.register(TopicAnalyzer())
+    runtime.run_forever()
+"""
+
+import asyncio
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from pika.adapters.asyncio_connection import AsyncioConnection
+from pika.exceptions import AMQPError, AMQPConnectionError
+
+from ack_batcher import AckBatcher, DEFAULT_PREFETCH, DEFAULT_ACK_EVERY, DEFAULT_ACK_MS
+from utils import get_connection_parameters
+from wire_format import iter_readings
+
+# Seconds to wait for the broker to answer a declare/bind/qos request
+RPC_TIMEOUT = 30
+
+
+class Message:
+    """A delivered message as seen by Consumer.handle()."""
+
+    __slots__ = ("body", "routing_key", "exchange", "properties", "delivery_tag", "redelivered")
+
+    def __init__(self, body, routing_key, exchange, properties, delivery_tag, redelivered):
+        self.body = body
+        self.routing_key = routing_key
+        self.exchange = exchange
+        self.properties = properties
+        self.delivery_tag = delivery_tag
+        self.redelivered = redelivered
+
+
+class Consumer:
+    """
+    Base class for consumers run by ConsumerRuntime.
+
+    Subclasses set the class attributes below and implement handle().
+    handle() may be a plain method (called directly on the event loop, so
+    keep it quick) or a coroutine. Unless manual_ack is set, messages are
+    acknowledged in batches once handle() returns (see AckBatcher) and
+    rejected one by one if it raises.
+    """
+
+    # Name used in log output, defaults to the class name
+    name = None
+
+    # Where messages come from: one exchange and its routing keys...
+    exchange = None
+    exchange_type = "fanout"
+    routing_keys = ("",)
+    # ...or a list of (exchange, exchange_type, routing_key) tuples
+    bindings = None
+
+    # "" declares a private queue named by the broker and deleted on disconnect
+    queue = ""
+    durable = False
+    # Extra queue_declare arguments, e.g. {'x-single-active-consumer': True}
+    queue_arguments = None
+
+    # (destination, source, source_type) exchange-to-exchange bindings set up
+    # before the queue is bound (see sharding.py)
+    exchange_bindings = ()
+
+    # Unacknowledged messages the broker may push to this consumer at once
+    prefetch_count = DEFAULT_PREFETCH
+
+    # Ack with multiple=True every ack_every messages or ack_delay_ms,
+    # whichever comes first; keep ack_every below prefetch_count
+    ack_every = DEFAULT_ACK_EVERY
+    ack_delay_ms = DEFAULT_ACK_MS
+
+    # True if the consumer acknowledges messages itself through ack()
+    manual_ack = False
+
+    def __init__(self):
+        self.runtime = None
+        self.channel = None
+        self.queue_name = None
+        self.acks = None
+        if self.name is None:
+            self.name = type(self).__name__
+
+    def get_bindings(self):
+        """Return the (exchange, exchange_type, routing_key) tuples to bind."""
+        if self.bindings is not None:
+            return list(self.bindings)
+        return [(self.exchange, self.exchange_type, key) for key in self.routing_keys]
+
+    def on_start(self):
+        """Called on the event loop each time the consumer's channel is ready."""
+
+    def on_connection_lost(self):
+        """Called when the connection drops; unacked messages will be redelivered."""
+
+    def on_stop(self):
+        """Called once on shutdown, while the channel is still open."""
+
+    def handle(self, message):
+        raise NotImplementedError
+
+    # ---------- Helpers for subclasses ----------
+
+    def ack(self, delivery_tag, multiple=False):
+        """Acknowledge a delivery. Must be called on the event loop."""
+        if self.channel is not None and self.channel.is_open:
+            self.channel.basic_ack(delivery_tag=delivery_tag, multiple=multiple)
+
+    def publish(self, exchange, routing_key, body, properties=None):
+        """
+        Publish a message on the consumer's channel. Must be called on the event loop.
+
+        Returns:
+            bool: False if the channel is closed and the message was not sent
+        """
+        if self.channel is None or not self.channel.is_open:
+            return False
+        self.channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body,
+                                   properties=properties)
+        return True
+
+    def call_later(self, delay, callback, *args):
+        """Schedule a plain function on the event loop."""
+        return self.runtime.loop.call_later(delay, callback, *args)
+
+    async def run_in_executor(self, func, *args):
+        """Run blocking or CPU-heavy work on the runtime's thread pool."""
+        return await self.runtime.loop.run_in_executor(self.runtime.executor, func, *args)
+
+
+class ReadingConsumer(Consumer):
+    """
+    Consumer of sensor readings.
+
+    Decodes each message (JSON or binary, single reading or envelope, see
+    wire_format.py) and calls handle_reading() once per reading, so
+    subclasses never deal with wire formats or batching. Subclasses that can
+    work on all readings of a message at once override handle_readings().
+    """
+
+    def handle(self, message):
+        try:
+            readings = list(iter_readings(message.body, message.properties))
+        except ValueError:
+            print(f"[{self.name}] Error: Could not decode message: {message.body}")
+            self.on_decode_error(message)
+            return
+        self.handle_readings(readings, message)
+
+    def handle_readings(self, readings, message):
+        """Handle every decoded reading of one message."""
+        for reading in readings:
+            self.handle_reading(reading, message)
+
+    def handle_reading(self, reading, message):
+        """Handle one decoded reading dict; message is the message it came in."""
+        raise NotImplementedError
+
+    def on_decode_error(self, message):
+        """Called after a message could not be decoded (it is still acked)."""
+
+
+class ConsumerRuntime:
+    """Runs registered consumers over one shared RabbitMQ connection."""
+
+    def __init__(self, parameters=None, max_workers=None, reconnect_delay=5):
+        """
+        Args:
+            parameters (pika.ConnectionParameters, optional): Defaults to the .env settings
+            max_workers (int, optional): Size of the thread pool for offloaded work
+            reconnect_delay (float): Seconds to wait before reconnecting
+        """
+        self.parameters = parameters or get_connection_parameters()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="consumer-worker")
+        self.reconnect_delay = reconnect_delay
+        self.consumers = []
+        self.loop = None
+
+        self._connection = None
+        self._closed = None
+        self._stopping = False
+        self._tasks = set()
+
+    def register(self, consumer):
+        """Add a consumer. Returns the consumer so calls can be chained."""
+        consumer.runtime = self
+        self.consumers.append(consumer)
+        return consumer
+
+    # ---------- pika callbacks as awaitables ----------
+
+    async def _connect(self):
+        opened = self.loop.create_future()
+        # Bind this connection to this run's future, not whatever self._closed is later
+        closed = self._closed
+
+        def on_open(connection):
+            if not opened.done():
+                opened.set_result(connection)
+
+        def on_open_error(connection, error):
+            if not opened.done():
+                opened.set_exception(AMQPConnectionError(error))
+
+        def on_close(connection, reason):
+            if not closed.done():
+                closed.set_result(reason)
+
+        AsyncioConnection(
+            self.parameters,
+            on_open_callback=on_open,
+            on_open_error_callback=on_open_error,
+            on_close_callback=on_close,
+            custom_ioloop=self.loop
+        )
+        return await opened
+
+    async def _rpc(self, method, **kwargs):
+        """Call a pika method that reports completion through `callback`."""
+        done = self.loop.create_future()
+
+        def on_done(result):
+            if not done.done():
+                done.set_result(result)
+
+        method(callback=on_done, **kwargs)
+        return await asyncio.wait_for(done, RPC_TIMEOUT)
+
+    async def _open_channel(self, connection):
+        done = self.loop.create_future()
+
+        def on_open(channel):
+            if not done.done():
+                done.set_result(channel)
+
+        connection.channel(on_open_callback=on_open)
+        return await asyncio.wait_for(done, RPC_TIMEOUT)
+
+    # ---------- Consumers ----------
+
+    async def _start_consumer(self, connection, consumer):
+        channel = await self._open_channel(connection)
+        channel.add_on_close_callback(partial(self._on_channel_closed, consumer))
+
+        bindings = consumer.get_bindings()
+        declared = set()
+        exchanges = [(exchange, exchange_type) for exchange, exchange_type, _ in bindings]
+        exchanges += [(source, source_type) for _, source, source_type in consumer.exchange_bindings]
+        for exchange, exchange_type in exchanges:
+            if exchange not in declared:
+                await self._rpc(channel.exchange_declare, exchange=exchange, exchange_type=exchange_type)
+                declared.add(exchange)
+        for destination, source, _ in consumer.exchange_bindings:
+            await self._rpc(channel.exchange_bind, destination=destination, source=source)
+
+        frame = await self._rpc(
+            channel.queue_declare,
+            queue=consumer.queue,
+            exclusive=not consumer.queue,
+            durable=consumer.durable,
+            arguments=consumer.queue_arguments
+        )
+        queue_name = frame.method.queue
+
+        for exchange, _, routing_key in bindings:
+            await self._rpc(channel.queue_bind, queue=queue_name, exchange=exchange, routing_key=routing_key)
+
+        await self._rpc(channel.basic_qos, prefetch_count=consumer.prefetch_count)
+
+        consumer.channel = channel
+        consumer.queue_name = queue_name
+        if not consumer.manual_ack:
+            # Delivery tags restart at 1 on every new channel
+            consumer.acks = AckBatcher(
+                partial(self._basic_ack, channel),
+                every=consumer.ack_every,
+                max_delay_ms=consumer.ack_delay_ms
+            )
+            self._schedule_ack_timer(consumer, consumer.acks)
+        consumer.on_start()
+
+        is_async = inspect.iscoroutinefunction(consumer.handle)
+        channel.basic_consume(
+            queue=queue_name,
+            on_message_callback=partial(self._on_message, consumer, is_async)
+        )
+        print(f"[{consumer.name}] consuming from {queue_name} "
+              f"({', '.join(exchange for exchange in declared)})")
+
+    def _basic_ack(self, channel, delivery_tag, multiple):
+        if channel.is_open:
+            channel.basic_ack(delivery_tag=delivery_tag, multiple=multiple)
+
+    def _schedule_ack_timer(self, consumer, acks):
+        def tick():
+            # Stop once the channel this batcher belongs to is gone
+            if consumer.acks is acks:
+                acks.flush_if_due()
+                self._schedule_ack_timer(consumer, acks)
+        self.loop.call_later(acks.max_delay / 2, tick)
+
+    def _on_channel_closed(self, consumer, channel, reason):
+        if consumer.channel is channel:
+            consumer.channel = None
+            consumer.acks = None
+        if not self._stopping:
+            print(f"[{consumer.name}] channel closed: {reason}")
+            # Restart everything from a clean connection
+            if self._connection is not None and self._connection.is_open:
+                self._connection.close()
+
+    def _on_message(self, consumer, is_async, channel, method, properties, body):
+        message = Message(body, method.routing_key, method.exchange, properties,
+                          method.delivery_tag, method.redelivered)
+        if is_async:
+            task = self.loop.create_task(self._dispatch_async(consumer, channel, message))
+            # Keep a reference so the task is not garbage collected mid-flight
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            return
+
+        try:
+            consumer.handle(message)
+        except Exception as e:
+            self._reject(consumer, channel, message, e)
+        else:
+            self._settle(consumer, channel, message)
+
+    async def _dispatch_async(self, consumer, channel, message):
+        try:
+            await consumer.handle(message)
+        except Exception as e:
+            self._reject(consumer, channel, message, e)
+        else:
+            self._settle(consumer, channel, message)
+
+    def _settle(self, consumer, channel, message):
+        if not consumer.manual_ack and consumer.channel is channel:
+            consumer.acks.done(message.delivery_tag)
+
+    def _reject(self, consumer, channel, message, error):
+        print(f"[{consumer.name}] Error processing message: {error}")
+        if not consumer.manual_ack and consumer.channel is channel and channel.is_open:
+            channel.basic_nack(delivery_tag=message.delivery_tag, requeue=False)
+            consumer.acks.done(message.delivery_tag, ok=False)
+
+    # ---------- Lifecycle ----------
+
+    async def run(self):
+        """Connect, start every consumer and run until the connection closes."""
+        self.loop = asyncio.get_running_loop()
+        self._closed = self.loop.create_future()
+        self._connection = None
+        try:
+            self._connection = await self._connect()
+            for consumer in self.consumers:
+                await self._start_consumer(self._connection, consumer)
+            print(f"Consumer runtime started with {len(self.consumers)} consumer(s). To exit press CTRL+C")
+
+            reason = await self._closed
+            raise AMQPConnectionError(f"Connection closed: {reason}")
+        except asyncio.CancelledError:
+            # CTRL+C: let consumers flush and ack while the channels are open
+            await self._shutdown()
+            raise
+        except (AMQPError, asyncio.TimeoutError, OSError):
+            if self._connection is not None and self._connection.is_open:
+                self._connection.close()
+            for consumer in self.consumers:
+                consumer.channel = None
+                consumer.acks = None
+                consumer.on_connection_lost()
+            raise
+
+    async def _shutdown(self):
+        self._stopping = True
+        for consumer in self.consumers:
+            try:
+                consumer.on_stop()
+                if consumer.acks is not None:
+                    consumer.acks.flush()
+            except Exception as e:
+                print(f"[{consumer.name}] Error while stopping: {e}")
+
+        connection = self._connection
+        if connection is not None and connection.is_open:
+            connection.close()
+            try:
+                await asyncio.wait_for(asyncio.shield(self._closed), 5)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
+
+    async def run_with_reconnect(self):
+        """Run, reconnecting after connection failures until cancelled."""
+        while True:
+            try:
+                await self.run()
+                return
+            except (AMQPError, asyncio.TimeoutError, OSError) as e:
+                print(f"RabbitMQ consumer error: {e}")
+                await asyncio.sleep(self.reconnect_delay)
+
+    def run_forever(self):
+        """Blocking entry point for scripts; stops cleanly on CTRL+C."""
+        try:
+            asyncio.run(self.run_with_reconnect())
+        except KeyboardInterrupt:
+            print("Stopping consumers")
+        finally:
+            self.executor.shutdown(wait=False)
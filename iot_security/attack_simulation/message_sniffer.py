@@ -17,7 +17,7 @@ from colorama import init, Fore, Style
 # Add parent directory to path to import utils
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils import get_rabbitmq_connection
-from security_utils import decrypt_message
+from security_utils import decrypt_message, is_gcm_frame
 
 # Initialize colorama for colored terminal output
 init()
@@ -68,10 +68,11 @@ for exchange in exchanges:
         def create_callback(exchange_name):
             def callback(ch, method, properties, body):
                 try:
-                    data = json.loads(body)
+                    # AES-GCM frames are binary, everything else is JSON
+                    data = body if is_gcm_frame(body) else json.loads(body)
                     
                     # Check if the message is encrypted
-                    if isinstance(data, dict) and data.get('is_encrypted', False):
+                    if isinstance(data, bytes) or (isinstance(data, dict) and data.get('is_encrypted', False)):
                         print(f"{Fore.RED}[ATTACK SIMULATION] Intercepted ENCRYPTED message on {exchange_name}:")
                         print(f"{Fore.RED}[ATTACK SIMULATION] Cannot read contents - encryption protects the data!{Style.RESET_ALL}")
                         
@@ -20,6 +20,7 @@ from colorama import init, Fore, Style
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils import get_rabbitmq_connection
 from security_utils import sign_message, DEVICE_CREDENTIALS
+from sharding import device_routing_key
 
 # Initialize colorama for colored terminal output
 init()
@@ -121,7 +122,8 @@ try:
     print(f"{Fore.RED}[ATTACK SIMULATION] Phase 1: Sending fake extreme sensor data to trigger false alerts{Style.RESET_ALL}")
     for i in range(3):
         fake_data = generate_fake_data(extreme=True)
-        send_spoofed_message(fake_data, 'sensors.fanout')
+        # Use the device's shard key, as the real emitter does, so sharded consumers get it too
+        send_spoofed_message(fake_data, 'sensors.fanout', routing_key=device_routing_key(fake_data['device_id']))
         send_spoofed_message(fake_data, 'sensors.direct', routing_key='alerts')
         time.sleep(1)
     
@@ -129,7 +131,7 @@ try:
     print(f"{Fore.RED}[ATTACK SIMULATION] Phase 2: Sending normal-looking but false sensor data{Style.RESET_ALL}")
     for i in range(3):
         fake_data = generate_fake_data(extreme=False)
-        send_spoofed_message(fake_data, 'sensors.fanout')
+        send_spoofed_message(fake_data, 'sensors.fanout', routing_key=device_routing_key(fake_data['device_id']))
         time.sleep(1)
     
     # Phase 3: Try to send a malicious pump command
@@ -19,7 +19,8 @@ from colorama import init, Fore, Style
 # Add parent directory to path to import utils
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils import get_rabbitmq_connection
-from security_utils import verify_signature
+from security_utils import verify_signature, load_signed, has_detached_signature
+from sharding import device_routing_key
 
 # Initialize colorama for colored terminal output
 init()
@@ -92,9 +93,12 @@ def modify_message(original_data):
     return modified
 
 # Function to forward modified messages to our mitm exchange
-def forward_modified_message(message, routing_key=''):
+def forward_modified_message(message, routing_key=None):
     """Forward the modified message to consumers."""
     message_json = json.dumps(message)
+    if routing_key is None:
+        # Same shard key as the real emitter, so sharded consumers bound to the exchange get it too
+        routing_key = device_routing_key(message.get('device_id', ''))
     
     try:
         # Forward to our mitm exchange
@@ -143,15 +147,14 @@ def callback(ch, method, properties, body):
 # Callback for secure messages
 def secure_callback(ch, method, properties, body):
     try:
-        # Parse the secure message
-        secure_msg = json.loads(body)
+        # Parse the secure message (its signature may be in the headers, covering the body bytes)
+        secure_msg, is_valid = load_signed(body, properties.headers)
         
         print(f"{Fore.YELLOW}[MITM ATTACK] Intercepted secure message:{Style.RESET_ALL}")
         print(f"{Fore.WHITE}{json.dumps(secure_msg, indent=2)}{Style.RESET_ALL}")
         
         # Check if the message has a signature
-        if 'signature' in secure_msg:
-            is_valid = verify_signature(secure_msg)
+        if 'signature' in secure_msg or has_detached_signature(properties.headers):
             if is_valid:
                 print(f"{Fore.RED}[MITM ATTACK] Message has valid signature - modification would be detected{Style.RESET_ALL}")
             else:
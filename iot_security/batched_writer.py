@@ -0,0 +1,195 @@
+"""
+Buffered writers for the data logger.
+Keep the output open, collect rows in memory and write them out in
+batches, so each message no longer costs an open/write/close cycle.
+"""
+
+import os
+import time
+
+# Durability policies
+FSYNC_NEVER = "never"        # leave it to the OS page cache
+FSYNC_INTERVAL = "interval"  # fsync at most once every fsync_interval seconds
+FSYNC_BATCH = "batch"        # fsync after every flushed batch
+FSYNC_POLICIES = (FSYNC_NEVER, FSYNC_INTERVAL, FSYNC_BATCH)
+
+
+class BatchedWriter:
+    """
+    Base class for writers that flush rows in batches.
+
+    A batch is written when it reaches max_rows or when its oldest row is
+    older than max_delay_ms. Every row can carry a RabbitMQ delivery tag;
+    on_flush is called with the highest tag in a batch only after that batch
+    has been written (and synced to disk, if the policy asks for it).
+
+    Subclasses implement _write_rows() and _sync().
+    """
+
+    def __init__(self, max_rows=500, max_delay_ms=1000, fsync_policy=FSYNC_INTERVAL,
+                 fsync_interval=1.0, on_flush=None):
+        """
+        Args:
+            max_rows (int): Flush once this many rows are buffered
+            max_delay_ms (int): Flush once the oldest buffered row is this old
+            fsync_policy (str): One of FSYNC_NEVER, FSYNC_INTERVAL or FSYNC_BATCH
+            fsync_interval (float): Seconds between fsyncs for FSYNC_INTERVAL
+            on_flush (callable): Called with the last delivery tag of each flushed batch
+        """
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync_policy}")
+
+        self.max_rows = max_rows
+        self.max_delay = max_delay_ms / 1000.0
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.on_flush = on_flush
+
+        self.rows_written = 0
+        self.batches_written = 0
+
+        self._rows = []
+        self._last_tag = None
+        self._first_row_time = None
+        self._last_fsync = time.monotonic()
+        self._closed = False
+
+    def __len__(self):
+        return len(self._rows)
+
+    def write(self, row, delivery_tag=None):
+        """
+        Buffer one row and flush if the batch is full.
+
+        Args:
+            row: A row in the format the subclass expects
+            delivery_tag (int, optional): Delivery tag acknowledged after the flush
+        """
+        if not self._rows and self._last_tag is None:
+            self._first_row_time = time.monotonic()
+        self._rows.append(row)
+        if delivery_tag is not None:
+            self._last_tag = delivery_tag
+
+        if len(self._rows) >= self.max_rows:
+            self.flush()
+
+    def skip(self, delivery_tag):
+        """
+        Acknowledge a delivery with the next batch without writing a row for
+        it, e.g. a message that could not be parsed. Acking it on its own
+        could ack a tag that a later batch ack names again.
+        """
+        if not self._rows and self._last_tag is None:
+            self._first_row_time = time.monotonic()
+        self._last_tag = delivery_tag
+
+    def flush_if_due(self):
+        """Flush the batch if its oldest row has waited longer than max_delay_ms."""
+        if (self._rows or self._last_tag is not None) and \
+                time.monotonic() - self._first_row_time >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        """
+        Write all buffered rows.
+
+        Returns:
+            int: Number of rows written
+
+        Raises:
+            Exception: If writing fails; rows not written stay buffered for the next flush
+        """
+        count = len(self._rows)
+        if count:
+            rows, self._rows = self._rows, []
+            try:
+                self._write_rows(rows)
+            except Exception:
+                # Keep the rows that were not written (and their tags unacked) for the next flush
+                self.rows_written += count - len(rows)
+                self._rows = rows + self._rows
+                raise
+
+        now = time.monotonic()
+        if self.fsync_policy == FSYNC_BATCH or (
+            self.fsync_policy == FSYNC_INTERVAL and now - self._last_fsync >= self.fsync_interval
+        ):
+            self._sync()
+            self._last_fsync = now
+
+        if count:
+            self.rows_written += count
+            self.batches_written += 1
+
+        last_tag, self._last_tag = self._last_tag, None
+        if last_tag is not None and self.on_flush is not None:
+            self.on_flush(last_tag)
+        return count
+
+    def discard(self):
+        """
+        Drop buffered rows without writing them, e.g. after the RabbitMQ
+        connection was lost and the broker will redeliver them.
+
+        Returns:
+            int: Number of rows dropped
+        """
+        count = len(self._rows)
+        self._rows = []
+        self._last_tag = None
+        return count
+
+    def close(self):
+        """Flush remaining rows, sync to disk and release the output."""
+        if self._closed:
+            return
+        self.flush()
+        self._sync()
+        self._close()
+        self._closed = True
+
+    def _write_rows(self, rows):
+        # May remove rows from the list as they are written; if it raises,
+        # the rows left in the list are written again by the next flush
+        raise NotImplementedError
+
+    def _sync(self):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+
+class BatchedCSVWriter(BatchedWriter):
+    """Append CSV lines to a file that stays open between batches."""
+
+    def __init__(self, path, header, **kwargs):
+        """
+        Args:
+            path (str): CSV file to append to
+            header (str): Header line written when the file is new or empty
+            **kwargs: Batching options passed to BatchedWriter
+        """
+        super().__init__(**kwargs)
+        self.path = path
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", buffering=1024 * 1024)
+        if self._file.tell() == 0:
+            self._file.write(header if header.endswith("\n") else header + "\n")
+            self._file.flush()
+
+    def _write_rows(self, rows):
+        # Rows are complete CSV lines including the trailing newline
+        self._file.write("".join(rows))
+        self._file.flush()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _close(self):
+        self._file.close()
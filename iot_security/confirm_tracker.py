@@ -0,0 +1,147 @@
+"""
+Asynchronous publisher confirms for BlockingConnection publishers.
+
+With BlockingChannel.confirm_delivery() every basic_publish waits for the
+broker's answer, one round trip per message. ConfirmTracker enables confirms
+on the underlying channel instead: publishes go out immediately, up to
+`window` of them may be unconfirmed at once, and basic.ack/basic.nack frames
+are matched to pending messages by delivery tag as they arrive. Nacked
+messages are published again.
+
+Example:
+    tracker = ConfirmTracker(connection, channel, window=1000)
+    tracker.publish('sensors.fanout', '', body)
+    tracker.flush()
+    ...
+    tracker.wait_for_confirms()
+"""
+
+import time
+from collections import OrderedDict
+
+from pika.spec import Basic
+
+# Default number of unconfirmed messages allowed in flight
+DEFAULT_CONFIRM_WINDOW = 1000
+
+
+class ConfirmStats:
+    """Counters for confirmed, nacked, retried and failed publishes."""
+
+    def __init__(self):
+        self.published = 0
+        self.confirmed = 0
+        self.nacked = 0
+        self.retried = 0
+        self.failed = 0
+
+    def __str__(self):
+        return (f"published={self.published} confirmed={self.confirmed} "
+                f"nacked={self.nacked} retried={self.retried} failed={self.failed}")
+
+
+class ConfirmTracker:
+    """Windowed publisher confirms on a pika BlockingConnection channel."""
+
+    def __init__(self, connection, channel, window=DEFAULT_CONFIRM_WINDOW, max_retries=3,
+                 on_failed=None):
+        """
+        Args:
+            connection (pika.BlockingConnection): Connection the channel belongs to
+            channel (BlockingChannel): Channel to publish on; put into confirm mode here
+            window (int): Maximum unconfirmed messages before publish() waits
+            max_retries (int): Times a nacked message is published again before giving up
+            on_failed (callable, optional): Called with (exchange, routing_key, body)
+                for messages that were still nacked after max_retries
+        """
+        self.connection = connection
+        self.window = max(1, window)
+        self.max_retries = max_retries
+        self.on_failed = on_failed
+        self.stats = ConfirmStats()
+
+        # Publishing through the underlying channel keeps basic_publish
+        # non-blocking; BlockingConnection still drives its I/O
+        self._impl = channel._impl
+        self._next_tag = 1
+        # delivery tag -> (exchange, routing_key, body, properties, attempt);
+        # insertion order is tag order, so multiple=True acks pop from the front
+        self._pending = OrderedDict()
+
+        ready = []
+        self._impl.confirm_delivery(ack_nack_callback=self._on_confirm,
+                                    callback=lambda frame: ready.append(frame))
+        while not ready:
+            self.connection.process_data_events(time_limit=1)
+
+    @property
+    def outstanding(self):
+        """Number of published messages not yet acked or nacked."""
+        return len(self._pending)
+
+    def publish(self, exchange, routing_key, body, properties=None):
+        """
+        Queue a message for publishing, waiting first if the window is full.
+        Frames are sent on the next flush() (or any other I/O on the connection).
+        """
+        while len(self._pending) >= self.window:
+            self.connection.process_data_events(time_limit=0.05)
+        self._send(exchange, routing_key, body, properties, 0)
+        self.stats.published += 1
+
+    def flush(self):
+        """Send queued frames and handle any confirms that have arrived."""
+        self.connection.process_data_events(time_limit=0)
+
+    def wait_for_confirms(self, timeout=None):
+        """
+        Block until every published message is acked or given up on.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait
+
+        Returns:
+            bool: True if nothing is left outstanding
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._pending:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            self.connection.process_data_events(time_limit=0.1)
+        return True
+
+    def _send(self, exchange, routing_key, body, properties, attempt):
+        # The broker numbers confirms 1, 2, 3... in publish order on this channel
+        self._pending[self._next_tag] = (exchange, routing_key, body, properties, attempt)
+        self._next_tag += 1
+        self._impl.basic_publish(exchange=exchange, routing_key=routing_key,
+                                 body=body, properties=properties)
+
+    def _on_confirm(self, frame):
+        method = frame.method
+        if method.multiple:
+            settled = []
+            while self._pending:
+                tag = next(iter(self._pending))
+                if tag > method.delivery_tag:
+                    break
+                settled.append(self._pending.popitem(last=False)[1])
+        else:
+            message = self._pending.pop(method.delivery_tag, None)
+            settled = [message] if message is not None else []
+
+        if isinstance(method, Basic.Ack):
+            self.stats.confirmed += len(settled)
+            return
+
+        self.stats.nacked += len(settled)
+        for exchange, routing_key, body, properties, attempt in settled:
+            if attempt < self.max_retries:
+                self.stats.retried += 1
+                self._send(exchange, routing_key, body, properties, attempt + 1)
+            else:
+                self.stats.failed += 1
+                print(f"Message to {exchange or 'default exchange'} ({routing_key}) "
+                      f"was rejected by the broker {attempt + 1} times, giving up")
+                if self.on_failed is not None:
+                    self.on_failed(exchange, routing_key, body)
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 import json
 import threading
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
 import time
 import sys
@@ -9,8 +9,15 @@ import os
 
 # Add parent directory to path to import utils
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils import get_rabbitmq_connection
-from security_utils import verify_signature, decrypt_message, is_message_recent
+from utils import get_rabbitmq_connection, get_connection_manager
+from replay_cache import ReplayCache, FRESH, REPLAYED, FUTURE
+from verify_pipeline import VerificationPipeline, OK, DECODE_ERROR, DECRYPTION_FAILED
+from ack_batcher import DEFAULT_PREFETCH
+from snapshot import SnapshotHolder, snapshot_response, json_response
+from device_table import DeviceTable
+from event_stream import EventBroadcaster, encode_event_body
+from wire_format import iter_readings
+from threshold_engine import check_alerts, check_alerts_batch, default_engine
 import pika
 
 # Initialize Flask app
@@ -18,7 +25,8 @@ app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
 # In-memory storage for the latest sensor data
-latest_data = {
+# (an immutable snapshot that the consumer thread replaces on every reading)
+latest_data = SnapshotHolder({
     "timestamp": 0,
     "temperature": 0,
     "humidity": 0,
@@ -29,44 +37,29 @@ latest_data = {
         "last_verified_timestamp": 0,
         "message_integrity": "unknown"
     }
-}
+})
 
-# Define thresholds for alerts
-THRESHOLDS = {
-    "temperature": {"min": 0, "max": 35, "unit": "°C"},
-    "humidity": {"min": 30, "max": 100, "unit": "%"},
-    "soil_moisture": {"min": 250, "max": 800, "unit": "units"}
-}
+# Latest reading for every device, keyed by device_id
+devices = DeviceTable()
 
-# Check if values are in alert range
-def check_alerts(data):
-    alerts = []
-    
-    # Check temperature
-    if "temperature" in data:
-        temp = data["temperature"]
-        if temp > THRESHOLDS["temperature"]["max"]:
-            alerts.append(f"HIGH TEMPERATURE: {temp}{THRESHOLDS['temperature']['unit']}")
-        elif temp < THRESHOLDS["temperature"]["min"]:
-            alerts.append(f"LOW TEMPERATURE: {temp}{THRESHOLDS['temperature']['unit']}")
-    
-    # Check humidity
-    if "humidity" in data:
-        humid = data["humidity"]
-        if humid < THRESHOLDS["humidity"]["min"]:
-            alerts.append(f"LOW HUMIDITY: {humid}{THRESHOLDS['humidity']['unit']}")
-        elif humid > THRESHOLDS["humidity"]["max"]:
-            alerts.append(f"HIGH HUMIDITY: {humid}{THRESHOLDS['humidity']['unit']}")
-    
-    # Check soil moisture
-    if "soil_moisture" in data:
-        moisture = data["soil_moisture"]
-        if moisture < THRESHOLDS["soil_moisture"]["min"]:
-            alerts.append(f"LOW SOIL MOISTURE: {moisture}{THRESHOLDS['soil_moisture']['unit']}")
-        elif moisture > THRESHOLDS["soil_moisture"]["max"]:
-            alerts.append(f"HIGH SOIL MOISTURE: {moisture}{THRESHOLDS['soil_moisture']['unit']}")
-    
-    return alerts
+# Pushes every new snapshot (readings and security alerts) to dashboards connected to /api/stream
+broadcaster = EventBroadcaster()
+
+def push_snapshot(snapshot):
+    """Send an already encoded snapshot to every connected dashboard."""
+    broadcaster.publish_encoded(encode_event_body('reading', snapshot.body))
+
+# Signatures accepted within the last minute, one cache per queue since the
+# emitter sends the same signed reading to the signed and the encrypted one
+# (see replay_cache.py)
+signed_replays = ReplayCache()
+encrypted_replays = ReplayCache()
+
+def replay_alert(freshness):
+    """Dashboard alert for a validly signed message that was rejected."""
+    if freshness == FUTURE:
+        return "SECURITY ALERT: Message timestamp in the future"
+    return "SECURITY ALERT: Message replay attempt detected"
 
 # Function to handle RabbitMQ connection and secure message processing
 def start_rabbitmq_consumer():
@@ -111,20 +104,19 @@ def start_rabbitmq_consumer():
         
         print("Secure web data server started. Waiting for sensor data...")
         
-        # Define callback function for secure signed messages
-        def secure_callback(ch, method, properties, body):
-            try:
-                # Parse the JSON message
-                data = json.loads(body)
+        # Handle a verified delivery from the secure fanout exchange
+        def handle_signed(verified):
+            if verified.status != OK:
+                print(f"Error: Could not decode message: {verified.error}")
+                return
+            
+            for data, is_valid, replay_key in zip(verified.messages, verified.signatures, verified.replay_keys):
+                # Only validly signed messages are remembered, so forgeries cannot fill the cache
+                freshness = signed_replays.check(replay_key, data.get("timestamp")) if is_valid else None
                 
-                # Verify the message signature
-                is_valid = verify_signature(data)
-                is_recent = is_message_recent(data, max_age_seconds=60)
-                
-                if is_valid and is_recent:
-                    # Update the latest data
-                    global latest_data
-                    latest_data.update({
+                if freshness == FRESH:
+                    # Publish a new snapshot with the reading and its alerts
+                    reading = {
                         "timestamp": data["timestamp"],
                         "temperature": data["temperature"],
                         "humidity": data["humidity"],
@@ -134,42 +126,39 @@ def start_rabbitmq_consumer():
                             "is_authenticated": True,
                             "last_verified_timestamp": time.time(),
                             "message_integrity": "verified"
-                        }
-                    })
-                    
-                    # Calculate alerts
-                    latest_data["alerts"] = check_alerts(data)
+                        },
+                        "alerts": check_alerts(data)
+                    }
+                    push_snapshot(latest_data.update(reading))
+                    devices.update(reading["device_id"], reading)
                     
                     print(f"Received authenticated data: {data}")
                 else:
-                    print(f"Warning: Received message with invalid signature or outdated timestamp")
-                    latest_data["security_status"]["message_integrity"] = "invalid"
+                    print("Warning: Received message with invalid signature or outdated timestamp")
                     
                     # For educational purposes, we'll log the attempt
                     security_alert = "SECURITY ALERT: Invalid signature detected"
-                    if not is_recent:
-                        security_alert = "SECURITY ALERT: Message replay attempt detected"
+                    if is_valid:
+                        security_alert = replay_alert(freshness)
                     
-                    latest_data["alerts"].append(security_alert)
-                
-            except json.JSONDecodeError:
-                print(f"Error: Could not parse message as JSON: {body}")
-            except Exception as e:
-                print(f"Error processing secure message: {e}")
+                    # Snapshots are never changed in place, so build new nested values
+                    push_snapshot(latest_data.modify(lambda current: {
+                        "security_status": dict(current["security_status"], message_integrity="invalid"),
+                        "alerts": list(current["alerts"]) + [security_alert]
+                    }))
         
         # Define callback function for insecure messages
         def insecure_callback(ch, method, properties, body):
             try:
-                # Parse the JSON message
-                data = json.loads(body)
-                
-                # For the insecure channel, we'll accept the data but mark it as unauthenticated
-                print(f"Received unauthenticated data: {data}")
+                # Decode the message (JSON or binary, one reading or an envelope of several)
+                readings = list(iter_readings(body, properties))
                 
-                # Only update data if we don't have authenticated data
-                global latest_data
-                if latest_data["security_status"]["is_authenticated"] == False:
-                    latest_data.update({
+                # Check every reading of the message against the thresholds at once
+                for data, alerts in zip(readings, check_alerts_batch(readings)):
+                    # For the insecure channel, we'll accept the data but mark it as unauthenticated
+                    print(f"Received unauthenticated data: {data}")
+                    
+                    reading = {
                         "timestamp": data["timestamp"],
                         "temperature": data["temperature"],
                         "humidity": data["humidity"],
@@ -179,74 +168,105 @@ def start_rabbitmq_consumer():
                             "is_authenticated": False,
                             "last_verified_timestamp": 0,
                             "message_integrity": "unverified"
-                        }
-                    })
+                        },
+                        "alerts": alerts
+                    }
                     
-                    # Calculate alerts
-                    latest_data["alerts"] = check_alerts(data)
-                
-            except json.JSONDecodeError:
-                print(f"Error: Could not parse message as JSON: {body}")
+                    # Only update data if we don't have authenticated data
+                    if latest_data.get()["security_status"]["is_authenticated"] == False:
+                        push_snapshot(latest_data.update(reading))
+                    
+                    # Same rule per device
+                    device_snapshot = devices.get(reading["device_id"])
+                    if device_snapshot is None or device_snapshot["security_status"]["is_authenticated"] == False:
+                        devices.update(reading["device_id"], reading)
+                    
+            except ValueError:
+                print(f"Error: Could not decode message: {body}")
             except Exception as e:
                 print(f"Error processing insecure message: {e}")
         
-        # Define callback function for encrypted messages
-        def encrypted_callback(ch, method, properties, body):
-            try:
-                # Parse the JSON message
-                encrypted_data = json.loads(body)
-                
-                # Check if it's actually encrypted
-                if not encrypted_data.get("is_encrypted", False):
-                    print("Received unencrypted message on encrypted channel - ignoring")
-                    return
+        # Handle a verified delivery from the secure topic exchange
+        def handle_encrypted(verified):
+            if verified.status == DECODE_ERROR:
+                print(f"Error: Could not parse encrypted message: {verified.error}")
+                return
+            
+            # Check if it's actually encrypted
+            if not verified.encrypted:
+                print("Received unencrypted message on encrypted channel - ignoring")
+                return
+            
+            if verified.status == DECRYPTION_FAILED:
+                print(f"Error decrypting message: {verified.error}")
+                push_snapshot(latest_data.modify(lambda current: {
+                    "security_status": dict(current["security_status"], message_integrity="decryption_failed"),
+                    "alerts": list(current["alerts"]) + ["SECURITY ALERT: Decryption failed, possible tampering"]
+                }))
+                return
+            
+            for decrypted_data, is_valid, replay_key in zip(verified.messages, verified.signatures, verified.replay_keys):
+                freshness = encrypted_replays.check(replay_key, decrypted_data.get("timestamp")) if is_valid else None
                 
-                # Decrypt the message
-                try:
-                    decrypted_data = decrypt_message(encrypted_data)
-                    
-                    # Verify the decrypted message signature
-                    is_valid = verify_signature(decrypted_data)
-                    is_recent = is_message_recent(decrypted_data, max_age_seconds=60)
+                if freshness == FRESH:
+                    # Publish a new snapshot with the reading and its alerts
+                    reading = {
+                        "timestamp": decrypted_data["timestamp"],
+                        "temperature": decrypted_data["temperature"],
+                        "humidity": decrypted_data["humidity"],
+                        "soil_moisture": decrypted_data["soil_moisture"],
+                        "device_id": decrypted_data["device_id"],
+                        "security_status": {
+                            "is_authenticated": True,
+                            "last_verified_timestamp": time.time(),
+                            "message_integrity": "verified_encrypted"
+                        },
+                        "alerts": check_alerts(decrypted_data)
+                    }
+                    push_snapshot(latest_data.update(reading))
+                    devices.update(reading["device_id"], reading)
                     
-                    if is_valid and is_recent:
-                        # Update the latest data
-                        global latest_data
-                        latest_data.update({
-                            "timestamp": decrypted_data["timestamp"],
-                            "temperature": decrypted_data["temperature"],
-                            "humidity": decrypted_data["humidity"],
-                            "soil_moisture": decrypted_data["soil_moisture"],
-                            "device_id": decrypted_data["device_id"],
-                            "security_status": {
-                                "is_authenticated": True,
-                                "last_verified_timestamp": time.time(),
-                                "message_integrity": "verified_encrypted"
-                            }
-                        })
-                        
-                        # Calculate alerts
-                        latest_data["alerts"] = check_alerts(decrypted_data)
-                        
-                        print(f"Received authenticated and encrypted data")
-                    else:
-                        print(f"Warning: Decrypted message has invalid signature or is outdated")
-                        
-                except Exception as e:
-                    print(f"Error decrypting message: {e}")
-                    latest_data["security_status"]["message_integrity"] = "decryption_failed"
-                    latest_data["alerts"].append("SECURITY ALERT: Decryption failed, possible tampering")
-                
-            except json.JSONDecodeError:
-                print(f"Error: Could not parse encrypted message as JSON: {body}")
-            except Exception as e:
-                print(f"Error processing encrypted message: {e}")
+                    print("Received authenticated and encrypted data")
+                elif freshness == REPLAYED:
+                    print("Warning: Replayed encrypted message rejected")
+                else:
+                    print("Warning: Decrypted message has invalid signature or is outdated")
+        
+        # Signed and encrypted deliveries are decrypted and verified in micro-batches
+        # on a pool (see verify_pipeline.py), then handled here in delivery order
+        def handle_verified(kind, verified):
+            if kind == 'encrypted':
+                handle_encrypted(verified)
+            else:
+                handle_signed(verified)
+        
+        # Each handled batch is acked at once, up to its last delivery
+        def ack_upto(delivery_tag):
+            if channel.is_open:
+                channel.basic_ack(delivery_tag=delivery_tag, multiple=True)
+        
+        pipeline = VerificationPipeline(
+            handle_verified,
+            ack_upto,
+            connection.add_callback_threadsafe,
+            connection.call_later
+        )
+        
+        # Define callback function for secure signed messages
+        def secure_callback(ch, method, properties, body):
+            pipeline.add(method.delivery_tag, body, properties, 'signed')
+        
+        # Define callback function for encrypted messages
+        def encrypted_callback(ch, method, properties, body):
+            pipeline.add(method.delivery_tag, body, properties, 'encrypted')
+        
+        # Limit the unacked signed and encrypted messages held while they are verified
+        channel.basic_qos(prefetch_count=DEFAULT_PREFETCH)
         
         # Start consuming secure messages
         channel.basic_consume(
             queue=secure_queue_name,
-            on_message_callback=secure_callback,
-            auto_ack=True
+            on_message_callback=secure_callback
         )
         
         # Start consuming insecure messages
@@ -259,8 +279,7 @@ def start_rabbitmq_consumer():
         # Start consuming encrypted messages
         channel.basic_consume(
             queue=encrypted_queue_name,
-            on_message_callback=encrypted_callback,
-            auto_ack=True
+            on_message_callback=encrypted_callback
         )
         
         # Start consuming in a blocking way
@@ -268,13 +287,50 @@ def start_rabbitmq_consumer():
     
     except Exception as e:
         print(f"RabbitMQ consumer error: {e}")
+        get_connection_manager().discard()  # Drop the broken connection from the pool
         time.sleep(5)  # Wait before reconnecting
         start_rabbitmq_consumer()  # Try to reconnect
 
 # API route to get the latest data
 @app.route('/api/sensor-data', methods=['GET'])
 def get_sensor_data():
-    return jsonify(latest_data)
+    # Pre-encoded bytes, or 304 if the client already has this reading
+    return snapshot_response(latest_data.get(), request)
+
+# API route to get the latest data for one device
+@app.route('/api/sensor-data/<device_id>', methods=['GET'])
+def get_device_data(device_id):
+    snapshot = devices.get(device_id)
+    if snapshot is None:
+        return jsonify({
+            'error': 'Not Found',
+            'message': f'No data received from device {device_id}'
+        }), 404
+    return snapshot_response(snapshot, request)
+
+# API route to get the latest data for all devices in one response
+@app.route('/api/devices', methods=['GET'])
+def get_all_devices():
+    body, etag = devices.bulk()
+    return json_response(body, etag, request)
+
+# API route to get the alert thresholds (defaults and per-device overrides) for the dashboard
+@app.route('/api/thresholds', methods=['GET'])
+def get_thresholds():
+    rules = default_engine.rules
+    body = json.dumps(rules.to_dict()).encode()
+    return json_response(body, f"rules-{rules.version}", request)
+
+# Streaming route: pushes each new snapshot as a Server-Sent Event
+@app.route('/api/stream', methods=['GET'])
+def stream_sensor_data():
+    response = Response(
+        broadcaster.stream(initial=encode_event_body('reading', latest_data.get().body)),
+        mimetype='text/event-stream'
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Disable proxy buffering
+    return response
 
 # API route for admin access (demonstration purposes)
 @app.route('/api/admin/reset-security', methods=['POST'])
@@ -289,11 +345,13 @@ def reset_security():
         }), 401
     
     # Reset security status
-    latest_data['security_status'] = {
-        "is_authenticated": False,
-        "last_verified_timestamp": 0,
-        "message_integrity": "reset"
-    }
+    push_snapshot(latest_data.update({
+        'security_status': {
+            "is_authenticated": False,
+            "last_verified_timestamp": 0,
+            "message_integrity": "reset"
+        }
+    }))
     
     return jsonify({
         'success': True,
@@ -308,4 +366,5 @@ rabbitmq_thread.start()
 # Run the Flask app
 if __name__ == '__main__':
     # Change port from 5000 to 5001 to avoid conflicts
-    app.run(host='0.0.0.0', port=5001, debug=True) 
\ No newline at end of file
+    # threaded=True lets each /api/stream client hold its own connection
+    app.run(host='0.0.0.0', port=5001, debug=True, threaded=True) 
\ No newline at end of file
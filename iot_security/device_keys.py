@@ -0,0 +1,190 @@
+"""
+Registry of device keys for message signing.
+
+Signing used to look a device up in DEVICE_CREDENTIALS, encode its key and
+build a new HMAC for every message. KeyRegistry does that work once per
+device, when the key is added:
+
+- the key is stored as bytes, with the device's permissions as a frozenset
+- a pre-keyed HMAC-SHA256 template is kept for each device; signing or
+  verifying copies it and hashes only the message, skipping the key setup
+
+Lookups are dict lookups, so thousands of devices cost nothing per message.
+Keys can be loaded from a JSON file with the same shape as
+DEVICE_CREDENTIALS in security_utils.py:
+
+    {"farm_sensor_01": {"key": "sensor01_secret_key", "permissions": ["publish_data"]}}
+
+Microbenchmark of signature checks per second on one core, before and after:
+
+    python device_keys.py
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+import time
+
+
+class KeyRegistry:
+    """Device keys, permissions and pre-keyed HMAC templates by device ID."""
+
+    def __init__(self, credentials=None):
+        """
+        Args:
+            credentials (dict, optional): device_id -> {"key": str, "permissions": list}
+        """
+        self._keys = {}          # device_id -> key bytes
+        self._templates = {}     # device_id -> HMAC-SHA256 object keyed with the device key
+        self._permissions = {}   # device_id -> frozenset of permissions
+        if credentials:
+            self.update(credentials)
+
+    def __contains__(self, device_id):
+        return device_id in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, device_id, key, permissions=()):
+        """
+        Add or replace a device's key.
+
+        Args:
+            device_id (str): The device ID
+            key (str or bytes): The device's secret key
+            permissions (iterable): Permissions of the device
+        """
+        if isinstance(key, str):
+            key = key.encode('utf-8')
+        self._keys[device_id] = key
+        self._templates[device_id] = hmac.new(key, digestmod=hashlib.sha256)
+        self._permissions[device_id] = frozenset(permissions)
+
+    def update(self, credentials):
+        """
+        Add the devices of a credentials dict.
+
+        Args:
+            credentials (dict): device_id -> {"key": str, "permissions": list}
+
+        Raises:
+            ValueError: If a device has no key
+        """
+        for device_id, entry in credentials.items():
+            if not isinstance(entry, dict) or not entry.get("key"):
+                raise ValueError(f"Device {device_id!r} has no key")
+            self.add(device_id, entry["key"], entry.get("permissions", ()))
+
+    def load(self, path):
+        """
+        Add the devices of a JSON key file.
+
+        Args:
+            path (str): Path of the file
+
+        Returns:
+            int: Number of devices loaded
+
+        Raises:
+            ValueError: If the file is not a valid key file
+        """
+        with open(path) as f:
+            credentials = json.load(f)
+        if not isinstance(credentials, dict):
+            raise ValueError(f"{path}: expected an object of device_id -> credentials")
+        self.update(credentials)
+        return len(credentials)
+
+    def key(self, device_id):
+        """The device's key as bytes, or None if the device is unknown."""
+        return self._keys.get(device_id)
+
+    def permissions(self, device_id):
+        """The device's permissions (empty if the device is unknown)."""
+        return self._permissions.get(device_id, frozenset())
+
+    def sign(self, device_id, data):
+        """
+        HMAC-SHA256 of some bytes with a device's key.
+
+        Args:
+            device_id (str): The device ID
+            data (bytes): The bytes to sign
+
+        Returns:
+            str: The hex signature
+
+        Raises:
+            KeyError: If the device is unknown
+        """
+        mac = self._templates[device_id].copy()
+        mac.update(data)
+        return mac.hexdigest()
+
+    def verify(self, device_id, data, signature):
+        """
+        Check a device's signature of some bytes.
+
+        Args:
+            device_id (str): The device ID
+            data (bytes): The signed bytes
+            signature (str): The hex signature to check
+
+        Returns:
+            bool: True if the device is known and the signature is valid
+        """
+        template = self._templates.get(device_id)
+        if template is None or not isinstance(signature, str):
+            return False
+        mac = template.copy()
+        mac.update(data)
+        return hmac.compare_digest(mac.hexdigest(), signature)
+
+
+def benchmark(count=200000, devices=10000):
+    """Signature checks per second on one core, with a fresh HMAC per message and with the registry."""
+    credentials = {f"sensor_{i:05d}": {"key": f"sensor_{i:05d}_secret_key", "permissions": ["publish_data"]}
+                   for i in range(devices)}
+
+    # Load the keys from a file, as with DEVICE_KEYS_FILE
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump(credentials, f)
+    try:
+        start = time.perf_counter()
+        registry = KeyRegistry()
+        registry.load(f.name)
+        load_ms = (time.perf_counter() - start) * 1000
+    finally:
+        os.unlink(f.name)
+    print(f"Loaded {len(registry)} device keys in {load_ms:.1f} ms")
+
+    payload = json.dumps({
+        "timestamp": time.time(),
+        "temperature": 23.4,
+        "humidity": 55.1,
+        "soil_moisture": 512,
+        "device_id": "sensor_00042"
+    }).encode('utf-8')
+    device_ids = list(credentials)
+    signed = [(device_ids[i % devices], registry.sign(device_ids[i % devices], payload)) for i in range(1000)]
+
+    # Before: look up and encode the key, then build a new HMAC for every message
+    def fresh(device_id, signature):
+        device_key = credentials[device_id]["key"].encode('utf-8')
+        expected = hmac.new(device_key, payload, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(signature, expected)
+
+    print(f"{'method':<10} {'verifies/s':>12}")
+    for name, verify in [("fresh", fresh), ("registry", lambda d, s: registry.verify(d, payload, s))]:
+        start = time.perf_counter()
+        for i in range(count):
+            device_id, signature = signed[i % len(signed)]
+            verify(device_id, signature)
+        print(f"{name:<10} {count / (time.perf_counter() - start):>12,.0f}")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,249 @@
+"""
+High-rate load generation for the sensor emitter.
+Simulates many virtual devices publishing at a target aggregate rate so the
+pipeline can be capacity-tested. Readings are generated in NumPy batches and
+pre-serialized ahead of time; the publish loop only stamps the time, paces
+itself with a token bucket and records how long each publish took.
+"""
+
+import time
+
+import numpy as np
+import pika
+
+from wire_format import binary_reading_prefix, binary_reading_suffix, content_type_for
+from threshold_engine import ThresholdEngine
+from sharding import device_routing_key
+
+# Publish latencies kept for the percentile report (a ring of the latest ones)
+LATENCY_SAMPLES = 1_000_000
+
+# Seconds between progress lines
+REPORT_INTERVAL = 5.0
+
+
+class TokenBucket:
+    """
+    Token bucket pacing: tokens refill at `rate` per second up to `burst`.
+    Unlike a fixed sleep per message this keeps the long-run rate exact while
+    letting the sender catch up in bursts after a stall.
+    """
+
+    def __init__(self, rate, burst):
+        """
+        Args:
+            rate (float): Tokens added per second
+            burst (int): Maximum tokens that can be saved up
+        """
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = float(burst)
+        self._last = time.perf_counter()
+
+    def take(self, count):
+        """
+        Take `count` tokens if they are available.
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise seconds to wait before retrying
+        """
+        now = time.perf_counter()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        if self._tokens >= count:
+            self._tokens -= count
+            return 0.0
+        return (count - self._tokens) / self.rate
+
+
+class ReadingBatches:
+    """Pre-generated, pre-serialized readings for N virtual devices."""
+
+    def __init__(self, devices, batch_size, batches=16, seed=None, wire_format="json"):
+        """
+        Args:
+            devices (int): Number of virtual devices (farm_sensor_00000, ...)
+            batch_size (int): Readings per batch
+            batches (int): Distinct batches generated up front and cycled through
+            seed (int, optional): Random seed for repeatable runs
+            wire_format (str): "json" or "binary"
+        """
+        rng = np.random.default_rng(seed)
+        count = batch_size * batches
+        device_ids = np.arange(count) % devices
+        temperature = np.round(rng.uniform(15, 40, count), 1)
+        humidity = np.round(rng.uniform(20, 80, count), 1)
+        soil_moisture = np.round(rng.uniform(200, 800, count)).astype(np.int64)
+        names = ["farm_sensor_%05d" % d for d in device_ids.tolist()]
+
+        # Alerts per the threshold rules, in each device's reading order, plus the
+        # first reading back in range so the alert handler sees the alert clear
+        engine = ThresholdEngine()
+        generated = {"temperature": temperature, "humidity": humidity, "soil_moisture": soil_moisture}
+        values = np.full((count, len(engine.fields)), np.nan)
+        for column, field in enumerate(engine.fields):
+            if field in generated:
+                values[:, column] = generated[field]
+        result = engine.evaluate(values, names)
+        alert = result.alerting | result.cleared
+
+        # Everything after the timestamp, so a body is just prefix + suffix
+        columns = zip(temperature.tolist(), humidity.tolist(),
+                      soil_moisture.tolist(), names)
+        if wire_format == "binary":
+            suffixes = [binary_reading_suffix(t, h, s, d) for t, h, s, d in columns]
+            self.prefix = binary_reading_prefix
+        else:
+            suffixes = [
+                (', "temperature": %.1f, "humidity": %.1f, "soil_moisture": %d, '
+                 '"device_id": "%s"}' % (t, h, s, d)).encode()
+                for t, h, s, d in columns
+            ]
+            self.prefix = self.json_prefix
+        alert = alert.tolist()
+        # Fanout routing keys select each device's shard (see sharding.py)
+        keys = [device_routing_key(name) for name in names]
+
+        self.batch_size = batch_size
+        self.batches = [
+            (suffixes[i:i + batch_size], alert[i:i + batch_size], keys[i:i + batch_size])
+            for i in range(0, count, batch_size)
+        ]
+
+    @staticmethod
+    def json_prefix(timestamp):
+        return b'{"timestamp": %.6f' % timestamp
+
+    def __iter__(self):
+        while True:
+            for batch in self.batches:
+                yield batch
+
+
+class LatencyStats:
+    """Publish counts and a ring of per-message publish latencies."""
+
+    def __init__(self, samples=LATENCY_SAMPLES):
+        self.latencies = np.zeros(samples, dtype=np.float64)
+        self.count = 0
+        self.started = time.perf_counter()
+
+    def record(self, latencies):
+        """Store a list of latencies in seconds."""
+        values = np.asarray(latencies, dtype=np.float64)[-len(self.latencies):]
+        size = len(self.latencies)
+        start = self.count % size
+        first = min(len(values), size - start)
+        self.latencies[start:start + first] = values[:first]
+        self.latencies[:len(values) - first] = values[first:]
+        self.count += len(latencies)
+
+    def summary(self):
+        """
+        Returns:
+            dict: Messages sent, elapsed seconds, msgs/s and latency percentiles in microseconds
+        """
+        elapsed = time.perf_counter() - self.started
+        result = {
+            "messages": self.count,
+            "elapsed": elapsed,
+            "throughput": self.count / elapsed if elapsed > 0 else 0.0
+        }
+        sample = self.latencies[:min(self.count, len(self.latencies))]
+        if len(sample):
+            p50, p95, p99 = np.percentile(sample, [50, 95, 99]) * 1e6
+            result.update(p50_us=p50, p95_us=p95, p99_us=p99, max_us=sample.max() * 1e6)
+        return result
+
+
+def format_summary(summary):
+    """One line for the console."""
+    line = (f"{summary['messages']} msgs in {summary['elapsed']:.1f}s "
+            f"= {summary['throughput']:,.0f} msgs/s")
+    if "p50_us" in summary:
+        line += (f" | publish latency p50 {summary['p50_us']:.1f}us "
+                 f"p95 {summary['p95_us']:.1f}us p99 {summary['p99_us']:.1f}us "
+                 f"max {summary['max_us']:.1f}us")
+    return line
+
+
+def run_load(connection, channel, devices=1000, rate=50000, duration=None,
+             batch_size=500, chunk_size=100, confirms=None, wire_format="json"):
+    """
+    Publish readings from `devices` virtual devices at `rate` messages per second.
+
+    Every reading goes to sensors.fanout; readings outside the alert thresholds,
+    and the first reading of a device back in range, also go to sensors.direct
+    with the 'alerts' routing key.
+
+    Args:
+        connection (pika.BlockingConnection): Used to sleep while servicing heartbeats
+        channel: Channel to publish on
+        devices (int): Number of virtual devices
+        rate (float): Target aggregate messages per second
+        duration (float, optional): Seconds to run; runs until CTRL+C if None
+        batch_size (int): Readings per pre-generated batch
+        chunk_size (int): Messages sent per token bucket grant
+        confirms (ConfirmTracker, optional): Publish with confirms through this tracker;
+            latencies then include any wait for a free slot in its window
+        wire_format (str): "json" or "binary" message bodies
+
+    Returns:
+        dict: Final summary (see LatencyStats.summary)
+    """
+    batches = ReadingBatches(devices, batch_size, wire_format=wire_format)
+    bucket = TokenBucket(rate, burst=max(chunk_size, rate / 10))
+    stats = LatencyStats()
+    clock = time.perf_counter
+    properties = pika.BasicProperties(content_type=content_type_for(wire_format))
+    if confirms is not None:
+        def publish(exchange, routing_key, body, properties):
+            confirms.publish(exchange, routing_key, body, properties)
+    else:
+        publish = channel.basic_publish
+
+    print(f"Load mode: {devices} devices, target {rate:,.0f} msgs/s, "
+          f"batches of {batch_size}, {wire_format} bodies. Press CTRL+C to stop")
+
+    deadline = None if duration is None else clock() + duration
+    last_report = clock()
+    last_count = 0
+    try:
+        for suffixes, alerts, keys in batches:
+            for start in range(0, batch_size, chunk_size):
+                chunk = suffixes[start:start + chunk_size]
+
+                # Wait for enough tokens for the next chunk
+                wait = bucket.take(len(chunk))
+                while wait:
+                    connection.sleep(wait)
+                    wait = bucket.take(len(chunk))
+
+                prefix = batches.prefix(time.time())
+                latencies = []
+                for suffix, alert, key in zip(chunk, alerts[start:start + chunk_size],
+                                              keys[start:start + chunk_size]):
+                    body = prefix + suffix
+                    sent = clock()
+                    publish(exchange='sensors.fanout', routing_key=key, body=body, properties=properties)
+                    if alert:
+                        publish(exchange='sensors.direct', routing_key='alerts', body=body, properties=properties)
+                    latencies.append(clock() - sent)
+                stats.record(latencies)
+                if confirms is not None:
+                    confirms.flush()
+
+            now = clock()
+            if now - last_report >= REPORT_INTERVAL:
+                print(f"Sent {stats.count} readings "
+                      f"({(stats.count - last_count) / (now - last_report):,.0f} msgs/s in the last interval)")
+                last_count = stats.count
+                last_report = now
+            if deadline is not None and now >= deadline:
+                break
+    except KeyboardInterrupt:
+        pass
+
+    summary = stats.summary()
+    print("Load test finished: " + format_summary(summary))
+    return summary
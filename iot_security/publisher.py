@@ -0,0 +1,245 @@
+"""
+Multi-exchange publisher for the sensor emitter.
+One reading goes to several exchanges. This module encodes each distinct
+payload once, queues the frames for every route of the reading and flushes
+them to the socket together, instead of waiting for a flush after each
+basic_publish.
+
+EnvelopeBatcher builds on it for high-frequency devices: readings are
+collected per route and sent as one envelope message (see wire_format.py).
+"""
+
+import json
+import time
+
+import pika
+
+from wire_format import (encode_binary, encode_binary_envelope, content_type_for,
+                         batch_content_type_for, MAX_ENVELOPE_READINGS)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _encode_json(obj):
+    return json.dumps(obj).encode()
+
+
+def get_encoder(name="auto"):
+    """
+    Return a function that turns a payload dict into JSON bytes.
+
+    Args:
+        name (str): "json", "orjson" or "auto" (orjson if installed, else json)
+
+    Returns:
+        tuple: (encoder name, encode function)
+    """
+    if name == "auto":
+        name = "orjson" if orjson is not None else "json"
+    if name == "orjson":
+        if orjson is None:
+            raise ImportError("orjson is not installed (pip install orjson)")
+        return name, orjson.dumps
+    if name == "json":
+        return name, _encode_json
+    raise ValueError(f"Unknown encoder: {name}")
+
+
+class PublishStats:
+    """Running totals of how much each reading costs to publish."""
+
+    def __init__(self):
+        self.readings = 0
+        self.messages = 0
+        self.bytes = 0
+        self.encode_seconds = 0.0
+        self.publish_seconds = 0.0
+
+    def bytes_per_reading(self):
+        """Average bytes sent per reading, over all routes."""
+        return self.bytes / self.readings if self.readings else 0.0
+
+    def per_reading_us(self):
+        """
+        Returns:
+            tuple: Average (encode, publish) microseconds per reading
+        """
+        if not self.readings:
+            return 0.0, 0.0
+        return (self.encode_seconds / self.readings * 1e6,
+                self.publish_seconds / self.readings * 1e6)
+
+
+class MultiExchangePublisher:
+    """Publish one reading to several exchanges with one flush."""
+
+    def __init__(self, connection, channel, encoder="auto", confirms=None, wire_format="json"):
+        """
+        Args:
+            connection (pika.BlockingConnection): Connection the channel belongs to
+            channel: Channel to publish on
+            encoder (str): JSON encoder, see get_encoder()
+            wire_format (str): "json" or "binary" (see wire_format.py)
+            confirms (ConfirmTracker, optional): Publish through this tracker so
+                every route is confirmed by the broker
+        """
+        self.connection = connection
+        self.channel = channel
+        self.encoder_name, self._encode = get_encoder(encoder)
+        if wire_format == "binary":
+            self.encoder_name, self._encode = "binary", encode_binary
+        self.wire_format = wire_format
+        self.content_type = content_type_for(wire_format)
+        # Routes without their own properties are tagged with the content type
+        self.properties = pika.BasicProperties(content_type=self.content_type)
+        self.batch_content_type = batch_content_type_for(wire_format)
+        self.stats = PublishStats()
+
+        # BlockingChannel.basic_publish writes to the socket after every call;
+        # its underlying channel only queues frames, so queue all routes
+        # there and flush once. Other channel types publish directly.
+        self.confirms = confirms
+        if confirms is not None:
+            self._queue_publish = self._publish_confirmed
+            self._pipelined = True
+        else:
+            self._queue_publish = getattr(channel, "_impl", channel).basic_publish
+            self._pipelined = hasattr(channel, "_impl")
+
+    def _publish_confirmed(self, exchange, routing_key, body, properties):
+        self.confirms.publish(exchange, routing_key, body, properties)
+
+    def encode(self, payload):
+        """Encode a payload dict to bytes, counting the time as encode cost."""
+        start = time.perf_counter()
+        body = self._encode(payload)
+        self.stats.encode_seconds += time.perf_counter() - start
+        return body
+
+    def encode_envelope(self, readings):
+        """Encode several readings as one envelope body."""
+        start = time.perf_counter()
+        if self.wire_format == "binary":
+            body = encode_binary_envelope(readings)
+        else:
+            body = self._encode({"readings": readings})
+        self.stats.encode_seconds += time.perf_counter() - start
+        return body
+
+    def publish_payloads(self, routes):
+        """
+        Encode and publish the routes of one reading. Routes that share a
+        payload dict share its encoded body.
+
+        Args:
+            routes (list): (exchange, routing_key, payload, properties) tuples
+
+        Returns:
+            float: Seconds spent publishing
+        """
+        bodies = {}
+        encoded = []
+        for exchange, routing_key, payload, properties in routes:
+            body = bodies.get(id(payload))
+            if body is None:
+                body = bodies[id(payload)] = self.encode(payload)
+            encoded.append((exchange, routing_key, body, properties))
+        return self.publish(encoded)
+
+    def publish(self, routes, readings=1):
+        """
+        Publish the routes of one reading (or of one batch of envelopes).
+
+        Args:
+            routes (list): (exchange, routing_key, body, properties) tuples; body
+                is bytes from encode() and properties may be None for the default
+                (own properties should carry content_type=self.content_type)
+            readings (int): Readings the routes carry, for the per-reading stats
+
+        Returns:
+            float: Seconds spent publishing
+        """
+        start = time.perf_counter()
+        for exchange, routing_key, body, properties in routes:
+            self._queue_publish(exchange=exchange, routing_key=routing_key,
+                                body=body, properties=properties or self.properties)
+            self.stats.bytes += len(body)
+        if self._pipelined:
+            # Send everything queued above and service heartbeats
+            self.connection.process_data_events(time_limit=0)
+        elapsed = time.perf_counter() - start
+
+        self.stats.readings += readings
+        self.stats.messages += len(routes)
+        self.stats.publish_seconds += elapsed
+        return elapsed
+
+
+class EnvelopeBatcher:
+    """
+    Collect readings per route and publish them as envelopes.
+
+    An envelope for a route (exchange, routing key and device) is sent once
+    it holds max_readings readings or its oldest reading is max_delay_ms old,
+    so one AMQP message carries many samples of a high-frequency device.
+    """
+
+    def __init__(self, publisher, max_readings=50, max_delay_ms=1000):
+        """
+        Args:
+            publisher (MultiExchangePublisher): Publishes and encodes the envelopes
+            max_readings (int): Send an envelope once it holds this many readings
+            max_delay_ms (int): Send an envelope once its oldest reading is this old
+        """
+        self.publisher = publisher
+        self.max_readings = min(max(1, max_readings), MAX_ENVELOPE_READINGS)
+        self.max_delay = max_delay_ms / 1000.0
+        # (exchange, routing_key, device_id) -> [first reading time, readings, properties]
+        self._pending = {}
+
+    def add(self, routes):
+        """
+        Queue the routes of one reading, sending any envelope that is full.
+
+        Args:
+            routes (list): (exchange, routing_key, payload, properties) tuples,
+                as for MultiExchangePublisher.publish_payloads()
+        """
+        full = []
+        for exchange, routing_key, payload, properties in routes:
+            key = (exchange, routing_key, payload.get("device_id"))
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = self._pending[key] = [time.monotonic(), [], properties]
+            pending[1].append(payload)
+            if len(pending[1]) >= self.max_readings:
+                full.append(key)
+        self.publisher.stats.readings += 1
+        if full:
+            self._send(full)
+
+    def flush_if_due(self):
+        """Send envelopes whose oldest reading has waited longer than max_delay_ms."""
+        now = time.monotonic()
+        due = [key for key, pending in self._pending.items() if now - pending[0] >= self.max_delay]
+        if due:
+            self._send(due)
+
+    def flush(self):
+        """Send every envelope that has readings."""
+        if self._pending:
+            self._send(list(self._pending))
+
+    def _send(self, keys):
+        routes = []
+        for key in keys:
+            _, batch, properties = self._pending.pop(key)
+            headers = properties.headers if properties is not None else None
+            routes.append((key[0], key[1], self.publisher.encode_envelope(batch),
+                           pika.BasicProperties(content_type=self.publisher.batch_content_type,
+                                                headers=headers)))
+        # Readings were counted as they were added
+        self.publisher.publish(routes, readings=0)
@@ -0,0 +1,140 @@
+"""
+Replay protection for signed messages.
+
+is_message_recent() only rejects messages older than a minute, so a signed
+message can be replayed any number of times within that minute. A
+ReplayCache remembers the signatures it accepted for as long as their
+messages would pass the age check, and rejects them the second time.
+
+Signatures are kept in time buckets of `bucket_seconds`, chosen by the
+message's own (signed) timestamp. A message always lands in the same
+bucket, so checking and inserting looks at one set: O(1). Buckets are
+dropped whole once every message in them is older than `max_age`, so the
+cache holds at most rate x (max_age + bucket_seconds) signatures.
+Timestamps further than `max_skew` in the future are rejected; otherwise
+they would pin their bucket, and its memory, for longer than the window.
+
+Benchmark (checks per second and entries kept at a given message rate):
+
+    python replay_cache.py
+"""
+
+import math
+import os
+import time
+from dotenv import load_dotenv
+
+# Defaults, overridable in .env
+load_dotenv()
+REPLAY_WINDOW = float(os.getenv('REPLAY_WINDOW', 60))
+REPLAY_BUCKET_SECONDS = float(os.getenv('REPLAY_BUCKET_SECONDS', 5))
+REPLAY_MAX_SKEW = float(os.getenv('REPLAY_MAX_SKEW', 5))
+
+# Outcome of a check
+FRESH = "fresh"          # First time seen, now remembered
+REPLAYED = "replayed"    # Seen before within the window
+EXPIRED = "expired"      # Too old (or no timestamp)
+FUTURE = "future"        # Timestamp too far in the future
+
+
+class ReplayCache:
+    """Signatures of accepted messages, in buckets by message timestamp."""
+
+    def __init__(self, max_age=REPLAY_WINDOW, bucket_seconds=REPLAY_BUCKET_SECONDS,
+                 max_skew=REPLAY_MAX_SKEW):
+        """
+        Args:
+            max_age (float): Oldest message accepted, in seconds
+            bucket_seconds (float): Time span of one bucket
+            max_skew (float): How far in the future a timestamp may be
+        """
+        self.max_age = max_age
+        self.bucket_seconds = bucket_seconds
+        self.max_skew = max_skew
+        self._buckets = {}       # bucket number -> set of keys
+        self._oldest = None      # Lowest bucket number that may still be live
+        self._size = 0
+
+        self.replays = 0
+
+    def __len__(self):
+        return self._size
+
+    def check(self, key, timestamp, now=None):
+        """
+        Check a message and remember it if it is fresh.
+
+        Args:
+            key: What identifies the message, e.g. its signature (hashable)
+            timestamp (float): The message's signed timestamp
+            now (float, optional): Current time in seconds, default time.time()
+
+        Returns:
+            str: FRESH, REPLAYED, EXPIRED or FUTURE
+        """
+        if now is None:
+            now = time.time()
+        if not isinstance(timestamp, (int, float)) or timestamp < now - self.max_age:
+            return EXPIRED
+        if timestamp > now + self.max_skew:
+            return FUTURE
+
+        self._expire(now)
+        number = math.floor(timestamp / self.bucket_seconds)
+        bucket = self._buckets.get(number)
+        if bucket is None:
+            bucket = self._buckets[number] = set()
+            if self._oldest is None or number < self._oldest:
+                self._oldest = number
+        elif key in bucket:
+            self.replays += 1
+            return REPLAYED
+
+        bucket.add(key)
+        self._size += 1
+        return FRESH
+
+    def _expire(self, now):
+        # Buckets that end before the oldest acceptable timestamp can go
+        cutoff = math.floor((now - self.max_age) / self.bucket_seconds)
+        if self._oldest is None or self._oldest >= cutoff:
+            return
+        if cutoff - self._oldest > len(self._buckets):
+            # Idle for a long time: cheaper to look at the buckets than at every number in between
+            for number in [n for n in self._buckets if n < cutoff]:
+                self._size -= len(self._buckets.pop(number))
+        else:
+            for number in range(self._oldest, cutoff):
+                bucket = self._buckets.pop(number, None)
+                if bucket is not None:
+                    self._size -= len(bucket)
+        self._oldest = min(self._buckets) if self._buckets else None
+
+
+def benchmark(rate=2000, seconds=180):
+    """Checks per second, and entries kept, for `rate` messages/s over `seconds` of simulated time."""
+    cache = ReplayCache()
+    count = rate * seconds
+    start_time = 1_700_000_000.0
+    keys = [f"{i:064x}" for i in range(count)]
+
+    largest = 0
+    start = time.perf_counter()
+    for i in range(count):
+        now = start_time + i / rate
+        cache.check(keys[i], now, now)
+        if i % rate == 0:
+            largest = max(largest, len(cache))
+    checks = count / (time.perf_counter() - start)
+
+    # Every message again, 10 seconds later: all still inside the window, all replays
+    replayed = sum(cache.check(keys[i], start_time + i / rate, start_time + i / rate + 10) == REPLAYED
+                   for i in range(count - rate * 30, count))
+
+    bound = rate * (cache.max_age + cache.bucket_seconds)
+    print(f"{checks:,.0f} checks/s, at most {largest:,} entries kept (bound {bound:,.0f}), "
+          f"{replayed:,} of {rate * 30:,} replays caught")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -6,7 +6,6 @@ This tool monitors for suspicious activities and logs security events.
 It demonstrates how to detect various security threats in an IoT system.
 """
 
-import json
 import sys
 import os
 import time
@@ -16,8 +15,10 @@ from colorama import init, Fore, Style
 
 # Add parent directory to path to import utils
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils import get_rabbitmq_connection
-from security_utils import verify_signature, is_message_recent
+from async_runtime import Consumer, ConsumerRuntime
+from security_utils import is_message_recent
+from verify_pipeline import VerificationPipeline, DECODE_ERROR, DECRYPTION_FAILED
+from replay_cache import ReplayCache, REPLAYED, EXPIRED
 
 # Initialize colorama for colored terminal output
 init()
@@ -26,16 +27,6 @@ init()
 LOG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 
                        'data', 'security_events.log')
 
-# Connect to RabbitMQ using CloudAMQP credentials
-print(f"{Fore.BLUE}[SECURITY MONITOR] {Fore.CYAN}Connecting to RabbitMQ...{Style.RESET_ALL}")
-try:
-    connection = get_rabbitmq_connection()
-    channel = connection.channel()
-    print(f"{Fore.GREEN}[SECURITY MONITOR] Connected successfully!{Style.RESET_ALL}")
-except Exception as e:
-    print(f"{Fore.RED}[SECURITY MONITOR] Connection failed: {e}{Style.RESET_ALL}")
-    sys.exit(1)
-
 # Declare and listen to all exchanges to detect tampering
 exchanges = [
     {'name': 'sensors.fanout', 'type': 'fanout', 'routing_key': '', 'secure': False},
@@ -48,6 +39,7 @@ exchanges = [
     {'name': 'mitm.fanout', 'type': 'fanout', 'routing_key': '', 'secure': False},
     {'name': 'mitm.direct', 'type': 'direct', 'routing_key': '#', 'secure': False},
 ]
+exchanges_by_name = {exchange_info['name']: exchange_info for exchange_info in exchanges}
 
 # Dictionary to store message history for anomaly detection
 message_history = {
@@ -148,97 +140,130 @@ def check_for_tampering(message, device_id):
     device_history['message_count'] += 1
     return False
 
-def create_callback(exchange_info):
-    """Create a callback function for each exchange."""
-    def callback(ch, method, properties, body):
+class SecurityMonitor(Consumer):
+    """
+    Watches every exchange through one queue bound to all of them.
+    Decryption and signature checks run in micro-batches on a pool (see
+    verify_pipeline.py) so a burst of signed messages does not stall the
+    other consumers in the process; results come back in delivery order,
+    which the per-device tampering checks rely on, and are acked after.
+    """
+
+    name = 'SECURITY MONITOR'
+    bindings = [(e['name'], e['type'], e['routing_key']) for e in exchanges]
+
+    # Messages are acked by the verification pipeline once handled
+    manual_ack = True
+
+    def __init__(self):
+        super().__init__()
+        self.pipeline = None
+        # Signatures seen within the replay window (see replay_cache.py)
+        self.replays = ReplayCache()
+
+    def on_start(self):
+        # Delivery tags restart on every new channel, so each channel gets its own pipeline
+        channel = self.channel
+        loop = self.runtime.loop
+
+        def ack_upto(delivery_tag):
+            if channel.is_open:
+                channel.basic_ack(delivery_tag=delivery_tag, multiple=True)
+
+        self.pipeline = VerificationPipeline(self.on_verified, ack_upto,
+                                             loop.call_soon_threadsafe, loop.call_later)
+        for exchange_info in exchanges:
+            print(f"{Fore.GREEN}[SECURITY MONITOR] Monitoring {exchange_info['name']} exchange{Style.RESET_ALL}")
+        print(f"{Fore.GREEN}[SECURITY MONITOR] Security monitoring active{Style.RESET_ALL}")
+
+    def handle(self, message):
+        # Decrypted, decoded and verified on the pool; on_verified() gets the result
+        self.pipeline.add(message.delivery_tag, message.body, message.properties, message.exchange)
+
+    def on_verified(self, exchange_name, verified):
+        """Run the security checks on a verified delivery, in delivery order."""
         try:
-            # Parse the message
-            data = json.loads(body)
-            
-            # Check if this is a secure exchange
-            is_secure = exchange_info['secure']
-            exchange_name = exchange_info['name']
-            
             # Special check for mitm exchanges
             if exchange_name.startswith('mitm.'):
                 details = f"Detected message on MITM exchange: {exchange_name}"
                 log_security_event('MITM_ATTACK_DETECTED', details)
                 return
-            
+
+            if verified.status == DECRYPTION_FAILED:
+                log_security_event('DECRYPTION_FAILED', f"{verified.error} on {exchange_name}")
+                return
+            if verified.status == DECODE_ERROR:
+                print(f"{Fore.RED}[SECURITY MONITOR] Could not decode message on {exchange_name}: "
+                      f"{verified.error}{Style.RESET_ALL}")
+                return
+
             # Basic logging
             print(f"{Fore.BLUE}[SECURITY MONITOR] Received message on {exchange_name}")
-            
-            # Check for suspicious activities
-            # 1. Check for unsigned messages on secure exchanges
-            if is_secure and 'signature' not in data:
-                details = f"Unsigned message on secure exchange {exchange_name}"
-                log_security_event('UNSIGNED_MESSAGE', details)
-            
-            # 2. Check signature validity for signed messages
-            if 'signature' in data:
-                is_valid = verify_signature(data)
-                if not is_valid:
-                    details = f"Invalid signature detected on {exchange_name}"
-                    log_security_event('INVALID_SIGNATURE', details)
-            
-            # 3. Check message recency for signed messages
-            if 'signature' in data and 'timestamp' in data:
-                is_recent = is_message_recent(data, max_age_seconds=60)
-                if not is_recent:
-                    details = f"Message replay detected on {exchange_name}: {data['timestamp']}"
-                    log_security_event('MESSAGE_REPLAY', details)
-            
-            # 4. Check for value tampering
-            if 'device_id' in data:
-                was_tampered = check_for_tampering(data, data['device_id'])
-                if was_tampered:
-                    print(f"{Fore.YELLOW}[SECURITY MONITOR] Possible tampering detected for device {data['device_id']}{Style.RESET_ALL}")
-            
-            # 5. Check for unauthorized command
-            if 'command' in data and 'device_id' in data:
-                if data.get('device_id') != 'admin_device':
-                    details = f"Unauthorized command detected from {data.get('device_id')}: {data.get('command')}"
-                    log_security_event('UNAUTHORIZED_COMMAND', details)
-                
-                if 'signature' not in data or not verify_signature(data):
-                    details = f"Unsigned or invalidly signed command detected: {data.get('command')}"
-                    log_security_event('UNSIGNED_COMMAND', details)
-            
-        except json.JSONDecodeError:
-            print(f"{Fore.RED}[SECURITY MONITOR] Could not parse message as JSON: {body}{Style.RESET_ALL}")
+
+            for data, signature, replay_key in zip(verified.messages, verified.signatures, verified.replay_keys):
+                self.check_message(data, exchange_name, signature, replay_key)
+
         except Exception as e:
             print(f"{Fore.RED}[SECURITY MONITOR] Error processing message: {e}{Style.RESET_ALL}")
-    
-    return callback
 
-# Start consuming messages from all exchanges
-for exchange_info in exchanges:
-    try:
-        # Declare the exchange
-        channel.exchange_declare(exchange=exchange_info['name'], exchange_type=exchange_info['type'])
-        
-        # Create a queue for this exchange
-        result = channel.queue_declare(queue='', exclusive=True)
-        queue_name = result.method.queue
-        
-        # Bind the queue to the exchange
-        channel.queue_bind(
-            exchange=exchange_info['name'],
-            queue=queue_name,
-            routing_key=exchange_info['routing_key']
-        )
-        
-        print(f"{Fore.GREEN}[SECURITY MONITOR] Monitoring {exchange_info['name']} exchange{Style.RESET_ALL}")
-        
-        # Start consuming messages from this queue
-        channel.basic_consume(
-            queue=queue_name,
-            on_message_callback=create_callback(exchange_info),
-            auto_ack=True
-        )
-        
-    except Exception as e:
-        print(f"{Fore.RED}[SECURITY MONITOR] Error setting up monitoring for {exchange_info['name']}: {e}{Style.RESET_ALL}")
+    def check_message(self, data, exchange_name, signature=None, replay_key=None):
+        """
+        Run every security check on one decoded message.
+
+        Args:
+            data (dict): The decoded message
+            exchange_name (str): Exchange it arrived on
+            signature (bool): True if the message's signature is valid, False
+                if it is invalid, None if the message is unsigned
+            replay_key (str): The message's signature, to spot replays
+        """
+        # Check if this is a secure exchange
+        exchange_info = exchanges_by_name.get(exchange_name, {'secure': False})
+        is_secure = exchange_info['secure']
+        is_signed = signature is not None
+
+        # Check for suspicious activities
+        # 1. Check for unsigned messages on secure exchanges
+        if is_secure and not is_signed:
+            details = f"Unsigned message on secure exchange {exchange_name}"
+            log_security_event('UNSIGNED_MESSAGE', details)
+
+        # 2. Check signature validity for signed messages (checked on the pool)
+        is_valid = bool(signature)
+        if is_signed and not is_valid:
+            details = f"Invalid signature detected on {exchange_name}"
+            log_security_event('INVALID_SIGNATURE', details)
+
+        # 3. Check message recency for signed messages, and that validly signed
+        # ones were not seen before (the emitter sends each reading to several
+        # exchanges, so the same signature on another exchange is no replay)
+        if is_signed and 'timestamp' in data:
+            if is_valid:
+                freshness = self.replays.check((exchange_name, replay_key), data['timestamp'])
+            else:
+                freshness = None if is_message_recent(data, max_age_seconds=60) else EXPIRED
+            if freshness == REPLAYED:
+                details = f"Replayed message detected on {exchange_name}: {data['timestamp']}"
+                log_security_event('MESSAGE_REPLAY', details)
+            elif freshness == EXPIRED:
+                details = f"Message replay detected on {exchange_name}: {data['timestamp']}"
+                log_security_event('MESSAGE_REPLAY', details)
+
+        # 4. Check for value tampering
+        if 'device_id' in data:
+            was_tampered = check_for_tampering(data, data['device_id'])
+            if was_tampered:
+                print(f"{Fore.YELLOW}[SECURITY MONITOR] Possible tampering detected for device {data['device_id']}{Style.RESET_ALL}")
+
+        # 5. Check for unauthorized command
+        if 'command' in data and 'device_id' in data:
+            if data.get('device_id') != 'admin_device':
+                details = f"Unauthorized command detected from {data.get('device_id')}: {data.get('command')}"
+                log_security_event('UNAUTHORIZED_COMMAND', details)
+
+            if not is_signed or not is_valid:
+                details = f"Unsigned or invalidly signed command detected: {data.get('command')}"
+                log_security_event('UNSIGNED_COMMAND', details)
 
 # Function to periodically show security stats
 def show_security_stats():
@@ -258,19 +283,23 @@ def show_security_stats():
         else:
             print(f"{Fore.GREEN}[SECURITY MONITOR] No security events detected in the last interval{Style.RESET_ALL}")
 
-# Start the stats thread
-stats_thread = threading.Thread(target=show_security_stats)
-stats_thread.daemon = True
-stats_thread.start()
+def start_stats_thread():
+    """Print a summary of security events every 30 seconds in the background."""
+    stats_thread = threading.Thread(target=show_security_stats)
+    stats_thread.daemon = True
+    stats_thread.start()
 
-print(f"{Fore.GREEN}[SECURITY MONITOR] Security monitoring active{Style.RESET_ALL}")
-print(f"{Fore.YELLOW}Press Ctrl+C to exit{Style.RESET_ALL}")
+def create_consumers():
+    """Consumers this script contributes to a shared runtime."""
+    start_stats_thread()
+    return [SecurityMonitor()]
 
-try:
-    # Start consuming messages
-    channel.start_consuming()
-except KeyboardInterrupt:
+if __name__ == '__main__':
+    print(f"{Fore.BLUE}[SECURITY MONITOR] {Fore.CYAN}Connecting to RabbitMQ...{Style.RESET_ALL}")
+    print(f"{Fore.YELLOW}Press Ctrl+C to exit{Style.RESET_ALL}")
+
+    runtime = ConsumerRuntime()
+    for consumer in create_consumers():
+        runtime.register(consumer)
+    runtime.run_forever()
     print(f"{Fore.BLUE}[SECURITY MONITOR] Stopping security monitor{Style.RESET_ALL}")
-    channel.stop_consuming()
-    
-connection.close() 
\ No newline at end of file
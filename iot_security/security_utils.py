@@ -1,17 +1,59 @@
 """
 Security utilities for the IoT security project.
 Provides functions for encryption, decryption, and message authentication.
+
+Two encryption modes are available:
+
+- encrypt_message(): AES-256-CBC with PKCS7 padding, returned as a dict with
+  base64 fields that is sent as JSON. It only provides confidentiality, so
+  messages are also signed with sign_message().
+- encrypt_frame(): AES-256-GCM, which encrypts and authenticates in one pass,
+  returned as a compact binary frame sent with CONTENT_TYPE_GCM:
+
+    offset  size  field
+    0       1     magic (0xA5)
+    1       1     version (1)
+    2       12    nonce
+    14      n+16  ciphertext of the compact JSON message, then the GCM tag
+
+  The two header bytes are authenticated as associated data. The AESGCM
+  object of each key is created once and reused. The GCM tag proves the
+  frame was made with the shared key; a per-device signature inside the
+  frame still tells which device sent it.
+
+decrypt_message() accepts both: a CBC envelope (dict or JSON bytes) or a
+GCM frame.
+
+Messages are signed in one of two ways:
+
+- sign_message() adds a "signature" field to the dict, computed over
+  json.dumps(message, sort_keys=True); verify_signature() has to copy the
+  parsed dict and serialize it again to check it.
+- sign_payload() signs the exact bytes that are sent, and the signature
+  travels next to them in the x-device-id and x-signature AMQP headers
+  (signature_headers()). verify_headers() is a single HMAC over the
+  received body, before it is parsed.
+
+Both use the device keys in key_registry (see device_keys.py), which keeps a
+pre-keyed HMAC per device.
+
+Benchmark of the encryption and signing modes:
+
+    python security_utils.py
 """
 
 import base64
-import hashlib
-import hmac
 import json
 import os
 import time
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives import padding
 from cryptography.hazmat.backends import default_backend
+from cryptography.exceptions import InvalidTag
+from functools import lru_cache
+from dotenv import load_dotenv
+from device_keys import KeyRegistry
 
 # This is a demo key - in a real application, this would be securely stored
 # and not hardcoded in the source code
@@ -30,6 +72,26 @@ DEVICE_CREDENTIALS = {
     }
 }
 
+# Keys of every known device, as bytes with pre-keyed HMACs (see device_keys.py).
+# DEVICE_KEYS_FILE adds the devices of a JSON key file to the demo credentials.
+load_dotenv()
+DEVICE_KEYS_FILE = os.getenv('DEVICE_KEYS_FILE')
+key_registry = KeyRegistry(DEVICE_CREDENTIALS)
+if DEVICE_KEYS_FILE:
+    key_registry.load(DEVICE_KEYS_FILE)
+
+# Detached signatures travel in these AMQP headers (see sign_payload())
+DEVICE_HEADER = "x-device-id"
+SIGNATURE_HEADER = "x-signature"
+
+# AES-GCM frames (see the module docstring)
+CONTENT_TYPE_GCM = "application/vnd.iot.aesgcm"
+GCM_MAGIC = 0xA5
+GCM_VERSION = 1
+GCM_HEADER = bytes((GCM_MAGIC, GCM_VERSION))
+GCM_NONCE_SIZE = 12
+GCM_TAG_SIZE = 16
+
 def generate_iv():
     """Generate a random initialization vector for AES encryption."""
     return os.urandom(16)  # 16 bytes IV for AES
@@ -76,7 +138,7 @@ def encrypt_message(message_dict, key=DEFAULT_SECRET_KEY):
     
     return encrypted_message
 
-def decrypt_message(encrypted_message, key=DEFAULT_SECRET_KEY):
+def decrypt_cbc(encrypted_message, key=DEFAULT_SECRET_KEY):
     """
     Decrypt an encrypted message using AES-256-CBC.
     
@@ -109,6 +171,106 @@ def decrypt_message(encrypted_message, key=DEFAULT_SECRET_KEY):
     # Convert JSON string back to dictionary
     return json.loads(plaintext.decode('utf-8'))
 
+@lru_cache(maxsize=64)
+def get_aesgcm(key):
+    """AESGCM object for a key, created once and reused for every message."""
+    return AESGCM(key)
+
+def is_gcm_frame(body):
+    """Check whether a message body is an AES-GCM frame (JSON never starts with the magic byte)."""
+    return len(body) > 0 and body[0] == GCM_MAGIC
+
+def encrypt_frame(message, key=DEFAULT_SECRET_KEY):
+    """
+    Encrypt and authenticate a message using AES-256-GCM.
+    
+    Args:
+        message (dict or bytes): The message to encrypt; bytes (e.g. a
+            payload with a detached signature) are encrypted as they are
+        key (bytes): The encryption key
+        
+    Returns:
+        bytes: The binary frame (header, nonce, ciphertext and tag)
+    """
+    # Compact JSON, no padding needed
+    if isinstance(message, dict):
+        plaintext = json.dumps(message, separators=(',', ':')).encode('utf-8')
+    else:
+        plaintext = bytes(message)
+    
+    # A random 96-bit nonce per message; the header is authenticated too
+    nonce = os.urandom(GCM_NONCE_SIZE)
+    return GCM_HEADER + nonce + get_aesgcm(key).encrypt(nonce, plaintext, GCM_HEADER)
+
+def open_frame(frame, key=DEFAULT_SECRET_KEY):
+    """
+    Decrypt an AES-256-GCM frame made by encrypt_frame() to its plaintext bytes.
+    
+    Args:
+        frame (bytes): The binary frame
+        key (bytes): The decryption key
+        
+    Returns:
+        bytes: The plaintext, e.g. for verify_headers()
+        
+    Raises:
+        ValueError: If the frame is malformed or fails authentication
+    """
+    header_size = len(GCM_HEADER) + GCM_NONCE_SIZE
+    if not is_gcm_frame(frame) or len(frame) < header_size + GCM_TAG_SIZE:
+        raise ValueError("Not an AES-GCM frame")
+    if frame[1] != GCM_VERSION:
+        raise ValueError(f"Unsupported AES-GCM frame version: {frame[1]}")
+    
+    frame = bytes(frame)
+    nonce = frame[len(GCM_HEADER):header_size]
+    try:
+        return get_aesgcm(key).decrypt(nonce, frame[header_size:], GCM_HEADER)
+    except InvalidTag:
+        raise ValueError("AES-GCM frame failed authentication, possible tampering")
+
+def decrypt_frame(frame, key=DEFAULT_SECRET_KEY):
+    """
+    Decrypt an AES-256-GCM frame made by encrypt_frame().
+    
+    Args:
+        frame (bytes): The binary frame
+        key (bytes): The decryption key
+        
+    Returns:
+        dict: The decrypted message as a dictionary
+        
+    Raises:
+        ValueError: If the frame is malformed or fails authentication
+    """
+    return json.loads(open_frame(frame, key))
+
+def decrypt_message(encrypted_message, key=DEFAULT_SECRET_KEY):
+    """
+    Decrypt a message encrypted with either mode.
+    
+    Args:
+        encrypted_message (dict or bytes): A CBC envelope (as a dict or its
+            JSON text) or an AES-GCM frame
+        key (bytes): The decryption key
+        
+    Returns:
+        dict: The decrypted message as a dictionary
+        
+    Raises:
+        ValueError: If the message is not encrypted or cannot be decrypted
+    """
+    if isinstance(encrypted_message, (bytes, bytearray, memoryview)):
+        if is_gcm_frame(encrypted_message):
+            return decrypt_frame(encrypted_message, key)
+        encrypted_message = json.loads(encrypted_message)
+    elif isinstance(encrypted_message, str):
+        encrypted_message = json.loads(encrypted_message)
+    
+    if not isinstance(encrypted_message, dict) or "encrypted_data" not in encrypted_message:
+        raise ValueError("Message is not encrypted")
+    return decrypt_cbc(encrypted_message, key)
+
 def sign_message(message, device_id, timestamp=None):
     """
     Sign a message using HMAC-SHA256.
@@ -121,11 +283,9 @@ def sign_message(message, device_id, timestamp=None):
     Returns:
         dict: The original message with signature and metadata added
     """
-    if device_id not in DEVICE_CREDENTIALS:
+    if device_id not in key_registry:
         raise ValueError(f"Unknown device ID: {device_id}")
     
-    device_key = DEVICE_CREDENTIALS[device_id]["key"].encode('utf-8')
-    
     # Add metadata
     if timestamp is None:
         timestamp = time.time()
@@ -136,11 +296,7 @@ def sign_message(message, device_id, timestamp=None):
     
     # Create the signature
     message_str = json.dumps(message_copy, sort_keys=True)
-    signature = hmac.new(
-        device_key, 
-        message_str.encode('utf-8'), 
-        hashlib.sha256
-    ).hexdigest()
+    signature = key_registry.sign(device_id, message_str.encode('utf-8'))
     
     # Add the signature to the message
     message_copy["signature"] = signature
@@ -164,24 +320,102 @@ def verify_signature(signed_message):
     if device_id is None or signature is None:
         return False
     
-    if device_id not in DEVICE_CREDENTIALS:
+    if device_id not in key_registry:
         return False
     
     # Create a copy of the message without the signature
     message_copy = signed_message.copy()
     message_copy.pop("signature")
     
-    # Create the expected signature
-    device_key = DEVICE_CREDENTIALS[device_id]["key"].encode('utf-8')
+    # Compare the signature with the expected one
     message_str = json.dumps(message_copy, sort_keys=True)
-    expected_signature = hmac.new(
-        device_key, 
-        message_str.encode('utf-8'), 
-        hashlib.sha256
-    ).hexdigest()
+    return key_registry.verify(device_id, message_str.encode('utf-8'), signature)
+
+def sign_payload(payload, device_id):
+    """
+    Sign the exact bytes of a message with HMAC-SHA256 (a detached signature).
+    
+    Args:
+        payload (bytes): The message body as it is sent
+        device_id (str): The ID of the device sending the message
+        
+    Returns:
+        str: The hex signature
+    """
+    if device_id not in key_registry:
+        raise ValueError(f"Unknown device ID: {device_id}")
+    
+    return key_registry.sign(device_id, payload)
+
+def signature_headers(payload, device_id):
+    """
+    AMQP headers carrying a detached signature of a message body.
     
-    # Compare the signatures
-    return hmac.compare_digest(signature, expected_signature)
+    Args:
+        payload (bytes): The message body as it is sent
+        device_id (str): The ID of the device sending the message
+        
+    Returns:
+        dict: Headers for pika.BasicProperties(headers=...)
+    """
+    return {DEVICE_HEADER: device_id, SIGNATURE_HEADER: sign_payload(payload, device_id)}
+
+def verify_headers(payload, headers):
+    """
+    Verify the detached signature of a message body.
+    
+    The signature covers the received bytes, so this is one HMAC over the
+    buffer, before (or without) parsing it. Callers should still check that
+    the device_id inside the message matches the signing device.
+    
+    Args:
+        payload (bytes): The message body as it was received
+        headers (dict): The message's AMQP headers (may be None)
+        
+    Returns:
+        str: The ID of the signing device if the signature is valid, None otherwise
+    """
+    if not headers:
+        return None
+    device_id = headers.get(DEVICE_HEADER)
+    signature = headers.get(SIGNATURE_HEADER)
+    
+    if device_id is None or signature is None:
+        return None
+    
+    # Header values may arrive as bytes
+    if isinstance(device_id, bytes):
+        device_id = device_id.decode('utf-8')
+    if isinstance(signature, bytes):
+        signature = signature.decode('utf-8')
+    
+    if key_registry.verify(device_id, payload, signature):
+        return device_id
+    return None
+
+def has_detached_signature(headers):
+    """Check whether AMQP headers carry a detached signature."""
+    return bool(headers) and SIGNATURE_HEADER in headers
+
+def load_signed(payload, headers=None):
+    """
+    Parse a signed JSON message and check its signature, detached or embedded.
+    
+    Args:
+        payload (bytes): The message body as it was received
+        headers (dict, optional): The message's AMQP headers
+        
+    Returns:
+        tuple: (message dict, True if the signature is valid)
+    """
+    if has_detached_signature(headers):
+        device_id = verify_headers(payload, headers)
+        message = json.loads(payload)
+        # The signing device must be the one the message claims to come from
+        return message, device_id is not None and message.get("device_id") == device_id
+    
+    message = json.loads(payload)
+    return message, verify_signature(message)
 
 def is_message_recent(signed_message, max_age_seconds=60):
     """
@@ -217,7 +451,80 @@ def validate_message_permissions(signed_message, required_permission):
     """
     device_id = signed_message.get("device_id")
     
-    if device_id is None or device_id not in DEVICE_CREDENTIALS:
+    if device_id is None or device_id not in key_registry:
         return False
     
-    return required_permission in DEVICE_CREDENTIALS[device_id]["permissions"] 
\ No newline at end of file
+    return required_permission in key_registry.permissions(device_id)
+
+def benchmark(count=20000):
+    """Compare message size and throughput of the signing and encryption modes."""
+    reading = {
+        "timestamp": time.time(),
+        "temperature": 23.4,
+        "humidity": 55.1,
+        "soil_moisture": 512,
+        "device_id": "farm_sensor_01"
+    }
+    device_id = reading["device_id"]
+
+    # What the secure emitter and the web server do per message in each mode
+    def cbc_send():
+        return json.dumps(encrypt_message(sign_message(reading, device_id))).encode('utf-8')
+
+    def cbc_receive(body):
+        message = decrypt_message(json.loads(body))
+        return verify_signature(message) and message
+
+    def gcm_hmac_send():
+        return encrypt_frame(sign_message(reading, device_id))
+
+    def gcm_hmac_receive(body):
+        message = decrypt_frame(body)
+        return verify_signature(message) and message
+
+    # GCM alone authenticates the frame, but only as coming from a holder of the shared key
+    def gcm_send():
+        return encrypt_frame(reading)
+
+    def gcm_receive(body):
+        return decrypt_frame(body)
+
+    # Signing only: embedded signature against a detached one over the body bytes
+    def signed_send():
+        return json.dumps(sign_message(reading, device_id)).encode('utf-8')
+
+    def signed_receive(body):
+        message = json.loads(body)
+        return verify_signature(message) and message
+
+    def detached_send():
+        body = json.dumps(dict(reading, timestamp=time.time())).encode('utf-8')
+        return body, signature_headers(body, device_id)
+
+    def detached_receive(sent):
+        body, headers = sent
+        return verify_headers(body, headers) and json.loads(body)
+
+    modes_to_run = [
+        ("signed", signed_send, signed_receive),
+        ("detached", detached_send, detached_receive),
+        ("cbc+hmac", cbc_send, cbc_receive),
+        ("gcm+hmac", gcm_hmac_send, gcm_hmac_receive),
+        ("gcm", gcm_send, gcm_receive)
+    ]
+    print(f"{'mode':<10} {'bytes':>6} {'send msg/s':>11} {'receive msg/s':>14}")
+    for name, send, receive in modes_to_run:
+        body = send()
+        start = time.perf_counter()
+        for _ in range(count):
+            send()
+        send_rate = count / (time.perf_counter() - start)
+        start = time.perf_counter()
+        for _ in range(count):
+            receive(body)
+        receive_rate = count / (time.perf_counter() - start)
+        size = len(body[0]) if isinstance(body, tuple) else len(body)
+        print(f"{name:<10} {size:>6} {send_rate:>11,.0f} {receive_rate:>14,.0f}")
+
+if __name__ == "__main__":
+    benchmark()
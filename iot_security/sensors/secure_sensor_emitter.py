@@ -8,7 +8,11 @@ import os
 # Add parent directory to path to import utils
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils import get_rabbitmq_connection
-from security_utils import sign_message, encrypt_message
+from security_utils import sign_message, signature_headers, encrypt_message, encrypt_frame, CONTENT_TYPE_GCM
+from confirm_tracker import ConfirmTracker
+from wire_format import encode_binary, content_type_for
+from threshold_engine import ThresholdEngine
+from sharding import device_routing_key
 import pika
 
 # Device ID for this sensor
@@ -30,6 +34,36 @@ channel.exchange_declare(exchange='sensors.secure.direct', exchange_type='direct
 channel.exchange_declare(exchange='sensors.secure.topic', exchange_type='topic')
 channel.exchange_declare(exchange='sensors.secure.headers', exchange_type='headers')
 
+# Publisher confirms, tracked asynchronously so publishing does not wait per message
+# (PUBLISH_CONFIRM_WINDOW=0 disables them)
+CONFIRM_WINDOW = int(os.getenv('PUBLISH_CONFIRM_WINDOW', 1000))
+confirms = ConfirmTracker(connection, channel, window=CONFIRM_WINDOW) if CONFIRM_WINDOW > 0 else None
+
+# Encoding of the regular (unsigned) readings: json or binary (see wire_format.py).
+# Signed and encrypted messages stay JSON since the signature covers the JSON form.
+WIRE_FORMAT = os.getenv('SENSOR_WIRE_FORMAT', 'json')
+regular_properties = pika.BasicProperties(content_type=content_type_for(WIRE_FORMAT))
+json_properties = pika.BasicProperties(content_type=content_type_for('json'))
+
+# Encryption of the high-security messages: cbc (JSON envelope, the default)
+# or gcm (binary AES-GCM frame, see security_utils.py)
+SECURE_ENCRYPTION = os.getenv('SECURE_ENCRYPTION', 'cbc')
+
+# Signing of the secure messages: detached (HMAC of the exact body bytes in
+# AMQP headers, the default) or embedded (a "signature" field in the JSON).
+# CBC envelopes always carry an embedded signature inside.
+SECURE_SIGNING = os.getenv('SECURE_SIGNING', 'detached')
+
+def publish(exchange, routing_key, body, properties=json_properties):
+    """Publish a message, through the confirm tracker if confirms are enabled."""
+    if confirms is not None:
+        confirms.publish(exchange, routing_key, body, properties)
+    else:
+        channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body, properties=properties)
+
+# Decides which readings also go to the alerts queue (rules from threshold_rules.json)
+thresholds = ThresholdEngine()
+
 print("Starting secure IoT sensor emitter... Press CTRL+C to exit")
 
 def generate_sensor_data():
@@ -48,71 +82,103 @@ def generate_sensor_data():
         "device_id": DEVICE_ID
     }
     
-    return data, temperature > 35 or humidity < 30 or soil_moisture < 250
+    # The first reading back in range also counts, so the alert handler sees the alert clear
+    return data, thresholds.needs_alert_route([data])[0]
 
 try:
     while True:
         # Generate random sensor data
         payload, is_alert = generate_sensor_data()
         
-        # Create regular JSON message (insecure)
-        regular_message = json.dumps(payload)
+        # Create regular message (insecure)
+        if WIRE_FORMAT == 'binary':
+            regular_message = encode_binary(payload)
+        else:
+            regular_message = json.dumps(payload)
         
-        # Create signed message (secure)
-        signed_payload = sign_message(payload, DEVICE_ID)
-        signed_message = json.dumps(signed_payload)
+        # Create signed message (secure); the payload already has device_id and timestamp
+        if SECURE_SIGNING == 'detached':
+            signed_message = json.dumps(payload).encode('utf-8')
+            headers = signature_headers(signed_message, DEVICE_ID)
+            signed_properties = pika.BasicProperties(content_type=content_type_for('json'), headers=headers)
+        else:
+            signed_payload = sign_message(payload, DEVICE_ID)
+            signed_message = json.dumps(signed_payload)
+            signed_properties = json_properties
         
         # Create encrypted+signed message (most secure)
-        encrypted_payload = encrypt_message(signed_payload)
-        encrypted_message = json.dumps(encrypted_payload)
+        if SECURE_ENCRYPTION == 'gcm':
+            # The frame holds the signed bytes; a detached signature stays in the headers
+            encrypted_message = encrypt_frame(signed_message if SECURE_SIGNING == 'detached' else signed_payload)
+            encrypted_properties = pika.BasicProperties(content_type=CONTENT_TYPE_GCM, headers=signed_properties.headers)
+        else:
+            # CBC envelopes carry an embedded signature
+            if SECURE_SIGNING == 'detached':
+                signed_payload = sign_message(payload, DEVICE_ID)
+            encrypted_message = json.dumps(encrypt_message(signed_payload))
+            encrypted_properties = json_properties
         
         # ---------- INSECURE PUBLISHING ----------
-        # Publish to regular fanout exchange (broadcasts to all consumers)
-        channel.basic_publish(
+        # Publish to regular fanout exchange (broadcasts to all consumers;
+        # the routing key only picks the device's shard queue, see sharding.py)
+        publish(
             exchange='sensors.fanout',
-            routing_key='',
-            body=regular_message
+            routing_key=device_routing_key(DEVICE_ID),
+            body=regular_message,
+            properties=regular_properties
         )
         
         # Regular direct exchange for alerts
         if is_alert:
-            channel.basic_publish(
+            publish(
                 exchange='sensors.direct',
                 routing_key='alerts',
-                body=regular_message
+                body=regular_message,
+                properties=regular_properties
             )
         
         # ---------- SECURE PUBLISHING ----------
         # Publish signed data to secure fanout exchange
-        channel.basic_publish(
+        publish(
             exchange='sensors.secure.fanout',
             routing_key='',
-            body=signed_message
+            body=signed_message,
+            properties=signed_properties
         )
         
         # Secure direct exchange for alerts
         if is_alert:
-            channel.basic_publish(
+            publish(
                 exchange='sensors.secure.direct',
                 routing_key='alerts',
-                body=signed_message
+                body=signed_message,
+                properties=signed_properties
             )
         
         # Secure topic exchange with encrypted + signed message for high security
-        channel.basic_publish(
+        publish(
             exchange='sensors.secure.topic',
             routing_key='secure.sensor.all',
-            body=encrypted_message
+            body=encrypted_message,
+            properties=encrypted_properties
         )
         
+        # Send everything queued for this reading
+        if confirms is not None:
+            confirms.flush()
+        
         # Print what was sent
-        print(f"Sent regular data: {regular_message}")
-        print(f"Sent secure data with signature")
-        print(f"Sent encrypted data to high-security consumers")
+        print(f"Sent regular data: {payload}")
+        print("Sent secure data with signature")
+        print("Sent encrypted data to high-security consumers")
         
         # Wait before sending the next reading
-        time.sleep(random.uniform(2, 5))
+        # (connection.sleep keeps handling confirms and heartbeats meanwhile)
+        connection.sleep(random.uniform(2, 5))
 
 except KeyboardInterrupt:
     print("Stopping secure sensor emitter")
+    if confirms is not None:
+        confirms.wait_for_confirms(timeout=5)
+        print(f"Publisher confirms: {confirms.stats}")
     connection.close() 
\ No newline at end of file
@@ -0,0 +1,141 @@
+"""
+Sharded work queues for running several consumer processes side by side.
+
+By default every consumer declares its own exclusive queue, so a second
+data_logger receives (and writes) every reading again. With CONSUMER_SHARDS
+set to K > 0, consumers use named durable queues instead:
+
+- Publishers send each reading to sensors.fanout with a routing key derived
+  from its device_id: one of SHARD_SLOTS slots, crc32(device_id) % 256.
+  Fanout exchanges ignore routing keys, so nothing else changes for
+  existing consumers.
+- sensors.fanout is bound to the direct exchange sensors.sharded, which
+  routes on that key. Shard queue k of a role (e.g. data_logger.shard2of4)
+  is bound to the slots s with s % K == k.
+- Worker i of N (run_consumers.py --worker i/N) consumes the shards k with
+  k % N == i. Every device always lands in the same shard queue, which has
+  a single active consumer, so its readings stay in order on one worker.
+- Roles whose work is not split by device (alert_handler, topic_analyzer)
+  share one named queue with a single active consumer: the other workers
+  are hot standbys that take over if it stops.
+
+Publishers do not need to know K, so the shard count can be changed on the
+consumer side alone.
+
+Publishers that still send to sensors.fanout with an empty routing key (the
+student emitter in iot_full_stack_app_incomplete, or any older script) are
+not lost: shard 0 of each role is also bound to the empty key
+(UNKEYED_ROUTING_KEY). All of their readings land in that one shard, so they
+are not spread over the workers; publish with device_routing_key() to get
+that. The history API reads shard 0's store as well as the device's own, so
+these readings still show up in /api/history. The queues of the old count keep receiving readings
+until they are deleted, e.g. with rabbitmqctl delete_queue.
+"""
+
+import os
+import zlib
+from functools import lru_cache
+from dotenv import load_dotenv
+
+# Number of shard queues per role, 0 for the default exclusive queues
+load_dotenv()
+CONSUMER_SHARDS = int(os.getenv('CONSUMER_SHARDS', 0))
+
+# Routing key space; shards own an equal share of these slots
+SHARD_SLOTS = 256
+
+SHARDED_EXCHANGE = 'sensors.sharded'
+
+# Routing key of publishers that do not shard; routed to shard 0
+UNKEYED_ROUTING_KEY = ''
+
+# Only one consumer of a queue gets messages at a time, which keeps them in order
+SINGLE_ACTIVE_CONSUMER = {'x-single-active-consumer': True}
+
+
+@lru_cache(maxsize=65536)
+def device_routing_key(device_id):
+    """Routing key for a device's readings on sensors.fanout (its slot number)."""
+    return str(zlib.crc32(str(device_id).encode()) % SHARD_SLOTS)
+
+
+def shard_for(device_id, shards=CONSUMER_SHARDS):
+    """Shard that receives a device's readings."""
+    return int(device_routing_key(device_id)) % shards
+
+
+def shard_path(path, shard):
+    """Per-shard variant of a data file or directory, e.g. data/timeseries.shard3."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{shard}{ext}"
+
+
+def parse_worker(value):
+    """
+    Parse a worker spec like "0/3".
+
+    Returns:
+        tuple: (worker index, number of workers)
+
+    Raises:
+        ValueError: If the spec is malformed
+    """
+    try:
+        worker, workers = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise ValueError(f"Worker must look like i/N, got {value!r}")
+    if workers < 1 or not 0 <= worker < workers:
+        raise ValueError(f"Worker index must be between 0 and {workers - 1}, got {value!r}")
+    return worker, workers
+
+
+def assigned_shards(worker=0, workers=1, shards=CONSUMER_SHARDS):
+    """
+    Shards that worker `worker` of `workers` consumes.
+
+    Returns:
+        list: Shard numbers, or None when sharding is off
+    """
+    if shards <= 0:
+        return None
+    return [shard for shard in range(shards) if shard % workers == worker]
+
+
+def make_sharded(consumer, role, shard, shards=CONSUMER_SHARDS):
+    """
+    Point a fanout consumer at shard `shard` of its role's work queues.
+
+    Args:
+        consumer (Consumer): Consumer to configure (see async_runtime.py)
+        role (str): Queue name prefix, e.g. 'data_logger'
+        shard (int): Shard number, 0 <= shard < shards
+        shards (int): Number of shards
+
+    Returns:
+        Consumer: The same consumer
+    """
+    consumer.name = f"{consumer.name}[{shard}/{shards}]"
+    consumer.queue = f"{role}.shard{shard}of{shards}"
+    consumer.durable = True
+    consumer.queue_arguments = SINGLE_ACTIVE_CONSUMER
+    consumer.exchange_bindings = [(SHARDED_EXCHANGE, 'sensors.fanout', 'fanout')]
+    consumer.bindings = [(SHARDED_EXCHANGE, 'direct', str(slot))
+                         for slot in range(shard, SHARD_SLOTS, shards)]
+    if shard == 0:
+        # Readings published without a device routing key would otherwise be dropped
+        consumer.bindings.append((SHARDED_EXCHANGE, 'direct', UNKEYED_ROUTING_KEY))
+    return consumer
+
+
+def make_shared(consumer, role):
+    """
+    Give a consumer a named durable queue shared by all workers, with one
+    of them active at a time.
+
+    Returns:
+        Consumer: The same consumer
+    """
+    consumer.queue = role
+    consumer.durable = True
+    consumer.queue_arguments = SINGLE_ACTIVE_CONSUMER
+    return consumer
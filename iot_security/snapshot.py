@@ -0,0 +1,123 @@
+"""
+Copy-on-write snapshots of the latest sensor data for the web data servers.
+
+The RabbitMQ consumer thread never changes a published snapshot. It builds
+a new dict, encodes it to JSON once, and swaps the reference. Flask request
+threads read the current reference and send its bytes as-is, so they never
+see a half-updated reading and never serialize anything themselves.
+"""
+
+import hashlib
+import json
+import threading
+from types import MappingProxyType
+
+from flask import Response
+
+
+class Snapshot:
+    """An immutable reading with its JSON encoding and ETag."""
+
+    __slots__ = ("data", "body", "etag")
+
+    def __init__(self, data):
+        """
+        Args:
+            data (dict): The values to publish; the dict must not be changed afterwards
+        """
+        self.data = MappingProxyType(data)
+        self.body = json.dumps(data).encode("utf-8")
+        self.etag = hashlib.blake2b(self.body, digest_size=8).hexdigest()
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+
+class SnapshotHolder:
+    """Holds the current Snapshot and replaces it atomically on every update."""
+
+    def __init__(self, initial):
+        """
+        Args:
+            initial (dict): Values of the first snapshot
+        """
+        self._current = Snapshot(dict(initial))
+        # Serializes writers; readers never take the lock
+        self._write_lock = threading.Lock()
+
+    def get(self):
+        """Return the current snapshot (a single reference read)."""
+        return self._current
+
+    def update(self, changes):
+        """
+        Publish a new snapshot with some values replaced.
+
+        Args:
+            changes (dict): Keys to add or replace. Nested values must be new
+                objects, not modified copies of the current ones.
+
+        Returns:
+            Snapshot: The snapshot that was published
+        """
+        with self._write_lock:
+            data = dict(self._current.data)
+            data.update(changes)
+            snapshot = Snapshot(data)
+            self._current = snapshot
+        return snapshot
+
+    def modify(self, make_changes):
+        """
+        Publish a new snapshot whose changes depend on the current values.
+
+        Args:
+            make_changes (callable): Receives the current snapshot and returns
+                the changes dict. Runs under the write lock, so no update is lost.
+
+        Returns:
+            Snapshot: The snapshot that was published
+        """
+        with self._write_lock:
+            data = dict(self._current.data)
+            data.update(make_changes(self._current))
+            snapshot = Snapshot(data)
+            self._current = snapshot
+        return snapshot
+
+
+def snapshot_response(snapshot, request):
+    """
+    Build a Flask response for a snapshot, honouring If-None-Match.
+
+    Args:
+        snapshot (Snapshot): The snapshot to send
+        request (flask.Request): The incoming request
+
+    Returns:
+        flask.Response: 304 if the client already has this ETag, else the JSON bytes
+    """
+    return json_response(snapshot.body, snapshot.etag, request)
+
+
+def json_response(body, etag, request):
+    """
+    Build a Flask response for pre-encoded JSON, honouring If-None-Match.
+
+    Args:
+        body (bytes): Encoded JSON
+        etag (str): Entity tag of the body
+        request (flask.Request): The incoming request
+
+    Returns:
+        flask.Response: 304 if the client already has this ETag, else the JSON bytes
+    """
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    return response
@@ -0,0 +1,63 @@
+"""
+Tests for replay_cache.py.
+
+Run from iot_security:
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+# Add parent directory to path to import the app's modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from replay_cache import ReplayCache, FRESH, REPLAYED, EXPIRED, FUTURE
+
+NOW = 1_700_000_000.0
+
+
+class ReplayCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ReplayCache(max_age=60, bucket_seconds=5, max_skew=5)
+
+    def test_second_sighting_is_a_replay(self):
+        self.assertEqual(self.cache.check("sig", NOW, NOW), FRESH)
+        self.assertEqual(self.cache.check("sig", NOW, NOW + 30), REPLAYED)
+        self.assertEqual(self.cache.replays, 1)
+
+    def test_same_key_with_other_timestamp_is_fresh(self):
+        # Keys are remembered in the bucket of their own timestamp
+        self.assertEqual(self.cache.check("sig", NOW, NOW), FRESH)
+        self.assertEqual(self.cache.check("sig", NOW + 20, NOW + 20), FRESH)
+
+    def test_too_old_or_missing_timestamp_is_expired(self):
+        self.assertEqual(self.cache.check("sig", NOW - 61, NOW), EXPIRED)
+        self.assertEqual(self.cache.check("sig", None, NOW), EXPIRED)
+        self.assertEqual(self.cache.check("sig", "yesterday", NOW), EXPIRED)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_boundary_of_the_window(self):
+        self.assertEqual(self.cache.check("a", NOW - 60, NOW), FRESH)
+        self.assertEqual(self.cache.check("b", NOW + 5, NOW), FRESH)
+        self.assertEqual(self.cache.check("c", NOW + 5.01, NOW), FUTURE)
+
+    def test_replay_after_the_window_is_rejected_as_expired(self):
+        self.cache.check("sig", NOW, NOW)
+        self.assertEqual(self.cache.check("sig", NOW, NOW + 61), EXPIRED)
+
+    def test_expired_buckets_are_dropped(self):
+        for i in range(100):
+            self.cache.check(f"sig{i}", NOW + i, NOW + i)
+        # Only the last max_age + bucket_seconds seconds are kept
+        self.assertLessEqual(len(self.cache), 65)
+        self.assertGreaterEqual(len(self.cache), 60)
+
+    def test_long_idle_period_empties_the_cache(self):
+        self.cache.check("sig", NOW, NOW)
+        self.cache.check("new", NOW + 10 ** 6, NOW + 10 ** 6)
+        self.assertEqual(len(self.cache), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+"""
+Tests for threshold_engine.py.
+
+Run from iot_security:
+    python -m unittest discover tests
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# Add parent directory to path to import the app's modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from threshold_engine import ThresholdEngine, resolve_thresholds, validate_rules
+
+RULES = {
+    "defaults": {
+        "temperature": {"min": 0, "max": 35, "unit": "°C", "hysteresis": 0.5},
+        "humidity": {"min": 30, "max": 100, "unit": "%", "hysteresis": 1.0}
+    },
+    "zones": {
+        "greenhouse": {"thresholds": {"temperature": {"max": 40}}}
+    },
+    "devices": {
+        "greenhouse_sensor_01": {"zone": "greenhouse"},
+        "greenhouse_sensor_02": {"zone": "greenhouse", "thresholds": {"temperature": {"max": 45}}}
+    }
+}
+
+
+def reading(temperature, humidity=50, device_id="farm_sensor_01"):
+    return {"temperature": temperature, "humidity": humidity, "device_id": device_id}
+
+
+class ResolveThresholdsTest(unittest.TestCase):
+
+    def test_layers(self):
+        self.assertEqual(resolve_thresholds(RULES)["temperature"]["max"], 35)
+        self.assertEqual(resolve_thresholds(RULES, "greenhouse_sensor_01")["temperature"]["max"], 40)
+        self.assertEqual(resolve_thresholds(RULES, "greenhouse_sensor_02")["temperature"]["max"], 45)
+        # Only the overridden key changes
+        self.assertEqual(resolve_thresholds(RULES, "greenhouse_sensor_02")["temperature"]["min"], 0)
+
+    def test_unknown_zone_is_invalid(self):
+        rules = dict(RULES, devices={"x": {"zone": "nowhere"}})
+        with self.assertRaises(ValueError):
+            validate_rules(rules)
+
+
+class ThresholdEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = ThresholdEngine(rules=RULES)
+
+    def test_alert_strings(self):
+        self.assertEqual(self.engine.check_batch([reading(20)]), [[]])
+        self.assertEqual(self.engine.check_batch([reading(36.2, humidity=20)]),
+                         [["HIGH TEMPERATURE: 36.2°C", "LOW HUMIDITY: 20%"]])
+
+    def test_per_device_thresholds(self):
+        alerts = self.engine.check_batch([reading(38), reading(38, device_id="greenhouse_sensor_01")])
+        self.assertEqual(alerts, [["HIGH TEMPERATURE: 38°C"], []])
+
+    def test_hysteresis_holds_until_back_by_the_band(self):
+        engine = self.engine
+        self.assertEqual(engine.alerting([reading(35.1)]), [True])
+        # Back under the limit but inside the band: still alerting
+        self.assertEqual(engine.alerting([reading(34.8)]), [True])
+        self.assertEqual(engine.alerting([reading(34.4)]), [False])
+        # Inside the band without having crossed the limit: not alerting
+        self.assertEqual(engine.alerting([reading(34.8)]), [False])
+
+    def test_hysteresis_within_one_batch(self):
+        self.assertEqual(self.engine.alerting([reading(36), reading(34.8), reading(34)]), [True, True, False])
+
+    def test_hysteresis_is_per_device(self):
+        self.engine.alerting([reading(36)])
+        self.assertEqual(self.engine.alerting([reading(34.8, device_id="other")]), [False])
+
+    def test_missing_value_keeps_the_state(self):
+        self.engine.alerting([reading(36)])
+        self.assertEqual(self.engine.alerting([reading(None)]), [True])
+        # No value, so no alert string for it
+        self.assertEqual(self.engine.check_batch([reading(None)]), [[]])
+
+    def test_first_reading_back_in_range_is_cleared(self):
+        result = self.engine.evaluate_readings([reading(36), reading(34.8), reading(34), reading(33)])
+        self.assertEqual(result.cleared.tolist(), [False, False, True, False])
+
+    def test_needs_alert_route(self):
+        self.assertEqual(self.engine.needs_alert_route([reading(20), reading(36), reading(34)]),
+                         [False, True, True])
+        self.assertEqual(self.engine.needs_alert_route([reading(34)]), [False])
+        self.assertEqual(self.engine.needs_alert_route([]), [])
+
+    def test_stateless_engine_judges_each_reading(self):
+        engine = ThresholdEngine(rules=RULES, stateful=False)
+        self.assertEqual(engine.alerting([reading(36), reading(34.8)]), [True, False])
+
+
+class RulesFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.rules_file = os.path.join(self.path, "rules.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write_rules(self, rules, mtime):
+        with open(self.rules_file, "w") as f:
+            f.write(rules if isinstance(rules, str) else json.dumps(rules))
+        os.utime(self.rules_file, (mtime, mtime))
+
+    def test_reload_and_broken_file(self):
+        self.write_rules(RULES, 1000)
+        engine = ThresholdEngine(path=self.rules_file, reload_interval=0)
+        self.assertEqual(engine.check_batch([reading(36)]), [["HIGH TEMPERATURE: 36°C"]])
+
+        self.write_rules(dict(RULES, defaults=dict(RULES["defaults"], temperature={"min": 0, "max": 50})), 2000)
+        self.assertTrue(engine.reload_if_changed())
+        self.assertEqual(engine.check_batch([reading(36)]), [[]])
+
+        # A broken file keeps the previous rules
+        self.write_rules("{not json", 3000)
+        self.assertFalse(engine.reload_if_changed())
+        self.assertEqual(engine.rules.thresholds_for()["temperature"]["max"], 50)
+
+    def test_missing_file_uses_builtin_defaults(self):
+        engine = ThresholdEngine(path=os.path.join(self.path, "missing.json"))
+        self.assertEqual(engine.rules.thresholds_for()["temperature"]["max"], 35)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+"""
+Tests for timeseries_index.py.
+
+Run from iot_security:
+    python -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# Add parent directory to path to import the app's modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from timeseries_index import (DeviceBlocks, SensorIndex, INDEX_DTYPE, INDEX_FILE,
+                              append_entries, block_entries)
+
+import numpy as np
+
+
+def entries(ranges):
+    """Index entries of one device from (min_ts, max_ts) pairs."""
+    result = np.zeros(len(ranges), dtype=INDEX_DTYPE)
+    result["min_ts"] = [low for low, _ in ranges]
+    result["max_ts"] = [high for _, high in ranges]
+    result["start_row"] = np.arange(len(ranges))
+    return result
+
+
+class BlockEntriesTest(unittest.TestCase):
+
+    def test_one_entry_per_device(self):
+        timestamps = np.array([1.0, 2.0, 3.0, 4.0, 5.0])
+        devices = np.array([0, 1, 0, 1, 0], dtype="<u2")
+        result = block_entries(3, 100, timestamps, devices)
+        self.assertEqual(result["device"].tolist(), [0, 1])
+        self.assertEqual(result["segment"].tolist(), [3, 3])
+        self.assertEqual(result["start_row"].tolist(), [100, 101])
+        self.assertEqual(result["end_row"].tolist(), [105, 104])
+        self.assertEqual(result["min_ts"].tolist(), [1.0, 2.0])
+        self.assertEqual(result["max_ts"].tolist(), [5.0, 4.0])
+
+
+class DeviceBlocksTest(unittest.TestCase):
+
+    def test_find_overlapping_blocks(self):
+        blocks = DeviceBlocks(entries([(0, 9), (10, 19), (20, 29), (30, 39)]))
+        self.assertEqual(blocks.find(15, 25)["start_row"].tolist(), [1, 2])
+        self.assertEqual(blocks.find(start=30)["start_row"].tolist(), [3])
+        self.assertEqual(blocks.find(end=9)["start_row"].tolist(), [0])
+        self.assertEqual(len(blocks.find(40, 50)), 0)
+
+    def test_out_of_order_blocks_are_still_found(self):
+        blocks = DeviceBlocks(entries([(10, 19), (0, 5), (20, 29)]))
+        self.assertFalse(blocks.ordered)
+        self.assertEqual(blocks.find(0, 3)["start_row"].tolist(), [1])
+
+    def test_extend_keeps_running_maximum_and_order(self):
+        blocks = DeviceBlocks(entries([(0, 50)]))
+        blocks.extend(entries([(10, 20)]))
+        self.assertEqual(blocks.max_ts_prefix.tolist(), [50, 50])
+        self.assertTrue(blocks.ordered)
+        blocks.extend(entries([(5, 6)]))
+        self.assertFalse(blocks.ordered)
+
+    def test_extend_grows_past_capacity(self):
+        blocks = DeviceBlocks()
+        for i in range(100):
+            blocks.extend(entries([(i, i + 0.5)]))
+        self.assertEqual(len(blocks.entries), 100)
+        self.assertEqual(blocks.find(49, 50.2)["min_ts"].tolist(), [49, 50])
+
+
+class SensorIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.index_file = open(os.path.join(self.path, INDEX_FILE), "ab")
+
+    def tearDown(self):
+        self.index_file.close()
+        shutil.rmtree(self.path)
+
+    def write_block(self, first_row, timestamps, devices):
+        append_entries(self.index_file, block_entries(
+            0, first_row, np.array(timestamps, dtype=np.float64), np.array(devices, dtype="<u2")))
+
+    def test_refresh_appends_per_device(self):
+        index = SensorIndex(self.path)
+        self.write_block(0, [1, 2, 3], [0, 1, 0])
+        self.assertEqual(len(index), 2)
+        self.assertEqual(len(index.find(0)), 1)
+
+        self.write_block(3, [4, 5], [1, 1])
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.find(1)["start_row"].tolist(), [1, 3])
+        # Device 0 saw no new entries and keeps its blocks
+        self.assertEqual(len(index.find(0)), 1)
+
+    def test_unknown_device_and_missing_file(self):
+        index = SensorIndex(os.path.join(self.path, "missing"))
+        self.assertEqual(len(index), 0)
+        self.assertEqual(len(index.find(7)), 0)
+
+    def test_partial_trailing_entry_is_ignored(self):
+        self.write_block(0, [1], [0])
+        self.index_file.write(b"\x00" * 5)
+        self.index_file.flush()
+        self.assertEqual(len(SensorIndex(self.path)), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+"""
+Tests for window_stats.py.
+
+Run from iot_security:
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+# Add parent directory to path to import the app's modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from window_stats import SlidingWindow, TumblingWindow, format_span, summarize
+
+import numpy as np
+
+
+class SummarizeTest(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertEqual(summarize(np.empty(0)),
+                         {"count": 0, "mean": None, "min": None, "max": None, "p95": None})
+
+    def test_values(self):
+        summary = summarize(np.arange(1, 101, dtype=np.float64))
+        self.assertEqual(summary["count"], 100)
+        self.assertEqual(summary["mean"], 50.5)
+        self.assertEqual(summary["min"], 1)
+        self.assertEqual(summary["max"], 100)
+        self.assertAlmostEqual(summary["p95"], 95.05)
+
+    def test_format_span(self):
+        self.assertEqual([format_span(s) for s in (30, 60, 300, 3600, 90)], ["30s", "1m", "5m", "1h", "90s"])
+
+
+class SlidingWindowTest(unittest.TestCase):
+
+    def test_keeps_only_the_last_span_seconds(self):
+        window = SlidingWindow(span=10, capacity=16)
+        for t in range(20):
+            window.add(t, t)
+        # (9, 19]: samples at 10..19
+        self.assertEqual(window.samples().tolist(), list(range(10, 20)))
+        summary = window.summary(now=25)
+        self.assertEqual(summary["count"], 4)
+        self.assertEqual((summary["start"], summary["end"]), (15, 25))
+
+    def test_full_buffer_drops_the_oldest(self):
+        window = SlidingWindow(span=100, capacity=4)
+        for t in range(6):
+            window.add(t, t)
+        self.assertEqual(window.samples().tolist(), [2, 3, 4, 5])
+        self.assertEqual(window.dropped, 2)
+
+    def test_samples_across_the_ring_boundary(self):
+        window = SlidingWindow(span=3, capacity=4)
+        for t in range(7):
+            window.add(t, t * 10)
+        self.assertEqual(window.samples().tolist(), [40, 50, 60])
+
+    def test_empty_after_everything_expired(self):
+        window = SlidingWindow(span=5)
+        window.add(0, 1)
+        self.assertEqual(window.summary(now=100)["count"], 0)
+
+
+class TumblingWindowTest(unittest.TestCase):
+
+    def test_sample_in_the_next_window_closes_the_current_one(self):
+        window = TumblingWindow(span=60)
+        self.assertIsNone(window.add(0, 1))
+        self.assertIsNone(window.add(59, 3))
+        finished = window.add(60, 10)
+        self.assertEqual(finished["count"], 2)
+        self.assertEqual(finished["mean"], 2)
+        self.assertEqual((finished["start"], finished["end"]), (0, 60))
+        self.assertEqual(len(window), 1)
+
+    def test_close_if_due(self):
+        window = TumblingWindow(span=60)
+        window.add(10, 5)
+        self.assertIsNone(window.close_if_due(59))
+        finished = window.close_if_due(60)
+        self.assertEqual(finished["count"], 1)
+        self.assertIsNone(window.close_if_due(200))
+
+    def test_late_sample_for_a_closed_window_is_dropped(self):
+        window = TumblingWindow(span=60)
+        window.add(10, 5)
+        window.close_if_due(61)
+        self.assertIsNone(window.add(30, 7))
+        self.assertEqual(window.dropped, 1)
+        self.assertEqual(len(window), 0)
+
+    def test_over_capacity_keeps_count_of_drops(self):
+        window = TumblingWindow(span=60, capacity=3)
+        for i in range(5):
+            window.add(i, i)
+        self.assertEqual(len(window), 3)
+        self.assertEqual(window.dropped, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+"""
+Tests for wire_format.py.
+
+Run from iot_security:
+    python -m unittest discover tests
+"""
+
+import json
+import os
+import sys
+import unittest
+
+# Add parent directory to path to import the app's modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from wire_format import (CONTENT_TYPE_BINARY, CONTENT_TYPE_BINARY_BATCH, CONTENT_TYPE_JSON_BATCH,
+                         binary_reading_prefix, binary_reading_suffix, decode_binary, decode_reading,
+                         encode_binary, encode_binary_envelope, iter_readings)
+
+READING = {
+    "timestamp": 1700000000.25,
+    "temperature": 23.45,
+    "humidity": 55.1,
+    "soil_moisture": 512,
+    "device_id": "farm_sensor_01"
+}
+
+
+class Properties:
+    def __init__(self, content_type=None):
+        self.content_type = content_type
+
+
+class BinaryFormatTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        self.assertEqual(decode_binary(encode_binary(READING)), READING)
+
+    def test_missing_fields_stay_missing(self):
+        self.assertEqual(decode_binary(encode_binary({"temperature": -5.5})), {"temperature": -5.5})
+
+    def test_prefix_and_suffix_match_encode_binary(self):
+        suffix = binary_reading_suffix(READING["temperature"], READING["humidity"],
+                                       READING["soil_moisture"], READING["device_id"])
+        self.assertEqual(binary_reading_prefix(READING["timestamp"]) + suffix, encode_binary(READING))
+
+    def test_out_of_range_value_is_rejected(self):
+        with self.assertRaises(ValueError):
+            encode_binary({"soil_moisture": 1 << 40})
+        with self.assertRaises(ValueError):
+            encode_binary({"device_id": "x" * 256})
+
+    def test_truncated_body_is_rejected(self):
+        body = encode_binary(READING)
+        with self.assertRaises(ValueError):
+            decode_binary(body[:10])
+        with self.assertRaises(ValueError):
+            decode_binary(body[:-1])
+
+    def test_unknown_version_is_rejected(self):
+        body = bytearray(encode_binary(READING))
+        body[0] = 99
+        with self.assertRaises(ValueError):
+            decode_binary(bytes(body))
+
+
+class IterReadingsTest(unittest.TestCase):
+
+    def test_json_without_content_type(self):
+        self.assertEqual(list(iter_readings(json.dumps(READING).encode())), [READING])
+
+    def test_single_binary_reading(self):
+        body = encode_binary(READING)
+        self.assertEqual(list(iter_readings(body, Properties(CONTENT_TYPE_BINARY))), [READING])
+        self.assertEqual(decode_reading(body, Properties(CONTENT_TYPE_BINARY)), READING)
+
+    def test_binary_envelope(self):
+        readings = [dict(READING, soil_moisture=i) for i in range(3)]
+        body = encode_binary_envelope(readings)
+        self.assertEqual(list(iter_readings(body, Properties(CONTENT_TYPE_BINARY_BATCH))), readings)
+
+    def test_truncated_binary_envelope_is_rejected(self):
+        body = encode_binary_envelope([READING, READING])
+        with self.assertRaises(ValueError):
+            list(iter_readings(body[:-20], Properties(CONTENT_TYPE_BINARY_BATCH)))
+
+    def test_json_envelope(self):
+        body = json.dumps({"readings": [READING, READING]}).encode()
+        self.assertEqual(list(iter_readings(body, Properties(CONTENT_TYPE_JSON_BATCH))), [READING, READING])
+
+    def test_json_envelope_without_readings_is_rejected(self):
+        with self.assertRaises(ValueError):
+            list(iter_readings(b'{"items": []}', Properties(CONTENT_TYPE_JSON_BATCH)))
+
+    def test_bad_json_is_a_value_error(self):
+        with self.assertRaises(ValueError):
+            list(iter_readings(b"not json"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,458 @@
+"""
+Threshold engine shared by the alert handler, the web data servers and the
+sensor emitters.
+
+Thresholds live in one rules file (threshold_rules.json, or the path in
+THRESHOLD_RULES_FILE) with defaults, per-zone and per-device overrides and a
+hysteresis band per field:
+
+    {
+        "defaults": {"temperature": {"min": 0, "max": 35, "unit": "°C", "hysteresis": 0.5}, ...},
+        "zones": {"greenhouse": {"thresholds": {"temperature": {"max": 40}}}},
+        "devices": {"greenhouse_sensor_01": {"zone": "greenhouse",
+                                             "thresholds": {"humidity": {"min": 50}}}}
+    }
+
+A device's thresholds are its zone's on top of the defaults, then its own on
+top of those. The rules are compiled into NumPy min/max/hysteresis tables
+with one row per distinct set of thresholds and a dict from device_id to row,
+so checking a batch of readings is a dict lookup per reading plus a few
+vectorized comparisons. Alert strings are only built for the readings that
+actually alert.
+
+Hysteresis: a field starts alerting once it crosses its min or max, and only
+clears once it is back inside the range by more than its hysteresis, so a
+value hovering at the limit does not flap between alert and normal.
+
+The rules file is checked for changes every THRESHOLD_RULES_RELOAD seconds
+(default 2) and reloaded in place; a broken file is reported and the
+previous rules are kept.
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+RULES_FILE = os.getenv('THRESHOLD_RULES_FILE',
+                       os.path.join(os.path.dirname(os.path.abspath(__file__)), 'threshold_rules.json'))
+RELOAD_INTERVAL = float(os.getenv('THRESHOLD_RULES_RELOAD', 2))
+
+# Built-in defaults, used when there is no rules file
+THRESHOLDS = {
+    "temperature": {"min": 0, "max": 35, "unit": "°C"},
+    "humidity": {"min": 30, "max": 100, "unit": "%"},
+    "soil_moisture": {"min": 250, "max": 800, "unit": "units"}
+}
+
+# Per-field alert codes; a reading's code packs two bits per field
+CODE_OK = 0
+CODE_LOW = 1
+CODE_HIGH = 2
+
+# Settings a zone or device may override
+_OVERRIDABLE = ("min", "max", "hysteresis")
+
+
+def _check_field(owner, field, limits):
+    if not isinstance(limits, dict):
+        raise ValueError(f"{owner}: thresholds for {field} must be an object")
+    for key in _OVERRIDABLE:
+        value = limits.get(key)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            raise ValueError(f"{owner}: {field}.{key} must be a number")
+    if limits.get("hysteresis") is not None and limits["hysteresis"] < 0:
+        raise ValueError(f"{owner}: {field}.hysteresis must not be negative")
+
+
+def _check_overrides(owner, overrides, fields):
+    if not isinstance(overrides, dict):
+        raise ValueError(f"{owner}: thresholds must be an object")
+    for field, limits in overrides.items():
+        if field not in fields:
+            raise ValueError(f"{owner}: unknown field {field} (not in defaults)")
+        _check_field(owner, field, limits)
+
+
+def validate_rules(rules):
+    """
+    Check the structure of a rules dict.
+
+    Raises:
+        ValueError: If the rules are malformed or a device names an unknown zone
+    """
+    if not isinstance(rules, dict) or not isinstance(rules.get("defaults"), dict) or not rules["defaults"]:
+        raise ValueError("Threshold rules need a non-empty 'defaults' object")
+    fields = rules["defaults"]
+    for field, limits in fields.items():
+        _check_field("defaults", field, limits)
+
+    zones = rules.get("zones", {})
+    devices = rules.get("devices", {})
+    if not isinstance(zones, dict) or not isinstance(devices, dict):
+        raise ValueError("'zones' and 'devices' must be objects")
+    for name, zone in zones.items():
+        if not isinstance(zone, dict):
+            raise ValueError(f"zone {name} must be an object")
+        _check_overrides(f"zone {name}", zone.get("thresholds", {}), fields)
+    for device_id, device in devices.items():
+        if not isinstance(device, dict):
+            raise ValueError(f"device {device_id} must be an object")
+        zone = device.get("zone")
+        if zone is not None and zone not in zones:
+            raise ValueError(f"device {device_id}: unknown zone {zone}")
+        _check_overrides(f"device {device_id}", device.get("thresholds", {}), fields)
+
+
+def load_rules(path=RULES_FILE):
+    """
+    Read and validate a rules file.
+
+    Returns:
+        dict: The rules
+
+    Raises:
+        OSError: If the file cannot be read
+        ValueError: If it is not valid JSON or not valid rules
+    """
+    with open(path, encoding="utf-8") as f:
+        rules = json.load(f)
+    validate_rules(rules)
+    return rules
+
+
+def resolve_thresholds(rules, device_id=None):
+    """
+    Thresholds that apply to one device: defaults, then its zone's, then its own.
+
+    Returns:
+        dict: field -> {"min", "max", "unit", "hysteresis"}
+    """
+    resolved = {field: dict(limits) for field, limits in rules["defaults"].items()}
+    device = rules.get("devices", {}).get(device_id)
+    if device is None:
+        return resolved
+    layers = []
+    zone = device.get("zone")
+    if zone is not None:
+        layers.append(rules["zones"][zone].get("thresholds", {}))
+    layers.append(device.get("thresholds", {}))
+    for layer in layers:
+        for field, limits in layer.items():
+            for key in _OVERRIDABLE:
+                if key in limits:
+                    resolved[field][key] = limits[key]
+    return resolved
+
+
+class CompiledRules:
+    """Thresholds compiled to lookup tables. Never modified once built."""
+
+    def __init__(self, rules, version=0):
+        """
+        Args:
+            rules (dict): Validated rules (see validate_rules)
+            version (int): Changes whenever the rules change
+        """
+        self.rules = rules
+        self.version = version
+        defaults = rules["defaults"]
+        self.fields = tuple(defaults)
+        self.units = [defaults[f].get("unit", "") for f in self.fields]
+        self.labels = [f.upper().replace("_", " ") for f in self.fields]
+
+        # One table row per distinct set of thresholds; row 0 is the defaults
+        rows = [self._row(resolve_thresholds(rules))]
+        row_index = {rows[0]: 0}
+        self.profiles = {}
+        self.zones = {}
+        for device_id, device in rules.get("devices", {}).items():
+            row = self._row(resolve_thresholds(rules, device_id))
+            if row not in row_index:
+                row_index[row] = len(rows)
+                rows.append(row)
+            self.profiles[device_id] = row_index[row]
+            self.zones[device_id] = device.get("zone")
+
+        table = np.array(rows, dtype=np.float64)  # (rows, fields, 3)
+        self.mins = table[:, :, 0]
+        self.maxs = table[:, :, 1]
+        self.hysteresis = table[:, :, 2]
+        # Weight of each field's code in the packed alert code
+        self.shifts = 4 ** np.arange(len(self.fields), dtype=np.int64)
+
+    def _row(self, thresholds):
+        # Missing limits never alert
+        row = []
+        for field in self.fields:
+            limits = thresholds[field]
+            low, high = limits.get("min"), limits.get("max")
+            row.append((-np.inf if low is None else low,
+                        np.inf if high is None else high,
+                        limits.get("hysteresis") or 0.0))
+        return tuple(row)
+
+    def thresholds_for(self, device_id=None):
+        """
+        Resolved thresholds of a device, for display. Missing limits are None.
+
+        Returns:
+            dict: field -> {"min", "max", "unit", "hysteresis"}
+        """
+        row = self.profiles.get(device_id, 0)
+        result = {}
+        for column, field in enumerate(self.fields):
+            low, high = self.mins[row, column], self.maxs[row, column]
+            result[field] = {
+                "min": None if np.isinf(low) else float(low),
+                "max": None if np.isinf(high) else float(high),
+                "unit": self.units[column],
+                "hysteresis": float(self.hysteresis[row, column])
+            }
+        return result
+
+    def to_dict(self):
+        """Defaults and per-device thresholds, as served to the dashboard."""
+        return {
+            "version": self.version,
+            "defaults": self.thresholds_for(None),
+            "devices": {
+                device_id: dict(zone=self.zones[device_id], thresholds=self.thresholds_for(device_id))
+                for device_id in self.profiles
+            }
+        }
+
+
+class ThresholdResult:
+    """Outcome of checking a batch of readings."""
+
+    __slots__ = ("low", "high", "alerting", "codes", "cleared")
+
+    def __init__(self, low, high, alerting, codes, cleared):
+        self.low = low            # (n, fields) bool: field is in its low alert state
+        self.high = high          # (n, fields) bool: field is in its high alert state
+        self.alerting = alerting  # (n,) bool: any field alerting
+        self.codes = codes        # (n,) int: CODE_* of field i in bits 2i..2i+1
+        self.cleared = cleared    # (n,) bool: first reading back in range after its device alerted
+
+
+class ThresholdEngine:
+    """Checks batches of readings against the compiled rules."""
+
+    def __init__(self, rules=None, path=RULES_FILE, stateful=True, reload_interval=RELOAD_INTERVAL):
+        """
+        Args:
+            rules (dict, optional): Rules to use instead of a file (never reloaded)
+            path (str): Rules file, reloaded when it changes; built-in defaults
+                are used while it does not exist
+            stateful (bool): Apply hysteresis, remembering which fields of each
+                device are alerting. Without it every reading is judged on its own
+            reload_interval (float): Seconds between checks of the rules file
+        """
+        self.stateful = stateful
+        self.reload_interval = reload_interval
+        # device_id -> alert code of its last reading (only alerting devices)
+        self._state = {}
+        self._mtime = None
+        self._next_check = 0.0
+        if rules is not None:
+            validate_rules(rules)
+            self.path = None
+            self._rules = CompiledRules(rules)
+        else:
+            self.path = path
+            self._rules = CompiledRules({"defaults": THRESHOLDS})
+            self.reload_if_changed(force=True)
+
+    @property
+    def rules(self):
+        """The current CompiledRules; replaced as a whole on reload."""
+        return self._rules
+
+    @property
+    def fields(self):
+        return self._rules.fields
+
+    def reload_if_changed(self, force=False):
+        """
+        Reload the rules file if it changed since it was last read. Cheap to
+        call often: the file is only looked at every reload_interval seconds.
+
+        Returns:
+            bool: True if new rules were loaded
+        """
+        if self.path is None:
+            return False
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return False
+        self._next_check = now + self.reload_interval
+
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return False  # No rules file (yet); keep what we have
+        if mtime == self._mtime:
+            return False
+        reloaded = self._mtime is not None
+        self._mtime = mtime
+
+        try:
+            rules = CompiledRules(load_rules(self.path), version=mtime)
+        except (OSError, ValueError) as e:
+            print(f"Could not load threshold rules from {self.path}: {e}. Keeping the previous rules.")
+            return False
+        if rules.fields != self._rules.fields:
+            # Packed codes refer to field positions
+            self._state.clear()
+        self._rules = rules
+        if reloaded:
+            print(f"Reloaded threshold rules from {self.path} "
+                  f"({len(rules.profiles)} device overrides, {len(rules.mins)} distinct threshold sets)")
+        return True
+
+    def to_matrix(self, readings):
+        """
+        Collect the checked fields of reading dicts into an (n, fields) array.
+        Missing or null values become NaN, which never alerts.
+        """
+        fields = self._rules.fields
+        values = np.empty((len(readings), len(fields)), dtype=np.float64)
+        for column, field in enumerate(fields):
+            # None converts to NaN in a float64 array
+            values[:, column] = np.array([reading.get(field) for reading in readings], dtype=np.float64)
+        return values
+
+    def evaluate(self, values, device_ids=None):
+        """
+        Check a batch of values.
+
+        Args:
+            values (np.ndarray): (n, fields) array in the order of self.fields
+            device_ids (list, optional): Device of each row, selecting its thresholds;
+                rows without one use the defaults
+
+        Returns:
+            ThresholdResult: Alert states and codes
+        """
+        rules = self._rules
+        if device_ids is None:
+            device_ids = [None] * len(values)
+        if rules.profiles:
+            # The hot path: one dict hit per reading, then a gather of its thresholds
+            get = rules.profiles.get
+            rows = np.array([get(device_id, 0) for device_id in device_ids], dtype=np.intp)
+            mins, maxs, hysteresis = rules.mins[rows], rules.maxs[rows], rules.hysteresis[rows]
+        else:
+            mins, maxs, hysteresis = rules.mins[0], rules.maxs[0], rules.hysteresis[0]
+
+        shifts = rules.shifts
+        codes = ((values < mins) * CODE_LOW + (values > maxs) * CODE_HIGH) @ shifts
+        cleared = np.zeros(len(codes), dtype=bool)
+        if self.stateful and (self._state or codes.any()):
+            # Alerting fields stay on until back inside the range by the hysteresis;
+            # a missing value keeps a field's state
+            hold = ((values < mins + hysteresis) * CODE_LOW
+                    + (values > maxs - hysteresis) * CODE_HIGH
+                    + np.isnan(values) * (CODE_LOW | CODE_HIGH)) @ shifts
+            codes, cleared = self._apply_hysteresis(device_ids, codes, hold)
+
+        bits = codes[:, None] >> (2 * np.arange(len(rules.fields)))
+        return ThresholdResult((bits & CODE_LOW) != 0, (bits & CODE_HIGH) != 0, codes != 0, codes, cleared)
+
+    def _apply_hysteresis(self, device_ids, enter, hold):
+        # Sequential, as the same device may appear several times in one batch
+        state = self._state
+        codes = []
+        cleared = []
+        for device_id, entered, held in zip(device_ids, enter.tolist(), hold.tolist()):
+            code = entered | (state.get(device_id, 0) & held)
+            if code:
+                state[device_id] = code
+                cleared.append(False)
+            else:
+                cleared.append(state.pop(device_id, None) is not None)
+            codes.append(code)
+        return np.array(codes, dtype=np.int64), np.array(cleared, dtype=bool)
+
+    def format_alerts(self, readings, result):
+        """
+        Build the alert strings for each reading, e.g. "HIGH TEMPERATURE: 36.2°C".
+        Only readings flagged in result.alerting are looked at.
+
+        Returns:
+            list: One list of strings per reading
+        """
+        alerts = [[] for _ in readings]
+        rows = np.flatnonzero(result.alerting)
+        if not len(rows):
+            return alerts
+
+        # Plain Python lists are much faster to walk than NumPy scalars
+        rules = self._rules
+        columns = range(len(rules.fields))
+        for row, low, high in zip(rows.tolist(), result.low[rows].tolist(), result.high[rows].tolist()):
+            reading = readings[row]
+            for column in columns:
+                # A field held in alert by hysteresis may be missing from this reading
+                value = reading.get(rules.fields[column])
+                if (low[column] or high[column]) and value is not None:
+                    level = "HIGH" if high[column] else "LOW"
+                    alerts[row].append(f"{level} {rules.labels[column]}: {value}{rules.units[column]}")
+        return alerts
+
+    def evaluate_readings(self, readings):
+        """Reload the rules if needed and evaluate a list of reading dicts."""
+        self.reload_if_changed()
+        return self.evaluate(self.to_matrix(readings), [reading.get("device_id") for reading in readings])
+
+    def alerting(self, readings):
+        """
+        Returns:
+            list: For each reading, True if any of its fields is alerting
+        """
+        if not readings:
+            return []
+        return self.evaluate_readings(readings).alerting.tolist()
+
+    def needs_alert_route(self, readings):
+        """
+        Which readings a publisher should also send to the alerts queue: the
+        alerting ones, and the first one of a device back in range, so the
+        alert handler sees its alert clear (needs a stateful engine).
+
+        Returns:
+            list: For each reading, True if it goes to the alerts queue
+        """
+        if not readings:
+            return []
+        result = self.evaluate_readings(readings)
+        return (result.alerting | result.cleared).tolist()
+
+    def check_batch(self, readings):
+        """
+        Check a list of reading dicts.
+
+        Returns:
+            list: One list of alert strings per reading (empty if it is in range)
+        """
+        if not readings:
+            return []
+        return self.format_alerts(readings, self.evaluate_readings(readings))
+
+
+# Engine for the rules file, shared by everything in this process
+default_engine = ThresholdEngine()
+
+
+def check_alerts_batch(readings):
+    """Alert strings for each reading in a batch, using the rules file."""
+    return default_engine.check_batch(readings)
+
+
+def check_alerts(data):
+    """Alert strings for one reading, using the rules file."""
+    return default_engine.check_batch([data])[0]
@@ -0,0 +1,205 @@
+"""
+Sparse time-range index for the columnar time-series store.
+
+For every batch the writer flushes, the index gets one entry per device in
+that batch: the segment, the row range the device's readings fall in, and
+the smallest and largest timestamp among them. A range query for one device
+binary-searches these entries and only touches the blocks that overlap the
+requested time window.
+"""
+
+import os
+import threading
+
+import numpy as np
+
+INDEX_FILE = "index.bin"
+
+INDEX_DTYPE = np.dtype([
+    ("device", "<u2"),
+    ("segment", "<u4"),
+    ("start_row", "<u4"),
+    ("end_row", "<u4"),
+    ("min_ts", "<f8"),
+    ("max_ts", "<f8"),
+])
+
+
+def block_entries(segment, first_row, timestamps, devices):
+    """
+    Build index entries for one block of rows.
+
+    Args:
+        segment (int): Segment number the rows were written to
+        first_row (int): Row offset of the block inside the segment
+        timestamps (np.ndarray): Timestamps of the block
+        devices (np.ndarray): Device codes of the block
+
+    Returns:
+        np.ndarray: One INDEX_DTYPE entry per device in the block
+    """
+    # Group the rows by device without a Python loop
+    order = np.argsort(devices, kind="stable")
+    sorted_devices = devices[order]
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(sorted_devices)) + 1))
+
+    entries = np.empty(len(bounds), dtype=INDEX_DTYPE)
+    entries["device"] = sorted_devices[bounds]
+    entries["segment"] = segment
+    entries["start_row"] = first_row + np.minimum.reduceat(order, bounds)
+    entries["end_row"] = first_row + np.maximum.reduceat(order, bounds) + 1
+    sorted_timestamps = timestamps[order]
+    entries["min_ts"] = np.minimum.reduceat(sorted_timestamps, bounds)
+    entries["max_ts"] = np.maximum.reduceat(sorted_timestamps, bounds)
+    return entries
+
+
+class DeviceBlocks:
+    """
+    Index entries for one device, prepared for binary search.
+
+    Entries are kept in a buffer that doubles when it fills up, so new
+    entries are appended in amortized O(1) instead of copying the device's
+    whole history on every refresh.
+    """
+
+    def __init__(self, entries=None):
+        self._count = 0
+        self._buffer = np.empty(0, dtype=INDEX_DTYPE)
+        # Running maximum makes max_ts searchable even if readings arrive out of order
+        self._max_ts_prefix = np.empty(0, dtype=INDEX_DTYPE["max_ts"])
+        self.ordered = True
+        if entries is not None:
+            self.extend(entries)
+
+    @property
+    def entries(self):
+        return self._buffer[:self._count]
+
+    @property
+    def max_ts_prefix(self):
+        return self._max_ts_prefix[:self._count]
+
+    def extend(self, entries):
+        """Append entries written after the ones already held."""
+        if not len(entries):
+            return
+        count = self._count
+        new_count = count + len(entries)
+        if new_count > len(self._buffer):
+            capacity = max(16, 2 * len(self._buffer), new_count)
+            buffer = np.empty(capacity, dtype=INDEX_DTYPE)
+            buffer[:count] = self._buffer[:count]
+            max_ts_prefix = np.empty(capacity, dtype=self._max_ts_prefix.dtype)
+            max_ts_prefix[:count] = self._max_ts_prefix[:count]
+            self._buffer, self._max_ts_prefix = buffer, max_ts_prefix
+
+        self._buffer[count:new_count] = entries
+        prefix = np.maximum.accumulate(entries["max_ts"])
+        if count:
+            prefix = np.maximum(prefix, self._max_ts_prefix[count - 1])
+            self.ordered = self.ordered and bool(entries["min_ts"][0] >= self._buffer["min_ts"][count - 1])
+        self._max_ts_prefix[count:new_count] = prefix
+        self.ordered = self.ordered and bool(np.all(np.diff(entries["min_ts"]) >= 0))
+        # Publish the new entries only once they are complete
+        self._count = new_count
+
+    def find(self, start=None, end=None):
+        """
+        Return the entries whose time range overlaps [start, end].
+        """
+        # Take one snapshot, a refresh may append entries meanwhile
+        count = self._count
+        entries = self._buffer[:count]
+        max_ts_prefix = self._max_ts_prefix[:count]
+
+        first = 0
+        if start is not None:
+            # Every block before `first` ends before the window starts
+            first = int(np.searchsorted(max_ts_prefix, start, side="left"))
+
+        last = count
+        if end is not None and self.ordered:
+            # Blocks are in time order, so everything after `last` starts too late
+            last = int(np.searchsorted(entries["min_ts"], end, side="right"))
+
+        candidates = entries[first:last]
+        if start is not None:
+            candidates = candidates[candidates["max_ts"] >= start]
+        if end is not None:
+            candidates = candidates[candidates["min_ts"] <= end]
+        return candidates
+
+
+class SensorIndex:
+    """
+    Reader for a store's index file. Picks up entries appended by a running
+    writer and adds each one to its device's DeviceBlocks, so a refresh only
+    costs as much as the entries it reads.
+    """
+
+    def __init__(self, path):
+        self.index_path = os.path.join(path, INDEX_FILE)
+        self._size = 0
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Load entries appended since the last call."""
+        try:
+            size = os.path.getsize(self.index_path)
+        except OSError:
+            return
+        # Ignore a partly written trailing entry
+        size -= size % INDEX_DTYPE.itemsize
+        if size <= self._size:
+            return
+
+        # Web server request threads may refresh at the same time
+        with self._lock:
+            if size <= self._size:
+                return
+            with open(self.index_path, "rb") as f:
+                f.seek(self._size)
+                new_entries = np.frombuffer(f.read(size - self._size), dtype=INDEX_DTYPE)
+
+            # Split the new entries by device, keeping write order within each device
+            order = np.argsort(new_entries["device"], kind="stable")
+            grouped = new_entries[order]
+            bounds = np.flatnonzero(np.diff(grouped["device"])) + 1
+            for entries in np.split(grouped, bounds):
+                device_code = int(entries["device"][0])
+                blocks = self._devices.get(device_code)
+                if blocks is None:
+                    self._devices[device_code] = DeviceBlocks(entries)
+                else:
+                    blocks.extend(entries)
+            self._size = size
+
+    def __len__(self):
+        self.refresh()
+        return self._size // INDEX_DTYPE.itemsize
+
+    def device_blocks(self, device_code):
+        """
+        Get the searchable entries for one device.
+
+        Returns:
+            DeviceBlocks: Entries for the device in write order
+        """
+        self.refresh()
+        blocks = self._devices.get(device_code)
+        if blocks is None:
+            with self._lock:
+                blocks = self._devices.setdefault(device_code, DeviceBlocks())
+        return blocks
+
+    def find(self, device_code, start=None, end=None):
+        """Return the index entries for a device that overlap [start, end]."""
+        return self.device_blocks(device_code).find(start, end)
+
+
+def append_entries(index_file, entries):
+    """Append entries to an open index file."""
+    index_file.write(entries.tobytes())
+    index_file.flush()
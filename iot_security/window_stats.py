@@ -0,0 +1,191 @@
+"""
+Streaming window statistics for the topic analyzer.
+
+Each window keeps its samples in preallocated NumPy arrays, so its memory
+is fixed when it is created:
+
+- SlidingWindow: the samples of the last `span` seconds in a ring buffer.
+  Adding a sample writes one slot and drops samples that fell out of the
+  window from the tail, O(1) amortized.
+- TumblingWindow: consecutive, non-overlapping windows aligned to `span`
+  (e.g. each whole minute). A sample writes one slot; when a sample
+  belongs to a later window, the finished one is summarized and reset.
+
+Summaries (count, mean, min, max, p95) are computed with NumPy over the
+samples at hand, only when a summary is asked for. A window that receives
+more samples than its capacity keeps the newest ones and counts the rest
+as dropped.
+"""
+
+import math
+
+import numpy as np
+
+# Samples kept per window
+DEFAULT_CAPACITY = 4096
+
+
+def format_span(seconds):
+    """Short label of a window span: 30s, 1m, 5m, 1h."""
+    seconds = int(seconds)
+    if seconds % 3600 == 0:
+        return f"{seconds // 3600}h"
+    if seconds % 60 == 0:
+        return f"{seconds // 60}m"
+    return f"{seconds}s"
+
+
+def summarize(values):
+    """
+    Statistics of an array of samples.
+
+    Returns:
+        dict: count, mean, min, max and p95 (None values if there are no samples)
+    """
+    if not len(values):
+        return {"count": 0, "mean": None, "min": None, "max": None, "p95": None}
+    return {
+        "count": int(len(values)),
+        "mean": float(values.mean()),
+        "min": float(values.min()),
+        "max": float(values.max()),
+        "p95": float(np.percentile(values, 95))
+    }
+
+
+class SlidingWindow:
+    """Samples of the last `span` seconds in a fixed-size ring buffer."""
+
+    kind = "sliding"
+
+    def __init__(self, span, capacity=DEFAULT_CAPACITY):
+        """
+        Args:
+            span (float): Window length in seconds
+            capacity (int): Most samples kept
+        """
+        self.span = span
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros(capacity, dtype=np.float64)
+        self._start = 0    # Index of the oldest sample
+        self._count = 0
+        self.dropped = 0   # Samples overwritten because the buffer was full
+
+    def __len__(self):
+        return self._count
+
+    def add(self, timestamp, value):
+        """Add a sample. Samples are expected in (roughly) time order."""
+        if self._count == self.capacity:
+            # Full: overwrite the oldest sample
+            self._start = (self._start + 1) % self.capacity
+            self._count -= 1
+            self.dropped += 1
+        end = (self._start + self._count) % self.capacity
+        self.times[end] = timestamp
+        self.values[end] = value
+        self._count += 1
+        self.evict(timestamp)
+
+    def evict(self, now):
+        """Drop samples older than `span` seconds before `now`."""
+        cutoff = now - self.span
+        while self._count and self.times[self._start] <= cutoff:
+            self._start = (self._start + 1) % self.capacity
+            self._count -= 1
+
+    def samples(self):
+        """Values currently in the window, oldest first."""
+        end = self._start + self._count
+        if end <= self.capacity:
+            return self.values[self._start:end]
+        return np.concatenate((self.values[self._start:], self.values[:end - self.capacity]))
+
+    def summary(self, now):
+        """
+        Statistics of the samples in (now - span, now].
+
+        Returns:
+            dict: See summarize(), plus the window's start and end
+        """
+        self.evict(now)
+        result = summarize(self.samples())
+        result.update(start=now - self.span, end=now)
+        return result
+
+
+class TumblingWindow:
+    """Back-to-back windows of `span` seconds, aligned to multiples of span."""
+
+    kind = "tumbling"
+
+    def __init__(self, span, capacity=DEFAULT_CAPACITY):
+        """
+        Args:
+            span (float): Window length in seconds
+            capacity (int): Most samples kept per window
+        """
+        self.span = span
+        self.capacity = capacity
+        self.values = np.zeros(capacity, dtype=np.float64)
+        self.window_start = None
+        self.closed_until = -math.inf   # End of the last summarized window
+        self._count = 0
+        self._seen = 0     # Samples in this window, including overwritten ones
+        self.dropped = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, timestamp, value):
+        """
+        Add a sample.
+
+        Returns:
+            dict: Summary of the window that just finished, or None
+        """
+        start = math.floor(timestamp / self.span) * self.span
+        if start < self.closed_until or (self.window_start is not None and start < self.window_start):
+            # Late sample for a window that was already summarized
+            self.dropped += 1
+            return None
+
+        finished = None
+        if self.window_start is None:
+            self.window_start = start
+        elif start > self.window_start:
+            finished = self.close()
+            self.window_start = start
+
+        # Past capacity, later samples replace earlier ones in turn
+        self.values[self._seen % self.capacity] = value
+        self._seen += 1
+        if self._count < self.capacity:
+            self._count += 1
+        else:
+            self.dropped += 1
+        return finished
+
+    def close_if_due(self, now):
+        """
+        Summarize the current window once `now` is past its end, even if no
+        newer sample arrived to close it.
+
+        Returns:
+            dict: Summary of the finished window, or None
+        """
+        if self.window_start is None or now < self.window_start + self.span:
+            return None
+        finished = self.close()
+        self.window_start = None
+        return finished
+
+    def close(self):
+        """Summarize the current window and start an empty one."""
+        result = summarize(self.values[:self._count])
+        result.update(start=self.window_start, end=self.window_start + self.span)
+        self.closed_until = self.window_start + self.span
+        self._count = 0
+        self._seen = 0
+        return result